@@ -1,6 +1,8 @@
 from passlib.context import CryptContext
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from jose import jwt
+from jose import jwt, JWTError
+import asyncio
 import os
 from dotenv import load_dotenv
 
@@ -11,8 +13,27 @@ SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES"))
 
+# Argon2 cost parameters (defaults match passlib's, so existing hashes stay valid).
+# Changing them makes old hashes "need update"; they are rehashed on next login.
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", "3"))
+ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", "65536"))  # KiB
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", "4"))
+
+# Max Argon2 computations running at once per worker; extra logins queue up
+PASSWORD_HASH_CONCURRENCY = int(os.getenv("PASSWORD_HASH_CONCURRENCY", str(min(4, os.cpu_count() or 1))))
+
 # --- CHANGED: Use argon2 instead of bcrypt ---
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
+pwd_context = CryptContext(
+    schemes=["argon2"],
+    deprecated="auto",
+    argon2__time_cost=ARGON2_TIME_COST,
+    argon2__memory_cost=ARGON2_MEMORY_COST,
+    argon2__parallelism=ARGON2_PARALLELISM
+)
+
+# argon2-cffi releases the GIL while hashing, so a thread pool is enough to
+# keep Argon2 off the event loop (and live games responsive during logins).
+hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_CONCURRENCY, thread_name_prefix="argon2")
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -20,9 +41,39 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+async def verify_password_async(plain_password, hashed_password):
+    """
+    Verifies off the event loop. Returns (is_valid, new_hash); new_hash is set
+    when the stored hash used outdated Argon2 parameters and should be replaced.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(hash_executor, pwd_context.verify_and_update, plain_password, hashed_password)
+
+async def get_password_hash_async(password):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(hash_executor, pwd_context.hash, password)
+
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
\ No newline at end of file
+    return encoded_jwt
+
+def decode_access_token(token: str):
+    """Claims if the signature checks out and it hasn't expired, else None."""
+    try:
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+
+# Browsers can't set headers on a WebSocket, so the token rides along as
+# `?token=<jwt>` or as a `bearer.<jwt>` subprotocol.
+BEARER_SUBPROTOCOL_PREFIX = "bearer."
+
+def websocket_token(websocket):
+    """Returns (token, subprotocol to echo back if the token came that way)."""
+    for offered in websocket.scope.get("subprotocols", []):
+        if offered.startswith(BEARER_SUBPROTOCOL_PREFIX):
+            return offered[len(BEARER_SUBPROTOCOL_PREFIX):], offered
+    return websocket.query_params.get("token"), None
@@ -0,0 +1,130 @@
+"""
+Wire codec for WebSocket messages.
+
+JSON goes through orjson when it's installed (stdlib json otherwise).
+Clients may negotiate MessagePack with `?encoding=msgpack` or the
+`msgpack` subprotocol; those connections get binary frames.
+
+Big payloads sent to several players (GAME_START) are wrapped in a
+`Payload`: the shared part is encoded once per encoding and the small
+per-player fields (e.g. `opponent`) are spliced in per recipient.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:  # optional speed-up
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # MessagePack is opt-in per client
+    msgpack = None
+
+JSON = "json"
+MSGPACK = "msgpack"
+
+
+# --- JSON ---
+if orjson is not None:
+    def dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+
+    def loads(data):
+        return orjson.loads(data)
+else:
+    def dumps(obj) -> str:
+        return json.dumps(obj, separators=(",", ":"))
+
+    def loads(data):
+        return json.loads(data)
+
+
+# --- NEGOTIATION ---
+def available_encodings() -> list[str]:
+    return [JSON, MSGPACK] if msgpack is not None else [JSON]
+
+
+def negotiate(websocket) -> tuple[str, str | None]:
+    """
+    Returns (encoding, subprotocol to accept with).
+    Unknown or unavailable encodings fall back to JSON.
+    """
+    if msgpack is None:
+        return JSON, None
+    if MSGPACK in websocket.scope.get("subprotocols", []):
+        return MSGPACK, MSGPACK
+    if websocket.query_params.get("encoding") == MSGPACK:
+        return MSGPACK, None
+    return JSON, None
+
+
+# --- SHARED PAYLOADS ---
+class Payload:
+    """A message encoded once per encoding; bind() adds per-recipient fields."""
+
+    def __init__(self, shared: dict):
+        self.shared = shared
+        self._json = None
+        self._msgpack = None
+
+    def bind(self, **fields) -> "BoundPayload":
+        return BoundPayload(self, fields)
+
+    def preencode(self):
+        """Encodes the shared part now (e.g. in a background task) instead of on first send."""
+        self.encode_json({})
+        if msgpack is not None:
+            self.encode_msgpack({})
+        return self
+
+    def encode_json(self, fields: dict) -> str:
+        if self._json is None:
+            self._json = dumps(self.shared)
+        if not fields:
+            return self._json
+        # '{"opponent":"bob"' + ',' + '"type":...}'
+        head = dumps(fields)[:-1]
+        return head + ("}" if self._json == "{}" else "," + self._json[1:])
+
+    def encode_msgpack(self, fields: dict) -> bytes:
+        if self._msgpack is None:
+            # Map body without its header, so the entry count can change per recipient
+            packed = msgpack.packb(self.shared)
+            size = len(self.shared)
+            self._msgpack = packed[1 if size < 16 else 3 if size < 65536 else 5:]
+        packer = msgpack.Packer()
+        extra = b"".join(packer.pack(k) + packer.pack(v) for k, v in fields.items())
+        return packer.pack_map_header(len(self.shared) + len(fields)) + extra + self._msgpack
+
+
+class BoundPayload:
+    __slots__ = ("payload", "fields")
+
+    def __init__(self, payload: Payload, fields: dict):
+        self.payload = payload
+        self.fields = fields
+
+    def to_dict(self) -> dict:
+        return {**self.fields, **self.payload.shared}
+
+
+def as_dict(message) -> dict:
+    return message.to_dict() if isinstance(message, BoundPayload) else message
+
+
+def encode(message, encoding: str = JSON) -> str | bytes:
+    """dict or BoundPayload -> str (JSON text frame) or bytes (MessagePack binary frame)."""
+    if isinstance(message, BoundPayload):
+        if encoding == MSGPACK:
+            return message.payload.encode_msgpack(message.fields)
+        return message.payload.encode_json(message.fields)
+    if encoding == MSGPACK:
+        return msgpack.packb(message)
+    return dumps(message)
+
+
+def decode(data: str | bytes, encoding: str = JSON):
+    if encoding == MSGPACK and isinstance(data, (bytes, bytearray)):
+        return msgpack.unpackb(data)
+    return loads(data)
@@ -0,0 +1,277 @@
+import asyncio
+import os
+import time
+from collections import deque
+from fastapi import WebSocket, WebSocketDisconnect
+from dotenv import load_dotenv
+
+from . import presence, codec, metrics
+from .redis_client import get_redis_client
+
+load_dotenv()
+
+# Config
+# Frames a socket may have waiting before we give up on it as too slow
+SEND_QUEUE_MAX = int(os.getenv("SEND_QUEUE_MAX", "64"))
+# Longest a single send may take (seconds) before the socket is dropped
+SEND_DEADLINE_SECONDS = float(os.getenv("SEND_DEADLINE_SECONDS", "5"))
+# App-level PING cadence, and how long a socket may stay silent before it's reaped
+PING_INTERVAL_SECONDS = float(os.getenv("PING_INTERVAL_SECONDS", "15"))
+PONG_TIMEOUT_SECONDS = float(os.getenv("PONG_TIMEOUT_SECONDS", "45"))
+CLOSE_TIMEOUT_SECONDS = 2
+# Message types where only the newest queued copy matters (score snapshots)
+COALESCED_TYPES = {"OPPONENT_UPDATE"}
+
+CONNECTIONS_DROPPED = metrics.Counter(
+    "codeclash_connections_dropped_total", "Sockets closed by the server", ("reason",)
+)
+MESSAGES_COALESCED = metrics.Counter(
+    "codeclash_messages_coalesced_total", "Queued messages replaced by a newer snapshot"
+)
+
+
+class Connection:
+    """
+    One socket plus its outbound queue.
+
+    Senders only enqueue; a per-connection writer task does the actual
+    sends, so one slow or dead client can't stall a game handler or the
+    Redis subscriber. A full queue or a send past its deadline drops it.
+    """
+
+    def __init__(self, websocket: WebSocket, username: str, encoding: str, on_drop):
+        self.websocket = websocket
+        self.username = username
+        self.encoding = encoding
+        self.on_drop = on_drop
+        # [coalesce key or None, frame]; entries are mutable so a newer snapshot can replace a queued one
+        self.outbox: deque[list] = deque()
+        self.pending: dict[str, list] = {}
+        self.ready = asyncio.Event()
+        self.last_seen = time.monotonic()
+        self.closed = False
+        self.writer = asyncio.create_task(self.run_writer())
+
+    def enqueue(self, message) -> bool:
+        if self.closed:
+            return False
+        frame = codec.encode(message, self.encoding)
+
+        key = message.get("type") if isinstance(message, dict) else None
+        if key not in COALESCED_TYPES:
+            key = None
+        elif key in self.pending:
+            self.pending[key][1] = frame
+            MESSAGES_COALESCED.inc()
+            return True
+
+        if len(self.outbox) >= SEND_QUEUE_MAX:
+            self.drop("queue_full")
+            return False
+        entry = [key, frame]
+        self.outbox.append(entry)
+        if key is not None:
+            self.pending[key] = entry
+        self.ready.set()
+        return True
+
+    async def run_writer(self):
+        while True:
+            if not self.outbox:
+                self.ready.clear()
+                await self.ready.wait()
+                continue
+            entry = self.outbox.popleft()
+            key, frame = entry
+            if key is not None and self.pending.get(key) is entry:
+                del self.pending[key]
+
+            send = self.websocket.send_bytes if isinstance(frame, bytes) else self.websocket.send_text
+            try:
+                await asyncio.wait_for(send(frame), SEND_DEADLINE_SECONDS)
+            except asyncio.CancelledError:
+                raise
+            except asyncio.TimeoutError:
+                self.drop("send_timeout")
+                return
+            except Exception:
+                self.drop("send_error")
+                return
+
+    def drop(self, reason: str):
+        """Stops sending and hands the socket back to the manager to close."""
+        if self.closed:
+            return
+        self.closed = True
+        self.outbox.clear()
+        self.pending.clear()
+        if self.writer is not asyncio.current_task():
+            self.writer.cancel()
+        CONNECTIONS_DROPPED.inc(reason)
+        print(f"✂️ Dropping {self.username}'s socket ({reason})")
+        self.on_drop(self)
+
+    def stop(self):
+        self.closed = True
+        self.writer.cancel()
+
+
+# --- UPGRADED CONNECTION MANAGER ---
+class ConnectionManager:
+    """
+    Local sockets first; anything else is routed through Redis.
+
+    Each worker subscribes to its own `node:{NODE_ID}` channel. To reach a
+    user connected elsewhere we look up `presence:{username}` and publish to
+    the owning worker's channel, whose subscriber task delivers it locally.
+    """
+
+    def __init__(self):
+        # Dictionary: Maps "username" -> Connection (socket + outbound queue)
+        self.active_connections: dict[str, Connection] = {}
+        self.tasks: list[asyncio.Task] = []
+        # Close handshakes for dropped sockets, kept so they aren't garbage-collected mid-flight
+        self.closing: set[asyncio.Task] = set()
+
+    async def connect(self, websocket: WebSocket, username: str, subprotocol: str | None = None):
+        # `subprotocol` is the fallback to accept with if the codec didn't pick one
+        # (a client that offered only a bearer token still needs one echoed back)
+        encoding, negotiated = codec.negotiate(websocket)
+        await websocket.accept(subprotocol=negotiated or subprotocol)
+        conn = Connection(websocket, username, encoding, self._on_drop)
+        websocket.state.connection = conn
+        previous = self.active_connections.get(username)
+        self.active_connections[username] = conn
+        await presence.register(username)
+        # One socket per user: an older one here is closed (its handler then exits on the close)
+        if previous is not None:
+            previous.drop("replaced")
+
+    async def disconnect(self, username: str, websocket: WebSocket | None = None):
+        conn = getattr(websocket.state, "connection", None) if websocket is not None else None
+        if conn is not None:
+            conn.stop()
+        # A newer socket for the same user may have replaced this one; leave it alone
+        if websocket is not None and self.active_connections.get(username) is not conn:
+            return
+        conn = self.active_connections.pop(username, None)
+        if conn is not None:
+            conn.stop()
+        await presence.unregister(username)
+
+    def _on_drop(self, conn: Connection):
+        task = asyncio.create_task(self._close_dropped(conn))
+        self.closing.add(task)
+        task.add_done_callback(self.closing.discard)
+
+    async def _close_dropped(self, conn: Connection):
+        # Forget the user right away so sends stop landing here; the handler's
+        # receive() then sees the close and runs its usual cleanup
+        if self.active_connections.get(conn.username) is conn:
+            del self.active_connections[conn.username]
+            try:
+                await presence.unregister(conn.username)
+            except Exception as e:
+                print(f"❌ Presence cleanup for {conn.username} failed: {e}")
+        try:
+            await asyncio.wait_for(conn.websocket.close(code=1008), CLOSE_TIMEOUT_SECONDS)
+        except Exception:
+            pass
+
+    async def receive(self, websocket: WebSocket, username: str) -> dict:
+        """Next client message, decoded with the connection's encoding."""
+        frame = await websocket.receive()
+        if frame["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(frame.get("code", 1000))
+        conn = websocket.state.connection
+        # Any frame (a PONG or a real message) proves the client is alive
+        conn.last_seen = time.monotonic()
+        data = frame.get("text")
+        if data is None:
+            data = frame.get("bytes")
+        return codec.decode(data, conn.encoding)
+
+    async def deliver_local(self, message, username: str) -> bool:
+        """message: a dict or a codec.BoundPayload (shared part already encoded). Never waits on the socket."""
+        conn = self.active_connections.get(username)
+        if conn is None:
+            return False
+        return conn.enqueue(message)
+
+    async def send_personal_message(self, message, username: str) -> bool:
+        if await self.deliver_local(message, username):
+            return True
+        # Not on this worker: hand it to whichever worker owns the socket,
+        # which re-encodes it for that client's negotiated encoding
+        return await presence.route(username, codec.dumps({"to": username, "message": codec.as_dict(message)}))
+
+    # Inside ConnectionManager class
+    async def broadcast_to_user(self, message, username: str) -> bool:
+        return await self.send_personal_message(message, username)
+
+    # --- BACKGROUND TASKS (started from lifespan) ---
+    async def run_subscriber(self):
+        """Delivers messages other workers published for our local users."""
+        redis = get_redis_client()
+        pubsub = redis.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(presence.node_channel())
+        try:
+            while True:
+                try:
+                    item = await pubsub.get_message(timeout=1.0)
+                    if item is None:
+                        continue
+                    envelope = codec.loads(item["data"])
+                    await self.deliver_local(envelope["message"], envelope["to"])
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"❌ Failed to deliver routed message: {e}")
+        finally:
+            await pubsub.unsubscribe()
+            await pubsub.aclose()
+
+    async def run_heartbeat(self):
+        """Keeps presence keys alive for every socket this worker holds."""
+        while True:
+            await asyncio.sleep(presence.PRESENCE_HEARTBEAT_SECONDS)
+            try:
+                stale = await presence.heartbeat(self.active_connections.keys())
+            except Exception as e:
+                print(f"❌ Presence heartbeat failed: {e}")
+                continue
+            # Reconnected on another worker: the socket here is dead weight
+            for username in stale:
+                conn = self.active_connections.get(username)
+                if conn is not None:
+                    conn.drop("replaced")
+
+    async def run_pinger(self):
+        """PINGs every local socket and reaps the ones that stopped answering."""
+        while True:
+            await asyncio.sleep(PING_INTERVAL_SECONDS)
+            now = time.monotonic()
+            for conn in list(self.active_connections.values()):
+                if now - conn.last_seen > PONG_TIMEOUT_SECONDS:
+                    conn.drop("heartbeat")
+                else:
+                    conn.enqueue({"type": "PING"})
+
+    def start(self):
+        self.tasks = [
+            asyncio.create_task(self.run_subscriber()),
+            asyncio.create_task(self.run_heartbeat()),
+            asyncio.create_task(self.run_pinger())
+        ]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        # Let other workers know these users are gone right away instead of waiting for the TTL
+        for username, conn in list(self.active_connections.items()):
+            conn.stop()
+            await presence.unregister(username)
+
+manager = ConnectionManager()
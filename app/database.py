@@ -1,6 +1,9 @@
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
+import asyncio
 import os
+from contextlib import AsyncExitStack
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -8,8 +11,46 @@ load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+# --- ENGINE PROFILE ---
+# SQL logging is synchronous and per statement: debugging only
+DB_ECHO = os.getenv("DB_ECHO", "false").lower() in ("1", "true", "yes")
+# Connections kept open per worker, plus how many extra may be opened under a burst
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+# Seconds to wait for a free connection before erroring
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Recycle connections older than this (seconds), before a proxy / firewall cuts them
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# Check each connection on checkout (one cheap round trip) so a dropped one is replaced, not raised
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+# asyncpg: prepared statements cached per connection; set 0 behind PgBouncer in transaction mode
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "500"))
+# Connections opened (and checked) at startup so the first requests don't pay for the handshakes
+DB_WARM_CONNECTIONS = int(os.getenv("DB_WARM_CONNECTIONS", str(DB_POOL_SIZE)))
+# Run metadata.create_all on boot (dev convenience); production runs create_schema.py once instead
+DB_CREATE_ALL = os.getenv("DB_CREATE_ALL", "false").lower() in ("1", "true", "yes")
+
+
+def engine_options(url: str, echo: bool = DB_ECHO, pool_pre_ping: bool = DB_POOL_PRE_PING) -> dict:
+    """create_async_engine kwargs for `url`; SQLite (tests, benchmarks) keeps its default pool."""
+    options = {"echo": echo}
+    if url.startswith("sqlite"):
+        return options
+
+    options.update(
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=pool_pre_ping
+    )
+    if "+asyncpg" in url:
+        options["connect_args"] = {"prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE}
+    return options
+
+
 # Create the Async Engine
-engine = create_async_engine(DATABASE_URL, echo=True) # echo=True logs SQL for debugging
+engine = create_async_engine(DATABASE_URL, **engine_options(DATABASE_URL))
 
 # Create the Session Maker
 SessionLocal = async_sessionmaker(
@@ -25,4 +66,21 @@ class Base(DeclarativeBase):
 # Dependency Injection function
 async def get_db():
     async with SessionLocal() as session:
-        yield session
\ No newline at end of file
+        yield session
+
+
+async def warm_up(connections: int = DB_WARM_CONNECTIONS) -> int:
+    """
+    Opens `connections` pooled connections at once and runs SELECT 1 on each,
+    so TCP/TLS/auth handshakes happen before traffic, not on the first requests.
+    Raises if the database is unreachable: better to fail the boot than serve errors.
+    """
+    count = 1 if DATABASE_URL.startswith("sqlite") else min(connections, DB_POOL_SIZE)
+    if count <= 0:
+        return 0
+    # All held at once, or the pool would keep handing back the same connection
+    # (capped at pool_size: overflow connections are closed when returned)
+    async with AsyncExitStack() as stack:
+        conns = await asyncio.gather(*(stack.enter_async_context(engine.connect()) for _ in range(count)))
+        await asyncio.gather(*(conn.execute(text("SELECT 1")) for conn in conns))
+    return count
@@ -0,0 +1,179 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+from dotenv import load_dotenv
+
+from . import codec, metrics
+from .game_utils import question_to_dict
+from .question_sampler import question_sampler, DEFAULT_QUOTAS
+
+load_dotenv()
+
+# Config
+QUESTIONS_PER_DECK = 10
+TIMER_PER_QUESTION = 15
+# Ready decks kept per category mix, and the depth that triggers a refill
+DECK_POOL_SIZE = int(os.getenv("DECK_POOL_SIZE", "64"))
+DECK_POOL_LOW_WATER = int(os.getenv("DECK_POOL_LOW_WATER", "16"))
+# The producer also wakes up this often (seconds) to notice a reseeded bank
+DECK_POOL_CHECK_SECONDS = float(os.getenv("DECK_POOL_CHECK_SECONDS", "5"))
+# How many player pairs (and decks per pair) we remember to avoid repeats
+DECK_POOL_PAIR_HISTORY = int(os.getenv("DECK_POOL_PAIR_HISTORY", "10000"))
+DECKS_REMEMBERED_PER_PAIR = 5
+
+DECK_REFILL_SECONDS = metrics.Histogram(
+    "codeclash_deck_refill_seconds", "Time to build one batch of question decks"
+)
+DECK_POOL_MISSES = metrics.Counter(
+    "codeclash_deck_pool_misses_total", "Match starts that had to build a deck inline"
+)
+
+
+class Deck:
+    __slots__ = ("fingerprint", "payload", "answer_key")
+
+    def __init__(self, questions: list[dict], answer_key: list[tuple[int, str]]):
+        # Same questions in any order = same deck
+        self.fingerprint = hash(frozenset(q["id"] for q in questions))
+        # [(question_id, correct letter), ...] in deck order; stays server-side
+        self.answer_key = answer_key
+        # Everything but game_id/opponent, encoded ahead of time
+        self.payload = codec.Payload({
+            "type": "GAME_START",
+            "questions": questions,
+            "config": {
+                "question_count": len(questions),
+                "timer_per_question": TIMER_PER_QUESTION
+            }
+        }).preencode()
+
+
+class DeckPool:
+    """
+    Ready-to-send GAME_START decks, kept warm by a background producer.
+
+    Match start pops a deck (no DB round trip); when a mix drops below the
+    low-water mark the producer builds the missing decks in one batch: ids
+    for all of them are drawn from the sampler's index and fetched with a
+    single primary-key query. Decks are per worker, like the sampler's id index.
+    """
+
+    def __init__(self, size: int = DECK_POOL_SIZE, low_water: int = DECK_POOL_LOW_WATER):
+        self.size = size
+        self.low_water = low_water
+        # mix key -> ready decks; the default mix is always kept warm
+        self.pools: dict[tuple, deque] = {self.mix_key(DEFAULT_QUOTAS): deque()}
+        # (player, player) -> fingerprints of their recent decks
+        self.recent: OrderedDict[tuple, deque] = OrderedDict()
+        self.bank_version = None
+        self.wakeup = asyncio.Event()
+        self.task: asyncio.Task | None = None
+
+    @staticmethod
+    def mix_key(quotas: dict[str, int] | None) -> tuple:
+        return tuple(sorted((quotas or {}).items()))
+
+    def depth(self) -> int:
+        return sum(len(pool) for pool in self.pools.values())
+
+    async def build(self, count: int, mix: tuple) -> list[Deck]:
+        """Builds `count` decks for one category mix with a single DB query."""
+        started = time.perf_counter()
+        await question_sampler.ensure_fresh()
+        id_lists = [question_sampler.draw_ids(QUESTIONS_PER_DECK, dict(mix)) for _ in range(count)]
+        rows = await question_sampler.fetch([qid for ids in id_lists for qid in ids])
+        decks = []
+        for ids in id_lists:
+            # A row can vanish between index refreshes (reseed); just skip it
+            questions = [rows[qid] for qid in ids if qid in rows]
+            decks.append(Deck(
+                [question_to_dict(q) for q in questions],
+                [(q.id, q.correct_option) for q in questions]
+            ))
+        DECK_REFILL_SECONDS.observe(time.perf_counter() - started)
+        return [deck for deck in decks if deck.payload.shared["questions"]]
+
+    async def refill(self):
+        await question_sampler.ensure_fresh()
+        # Reseeded bank: decks may reference deleted questions, start over
+        if question_sampler.version != self.bank_version:
+            self.bank_version = question_sampler.version
+            for pool in self.pools.values():
+                pool.clear()
+
+        for mix, pool in list(self.pools.items()):
+            if len(pool) < max(self.low_water, 1):
+                pool.extend(await self.build(self.size - len(pool), mix))
+
+    def _pair_key(self, players) -> tuple:
+        return tuple(sorted(players))
+
+    def _remember(self, players, deck: Deck):
+        key = self._pair_key(players)
+        history = self.recent.pop(key, None) or deque(maxlen=DECKS_REMEMBERED_PER_PAIR)
+        history.append(deck.fingerprint)
+        self.recent[key] = history
+        while len(self.recent) > DECK_POOL_PAIR_HISTORY:
+            self.recent.popitem(last=False)
+
+    async def take(self, players, quotas: dict[str, int] | None = None) -> Deck:
+        """A fresh deck for this pair: never one they've recently played."""
+        mix = self.mix_key(DEFAULT_QUOTAS if quotas is None else quotas)
+        pool = self.pools.setdefault(mix, deque())
+        seen = self.recent.get(self._pair_key(players), ())
+
+        deck = None
+        # Skip (and keep) decks this pair just played; only look a few deep
+        for i in range(min(len(pool), DECKS_REMEMBERED_PER_PAIR + 1)):
+            if pool[i].fingerprint not in seen:
+                deck = pool[i]
+                del pool[i]
+                break
+
+        if len(pool) < self.low_water:
+            self.wakeup.set()
+
+        if deck is None:
+            # Pool ran dry (or only had repeats): build one inline like before
+            DECK_POOL_MISSES.inc()
+            for _ in range(3):
+                built = await self.build(1, mix)
+                if built and built[0].fingerprint not in seen:
+                    deck = built[0]
+                    break
+            if deck is None:
+                # Tiny bank: a repeat beats not starting the game
+                deck = built[0] if built else Deck([], [])
+
+        self._remember(players, deck)
+        return deck
+
+    async def run(self):
+        while True:
+            # Cleared first so a take() during the refill still wakes us again
+            self.wakeup.clear()
+            try:
+                await self.refill()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Deck pool refill failed: {e}")
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), DECK_POOL_CHECK_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+
+deck_pool = DeckPool()
+
+metrics.Gauge("codeclash_deck_pool_depth", "Ready question decks on this worker", collect=deck_pool.depth)
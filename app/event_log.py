@@ -0,0 +1,276 @@
+"""
+Append-only game event log.
+
+Handlers call `event_log.emit(...)`, which only appends to an in-memory
+buffer; a background publisher ships the buffer to a capped Redis Stream
+with pipelined XADDs. An `EventConsumer` on every worker reads the stream
+through one consumer group and bulk-loads batches into `game_events`,
+acknowledging them only after the commit.
+
+Per-question difficulty and answer times then come straight from SQL, e.g.
+
+    SELECT question_id, avg(correct::int), percentile_cont(0.5)
+           WITHIN GROUP (ORDER BY latency_ms)
+    FROM game_events WHERE event_type = 'ANSWER' GROUP BY question_id;
+"""
+import asyncio
+import os
+import time
+from collections import deque
+from datetime import datetime, timezone
+from sqlalchemy.dialects import postgresql, sqlite
+from redis.exceptions import ResponseError
+from dotenv import load_dotenv
+
+from . import models, database, metrics
+from .presence import NODE_ID
+from .redis_client import get_redis_client
+
+load_dotenv()
+
+# Config
+EVENT_STREAM_KEY = "events:game"
+EVENT_CONSUMER_GROUP = "analytics"
+# Approximate cap on the stream (XADD MAXLEN ~); older entries are trimmed
+EVENT_STREAM_MAXLEN = int(os.getenv("EVENT_STREAM_MAXLEN", "1000000"))
+# Publisher: ship when this many events are buffered, or at least this often (seconds)
+EVENT_LOG_FLUSH_SIZE = int(os.getenv("EVENT_LOG_FLUSH_SIZE", "200"))
+EVENT_LOG_FLUSH_INTERVAL_SECONDS = float(os.getenv("EVENT_LOG_FLUSH_INTERVAL_SECONDS", "0.5"))
+# Events held in memory while Redis is slow; beyond this new events are dropped
+EVENT_LOG_MAX_BUFFER = int(os.getenv("EVENT_LOG_MAX_BUFFER", "50000"))
+# Consumer: events per bulk insert, and how long an entry may sit unacked on a
+# dead worker before another consumer claims it (seconds)
+EVENT_CONSUMER_BATCH = int(os.getenv("EVENT_CONSUMER_BATCH", "500"))
+EVENT_CONSUMER_CLAIM_IDLE_SECONDS = float(os.getenv("EVENT_CONSUMER_CLAIM_IDLE_SECONDS", "60"))
+EVENT_CONSUMER_ENABLED = os.getenv("EVENT_CONSUMER_ENABLED", "true").lower() in ("1", "true", "yes")
+EVENT_CONSUMER_BLOCK_MS = 1000
+# Consumers are named per process, so every restart leaves one behind; those idle
+# this long with nothing pending are removed from the group (seconds)
+EVENT_CONSUMER_PRUNE_IDLE_SECONDS = float(os.getenv("EVENT_CONSUMER_PRUNE_IDLE_SECONDS", "3600"))
+# Pause after an empty read, so a server that doesn't honour BLOCK can't make this spin
+EVENT_CONSUMER_IDLE_SECONDS = 0.2
+
+EVENTS_DROPPED = metrics.Counter(
+    "codeclash_events_dropped_total", "Game events lost before reaching the stream", ("reason",)
+)
+EVENTS_PUBLISHED = metrics.Counter("codeclash_events_published_total", "Game events added to the stream")
+EVENTS_LOADED = metrics.Counter("codeclash_events_loaded_total", "Game events loaded into Postgres")
+EVENT_LOAD_SECONDS = metrics.Histogram(
+    "codeclash_event_load_seconds", "Time to bulk-load one batch of game events"
+)
+
+
+class EventLog:
+    """Fire-and-forget producer: emit() never awaits, never raises."""
+
+    def __init__(self, flush_size: int = EVENT_LOG_FLUSH_SIZE,
+                 flush_interval: float = EVENT_LOG_FLUSH_INTERVAL_SECONDS,
+                 max_buffer: int = EVENT_LOG_MAX_BUFFER):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.buffer: deque[dict] = deque()
+        self.wakeup = asyncio.Event()
+        self.task: asyncio.Task | None = None
+
+    def emit(self, event_type: str, game_id: str, **fields):
+        """fields: username, opponent, question_id, answer, correct, latency_ms, score (any subset)."""
+        if len(self.buffer) >= self.max_buffer:
+            EVENTS_DROPPED.inc("buffer_full")
+            return
+        event = {"type": event_type, "game_id": game_id, "ts": int(time.time() * 1000)}
+        for name, value in fields.items():
+            if value is not None:
+                # Stream fields are flat strings
+                event[name] = int(value) if isinstance(value, bool) else value
+        self.buffer.append(event)
+        if len(self.buffer) >= self.flush_size:
+            self.wakeup.set()
+
+    async def flush(self):
+        if not self.buffer:
+            return
+        batch = [self.buffer.popleft() for _ in range(len(self.buffer))]
+        redis = get_redis_client()
+        try:
+            async with redis.pipeline(transaction=False) as pipe:
+                for event in batch:
+                    pipe.xadd(EVENT_STREAM_KEY, event, maxlen=EVENT_STREAM_MAXLEN, approximate=True)
+                await pipe.execute()
+            EVENTS_PUBLISHED.inc(amount=len(batch))
+        except Exception as e:
+            # Analytics must never hold up games: count the loss and move on
+            EVENTS_DROPPED.inc("publish_failed", amount=len(batch))
+            print(f"❌ Failed to publish {len(batch)} game events: {e}")
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Ships whatever is still buffered (called from lifespan)."""
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        await self.flush()
+
+
+def _to_row(stream_id: str, event: dict) -> dict:
+    def number(name):
+        value = event.get(name)
+        return int(value) if value not in (None, "") else None
+
+    correct = number("correct")
+    return {
+        "stream_id": stream_id,
+        "event_type": event.get("type", ""),
+        "game_id": event.get("game_id", ""),
+        "username": event.get("username"),
+        "opponent": event.get("opponent"),
+        "question_id": number("question_id"),
+        "answer": (event.get("answer") or "")[:1] or None,
+        "correct": None if correct is None else bool(correct),
+        "latency_ms": number("latency_ms"),
+        "score": number("score"),
+        "occurred_at": datetime.fromtimestamp(int(event.get("ts", 0)) / 1000, tz=timezone.utc)
+    }
+
+
+class EventConsumer:
+    """
+    Loads the stream into Postgres. Every worker runs one consumer in the
+    same group, so each entry is loaded by one of them; entries stuck on a
+    dead worker (or left by a failed load) are claimed after
+    EVENT_CONSUMER_CLAIM_IDLE_SECONDS.
+    Delivery is at-least-once, and `stream_id` is unique, so replays are skipped.
+    """
+
+    def __init__(self, batch_size: int = EVENT_CONSUMER_BATCH, name: str = NODE_ID):
+        self.batch_size = batch_size
+        self.name = name
+        self.task: asyncio.Task | None = None
+        self.loaded = 0
+
+    async def ensure_group(self):
+        redis = get_redis_client()
+        try:
+            await redis.xgroup_create(EVENT_STREAM_KEY, EVENT_CONSUMER_GROUP, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def load(self, entries: list) -> int:
+        """Bulk-inserts one batch (skipping ids already loaded), then XACKs it."""
+        if not entries:
+            return 0
+        started = time.perf_counter()
+        rows = [_to_row(stream_id, event) for stream_id, event in entries if event]
+
+        inserted = 0
+        if rows:
+            # One statement, and a replay racing another consumer can't fail the batch
+            dialect = postgresql if database.engine.dialect.name == "postgresql" else sqlite
+            async with database.SessionLocal() as session:
+                result = await session.execute(
+                    dialect.insert(models.GameEvent)
+                    .values(rows)
+                    .on_conflict_do_nothing(index_elements=["stream_id"])
+                    .returning(models.GameEvent.id)
+                )
+                inserted = len(result.all())
+                await session.commit()
+
+        redis = get_redis_client()
+        await redis.xack(EVENT_STREAM_KEY, EVENT_CONSUMER_GROUP, *[stream_id for stream_id, _ in entries])
+        EVENT_LOAD_SECONDS.observe(time.perf_counter() - started)
+        EVENTS_LOADED.inc(amount=inserted)
+        self.loaded += inserted
+        return inserted
+
+    async def read(self, stream_id: str, block: int | None = None) -> list:
+        redis = get_redis_client()
+        reply = await redis.xreadgroup(
+            EVENT_CONSUMER_GROUP, self.name, {EVENT_STREAM_KEY: stream_id},
+            count=self.batch_size, block=block
+        )
+        return reply[0][1] if reply else []
+
+    async def claim_stale(self) -> list:
+        """Entries another (probably dead) consumer read but never acknowledged."""
+        redis = get_redis_client()
+        reply = await redis.xautoclaim(
+            EVENT_STREAM_KEY, EVENT_CONSUMER_GROUP, self.name,
+            min_idle_time=int(EVENT_CONSUMER_CLAIM_IDLE_SECONDS * 1000), start_id="0-0", count=self.batch_size
+        )
+        return reply[1] if reply else []
+
+    async def prune_consumers(self) -> int:
+        """Removes consumers of exited workers: long idle, nothing pending (so nothing is lost)."""
+        redis = get_redis_client()
+        idle_ms = EVENT_CONSUMER_PRUNE_IDLE_SECONDS * 1000
+        removed = 0
+        for consumer in await redis.xinfo_consumers(EVENT_STREAM_KEY, EVENT_CONSUMER_GROUP):
+            if consumer["name"] != self.name and consumer["pending"] == 0 and consumer["idle"] >= idle_ms:
+                await redis.xgroup_delconsumer(EVENT_STREAM_KEY, EVENT_CONSUMER_GROUP, consumer["name"])
+                removed += 1
+        return removed
+
+    async def run(self):
+        grouped = False
+        last_claim = time.monotonic()
+        while True:
+            try:
+                if not grouped:
+                    await self.ensure_group()
+                    grouped = True
+                # New entries, blocking briefly when the stream is idle
+                entries = await self.read(">", block=EVENT_CONSUMER_BLOCK_MS)
+                await self.load(entries)
+                if not entries:
+                    await asyncio.sleep(EVENT_CONSUMER_IDLE_SECONDS)
+
+                # Now and then, adopt what a dead worker (or a failed load) left unacked
+                if time.monotonic() - last_claim >= EVENT_CONSUMER_CLAIM_IDLE_SECONDS:
+                    last_claim = time.monotonic()
+                    await self.load(await self.claim_stale())
+                    await self.prune_consumers()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Event consumer failed: {e}")
+                await asyncio.sleep(1)
+
+    def start(self):
+        if EVENT_CONSUMER_ENABLED:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Leaves the group on shutdown, unless entries are still pending on us (they get claimed)."""
+        if not self.task:
+            return
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        self.task = None
+        try:
+            redis = get_redis_client()
+            for consumer in await redis.xinfo_consumers(EVENT_STREAM_KEY, EVENT_CONSUMER_GROUP):
+                if consumer["name"] == self.name and consumer["pending"] == 0:
+                    await redis.xgroup_delconsumer(EVENT_STREAM_KEY, EVENT_CONSUMER_GROUP, self.name)
+        except Exception as e:
+            print(f"❌ Could not remove event consumer {self.name}: {e}")
+
+
+event_log = EventLog()
+event_consumer = EventConsumer()
+
+metrics.Gauge("codeclash_event_log_buffer_depth", "Game events waiting to be published",
+              collect=lambda: len(event_log.buffer))
@@ -1,32 +1,338 @@
+import asyncio
+import os
+import time
+from dotenv import load_dotenv
+
 from .redis_client import get_redis_client
+from . import metrics
+from .metrics import redis_timed
+
+load_dotenv()
+
+# Every game key expires this long (seconds) after its last activity, so games
+# abandoned mid-way (disconnects, crashed workers) can't leak memory.
+GAME_TTL_SECONDS = int(os.getenv("GAME_TTL_SECONDS", "900"))
+# How often the reaper prunes games:active of games whose key has expired
+GAME_REAPER_INTERVAL_SECONDS = float(os.getenv("GAME_REAPER_INTERVAL_SECONDS", "60"))
+GAME_REAPER_BATCH = 500
+
+# Sorted set: member = game_id, score = start time. Backs the in-flight games gauge.
+ACTIVE_GAMES_KEY = "games:active"
+# Sorted set: member = username, score = when their forfeit falls due (disconnected mid-game)
+PENDING_FORFEITS_KEY = "forfeits:pending"
+
+GAME_KEYS_RECLAIMED = metrics.Counter(
+    "codeclash_game_keys_reclaimed_total", "Abandoned games whose state expired via TTL"
+)
+
+# ALL per-game state lives in ONE hash, game:{game_id}:
+#   p1, p2               -> the two players (the server's truth, not the client's)
+#   q:{question_id}      -> "{index}{letter}", e.g. "3B" = 4th question, answer B
+#   answered:{username}  -> bitmask of question indexes this player already answered
+#   score:{username}     -> points so far
+#   finished:{username}  -> present once the player sent FINISH_GAME
+#   over                 -> set by whichever of finish / forfeit ends the game (exactly once)
+#   started              -> GAME_START time (ms)
+#   last:{username}      -> time (ms) of the player's last (non-duplicate) answer, for answer latency
+def game_key(game_id: str) -> str:
+    return f"game:{game_id}"
+
+# player:{username} -> the game they're in, so a reconnect (or a disconnect) can find it
+def player_key(username: str) -> str:
+    return f"player:{username}"
+
+# Checks, dedupes and scores one answer in ONE round trip; refreshes the TTLs.
+# KEYS[1] = game:{gid}, KEYS[2] = player:{username}
+# ARGV = username, question_id, answer letter, points, ttl, now (ms)
+# Returns {status, correct_option, score, opponent, latency_ms}; latency is measured
+# from the player's previous answer (or GAME_START). status is one of
+# CORRECT / WRONG / DUPLICATE / NO_GAME / NOT_PLAYER / UNKNOWN_QUESTION
+ANSWER_SCRIPT = """
+local user = ARGV[1]
+local fields = redis.call('HMGET', KEYS[1], 'p1', 'p2', 'q:' .. ARGV[2], 'answered:' .. user, 'score:' .. user,
+                          'last:' .. user, 'started')
+local p1, p2, entry = fields[1], fields[2], fields[3]
+local mask, score = tonumber(fields[4]) or 0, tonumber(fields[5]) or 0
+if not p1 then
+    return {'NO_GAME', '', 0, '', 0}
+end
+
+local opponent
+if user == p1 then
+    opponent = p2
+elseif user == p2 then
+    opponent = p1
+else
+    return {'NOT_PLAYER', '', 0, '', 0}
+end
+if not entry then
+    return {'UNKNOWN_QUESTION', '', 0, opponent, 0}
+end
+
+local bit = 2 ^ tonumber(string.sub(entry, 1, -2))
+local correct = string.sub(entry, -1)
+
+-- One attempt per question, right or wrong
+if math.floor(mask / bit) % 2 == 1 then
+    return {'DUPLICATE', correct, score, opponent, 0}
+end
+local now = tonumber(ARGV[6])
+local latency = math.max(now - (tonumber(fields[6]) or tonumber(fields[7]) or now), 0)
+redis.call('HSET', KEYS[1], 'answered:' .. user, mask + bit, 'last:' .. user, now)
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+redis.call('EXPIRE', KEYS[2], ARGV[5])
 
-async def update_score(game_id: str, username: str, points: int = 10):
-    """Increments the player's score in Redis."""
+if ARGV[3] == correct then
+    score = redis.call('HINCRBY', KEYS[1], 'score:' .. user, tonumber(ARGV[4]))
+    return {'CORRECT', correct, score, opponent, latency}
+end
+return {'WRONG', correct, score, opponent, latency}
+"""
+
+# Marks a player finished and, for the call that completes the game, hands
+# back the final scores, all in ONE round trip.
+# KEYS[1] = game:{gid}; ARGV = username, ttl
+# Returns {} for unknown games / non-players, else
+# {completed (1 only for the call that finished the game), p1, p2, score1, score2}
+FINISH_SCRIPT = """
+local players = redis.call('HMGET', KEYS[1], 'p1', 'p2')
+local p1, p2 = players[1], players[2]
+if not p1 or (ARGV[1] ~= p1 and ARGV[1] ~= p2) then
+    return {}
+end
+
+local newly = redis.call('HSETNX', KEYS[1], 'finished:' .. ARGV[1], 1)
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+local done = redis.call('HMGET', KEYS[1], 'finished:' .. p1, 'finished:' .. p2, 'score:' .. p1, 'score:' .. p2)
+local completed = 0
+if newly == 1 and done[1] and done[2] and redis.call('HSETNX', KEYS[1], 'over', 1) == 1 then
+    completed = 1
+end
+return {completed, p1, p2, done[3] or '0', done[4] or '0'}
+"""
+
+# Ends the game as a forfeit by ARGV[1], unless they already finished or the
+# game is over. KEYS[1] = game:{gid}
+# Returns {} if nothing to forfeit, else {p1, p2, score1, score2}
+FORFEIT_SCRIPT = """
+local f = redis.call('HMGET', KEYS[1], 'p1', 'p2', 'finished:' .. ARGV[1], 'over')
+local p1, p2 = f[1], f[2]
+if not p1 or (ARGV[1] ~= p1 and ARGV[1] ~= p2) or f[3] or f[4] then
+    return {}
+end
+redis.call('HSET', KEYS[1], 'over', 1)
+local scores = redis.call('HMGET', KEYS[1], 'score:' .. p1, 'score:' .. p2)
+return {p1, p2, scores[1] or '0', scores[2] or '0'}
+"""
+
+# Schedules a forfeit for a player who dropped mid-game (no-op if they have
+# no unfinished game). KEYS[1] = player:{user}, KEYS[2] = forfeits:pending
+# ARGV = username, due time, game key prefix. Returns the game id or false.
+SCHEDULE_FORFEIT_SCRIPT = """
+local gid = redis.call('GET', KEYS[1])
+if not gid then
+    return false
+end
+local f = redis.call('HMGET', ARGV[3] .. gid, 'p1', 'finished:' .. ARGV[1], 'over')
+if not f[1] or f[2] or f[3] then
+    return false
+end
+redis.call('ZADD', KEYS[2], ARGV[2], ARGV[1])
+return gid
+"""
+
+# Deletes a game and unlinks its players (only if player:{user} still points here;
+# they may already be in their next game). KEYS[1] = game:{gid}, KEYS[2] = games:active,
+# KEYS[3..] = player:{user}; ARGV[1] = game id
+CLEAR_SCRIPT = """
+redis.call('DEL', KEYS[1])
+redis.call('ZREM', KEYS[2], ARGV[1])
+for i = 3, #KEYS do
+    if redis.call('GET', KEYS[i]) == ARGV[1] then
+        redis.call('DEL', KEYS[i])
+    end
+end
+return 1
+"""
+
+_scripts = {}
+
+
+def _script(redis, source: str):
+    if source not in _scripts:
+        _scripts[source] = redis.register_script(source)
+    return _scripts[source]
+
+
+@redis_timed("create_game")
+async def create_game(game_id: str, players, answer_key: list[tuple[int, str]]):
+    """Stores the players and the answer key ([(question_id, letter), ...] in deck order)."""
     redis = get_redis_client()
-    key = f"score:{game_id}"
-    
-    # HINCRBY: Hash Increment By. efficient atomic counter.
-    new_score = await redis.hincrby(key, username, points)
-    return new_score
+    fields = {"p1": players[0], "p2": players[1], "started": int(time.time() * 1000)}
+    for index, (question_id, letter) in enumerate(answer_key):
+        fields[f"q:{question_id}"] = f"{index}{letter}"
+
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.hset(game_key(game_id), mapping=fields)
+        pipe.expire(game_key(game_id), GAME_TTL_SECONDS)
+        pipe.zadd(ACTIVE_GAMES_KEY, {game_id: time.time()})
+        for player in players:
+            pipe.set(player_key(player), game_id, ex=GAME_TTL_SECONDS)
+        await pipe.execute()
 
-async def get_game_scores(game_id: str):
-    """Fetches current scores for all players in the game."""
+@redis_timed("submit_answer")
+async def submit_answer(game_id: str, username: str, question_id, answer: str, points: int = 10):
+    """Atomically checks + scores an answer. Never touches Postgres."""
     redis = get_redis_client()
-    key = f"score:{game_id}"
-    
-    # Returns a dict like {'Manas': '10', 'Devansh': '20'}
-    scores = await redis.hgetall(key)
-    return scores
+    status, correct_option, score, opponent, latency_ms = await _script(redis, ANSWER_SCRIPT)(
+        keys=[game_key(game_id), player_key(username)],
+        args=[username, question_id, answer or "", points, GAME_TTL_SECONDS, int(time.time() * 1000)],
+        client=redis
+    )
+    return {
+        "status": status,
+        "correct_option": correct_option,
+        "score": int(score),
+        "opponent": opponent,
+        "latency_ms": int(latency_ms)
+    }
 
+@redis_timed("mark_finished")
 async def mark_finished(game_id: str, username: str):
-    """Marks a player as finished in Redis."""
+    """
+    Marks a player as finished in Redis.
+    Returns None if `username` isn't playing `game_id`, else
+    {"completed", "players", "scores"}; `completed` is True exactly once per game.
+    """
     redis = get_redis_client()
-    key = f"finished:{game_id}"
-    await redis.sadd(key, username) # Add to a "Set" of finished players
-    return await redis.scard(key)   # Return count (1 or 2)
+    result = await _script(redis, FINISH_SCRIPT)(
+        keys=[game_key(game_id)], args=[username, GAME_TTL_SECONDS], client=redis
+    )
+    if not result:
+        return None
+    completed, p1, p2, score1, score2 = result
+    return {
+        "completed": bool(int(completed)),
+        "players": (p1, p2),
+        "scores": {p1: score1, p2: score2}
+    }
 
-async def clear_game_data(game_id: str):
-    """Clean up Redis to save memory."""
+@redis_timed("forfeit")
+async def forfeit(game_id: str, username: str):
+    """
+    Ends `game_id` with `username` forfeiting. Returns None if they already
+    finished or the game is over, else {"players", "scores"}.
+    """
     redis = get_redis_client()
-    await redis.delete(f"score:{game_id}")
-    await redis.delete(f"finished:{game_id}")
\ No newline at end of file
+    result = await _script(redis, FORFEIT_SCRIPT)(keys=[game_key(game_id)], args=[username], client=redis)
+    if not result:
+        return None
+    p1, p2, score1, score2 = result
+    return {"players": (p1, p2), "scores": {p1: score1, p2: score2}}
+
+@redis_timed("get_current_game")
+async def get_current_game(username: str):
+    """The game `username` is still playing (not finished, not over), or None."""
+    redis = get_redis_client()
+    game_id = await redis.get(player_key(username))
+    if not game_id:
+        return None
+    p1, p2, finished, over = await redis.hmget(game_key(game_id), "p1", "p2", f"finished:{username}", "over")
+    if not p1 or finished or over:
+        return None
+    return {"game_id": game_id, "players": (p1, p2)}
+
+@redis_timed("schedule_forfeit")
+async def schedule_forfeit(username: str, delay: float):
+    """Starts the reconnect grace timer. Returns the game id, or None if there's nothing to forfeit."""
+    redis = get_redis_client()
+    game_id = await _script(redis, SCHEDULE_FORFEIT_SCRIPT)(
+        keys=[player_key(username), PENDING_FORFEITS_KEY],
+        args=[username, time.time() + delay, game_key("")],
+        client=redis
+    )
+    return game_id or None
+
+@redis_timed("cancel_forfeit")
+async def cancel_forfeit(username: str) -> bool:
+    """The player is back: stop their grace timer."""
+    redis = get_redis_client()
+    return bool(await redis.zrem(PENDING_FORFEITS_KEY, username))
+
+@redis_timed("claim_due_forfeits")
+async def claim_due_forfeits(now: float | None = None, limit: int = 100) -> list[str]:
+    """
+    Usernames whose grace period ran out. Each is claimed with ZREM, so with
+    several workers sweeping only one of them handles a given forfeit.
+    """
+    redis = get_redis_client()
+    due = await redis.zrangebyscore(PENDING_FORFEITS_KEY, "-inf", time.time() if now is None else now,
+                                    start=0, num=limit)
+    if not due:
+        return []
+    async with redis.pipeline(transaction=False) as pipe:
+        for username in due:
+            pipe.zrem(PENDING_FORFEITS_KEY, username)
+        claimed = await pipe.execute()
+    return [username for username, won in zip(due, claimed) if won]
+
+@redis_timed("clear_game_data")
+async def clear_game_data(game_id: str, players=()):
+    """Clean up Redis to save memory (one round trip)."""
+    redis = get_redis_client()
+    await _script(redis, CLEAR_SCRIPT)(
+        keys=[game_key(game_id), ACTIVE_GAMES_KEY, *[player_key(p) for p in players]],
+        args=[game_id],
+        client=redis
+    )
+
+@redis_timed("count_active_games")
+async def count_active_games():
+    redis = get_redis_client()
+    return await redis.zcard(ACTIVE_GAMES_KEY)
+
+
+# --- REAPER ---
+async def reap_expired_games(now: float | None = None, batch: int = GAME_REAPER_BATCH):
+    """
+    The game hashes expire on their own; this drops their games:active entries.
+    Only games older than the TTL can have expired, so only those are checked.
+    """
+    redis = get_redis_client()
+    cutoff = (time.time() if now is None else now) - GAME_TTL_SECONDS
+    reclaimed = 0
+    offset = 0
+
+    while True:
+        game_ids = await redis.zrangebyscore(ACTIVE_GAMES_KEY, "-inf", cutoff, start=offset, num=batch)
+        if not game_ids:
+            break
+
+        async with redis.pipeline(transaction=False) as pipe:
+            for game_id in game_ids:
+                pipe.exists(game_key(game_id))
+            alive = await pipe.execute()
+
+        expired = [gid for gid, exists in zip(game_ids, alive) if not exists]
+        if expired:
+            reclaimed += await redis.zrem(ACTIVE_GAMES_KEY, *expired)
+        # Long-running games that are still alive stay put; page past them
+        offset += len(game_ids) - len(expired)
+        if len(game_ids) < batch:
+            break
+
+    if reclaimed:
+        GAME_KEYS_RECLAIMED.inc(amount=reclaimed)
+        print(f"🧹 Reclaimed {reclaimed} abandoned games")
+    return reclaimed
+
+
+async def run_reaper(interval: float = GAME_REAPER_INTERVAL_SECONDS):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await reap_expired_games()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"❌ Game reaper failed: {e}")
@@ -0,0 +1,158 @@
+import asyncio
+import uuid
+from sqlalchemy import select
+
+from . import models, database
+from .redis_client import get_redis_client
+from .rating import DEFAULT_RATING
+
+# Sorted set: member = username, score = rating. Highest rating = rank 1.
+LEADERBOARD_KEY = "leaderboard"
+# Scratch boards are per rebuild (suffixed); this key names the one in progress
+REBUILD_KEY = "leaderboard:rebuild"
+# One rebuild at a time across workers; the lock outlives a stuck one by this much
+REBUILD_LOCK_KEY = "leaderboard:rebuild:lock"
+REBUILD_LOCK_SECONDS = 120
+
+MAX_PAGE_SIZE = 100
+REBUILD_CHUNK_SIZE = 5000
+
+# Rank lookup + the slice around it in ONE round trip.
+# KEYS[1] = leaderboard, ARGV[1] = username, ARGV[2] = radius
+# Returns {rank, member, score, member, score, ...} or {} if unranked.
+AROUND_SCRIPT = """
+local rank = redis.call('ZREVRANK', KEYS[1], ARGV[1])
+if not rank then
+    return {}
+end
+local radius = tonumber(ARGV[2])
+local start = math.max(rank - radius, 0)
+local slice = redis.call('ZREVRANGE', KEYS[1], start, rank + radius, 'WITHSCORES')
+table.insert(slice, 1, start)
+table.insert(slice, 1, rank)
+return slice
+"""
+
+_around_script = None
+
+
+def _entries(flat: list, start_rank: int):
+    """[member, score, member, score, ...] -> list of 1-based ranked entries."""
+    return [
+        {"rank": start_rank + i // 2 + 1, "username": flat[i], "rating": int(float(flat[i + 1]))}
+        for i in range(0, len(flat) - 1, 2)
+    ]
+
+
+async def update_ratings(ratings: dict[str, int]):
+    """
+    Incremental update: one ZADD for every rating that changed, on the live
+    board and on the one being rebuilt, if any. Call it after the commit: a
+    rebuild that starts later reads the new ratings from Postgres anyway.
+    """
+    if not ratings:
+        return
+    redis = get_redis_client()
+    scratch = await redis.get(REBUILD_KEY)
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.zadd(LEADERBOARD_KEY, ratings)
+        if scratch:
+            pipe.zadd(scratch, ratings)
+        await pipe.execute()
+
+
+async def get_page(limit: int = 20, cursor: int = 0):
+    """Top-N with cursor paging; the cursor is the 0-based rank to start from. O(log n + k)."""
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    cursor = max(cursor, 0)
+    redis = get_redis_client()
+    flat = await redis.zrevrange(LEADERBOARD_KEY, cursor, cursor + limit - 1, withscores=True)
+    # redis-py returns (member, score) tuples here; flatten to match the script output
+    entries = _entries([x for pair in flat for x in pair], cursor)
+    return {
+        "entries": entries,
+        "next_cursor": cursor + limit if len(entries) == limit else None
+    }
+
+
+async def get_standing(username: str, radius: int = 5):
+    """A player's rank plus `radius` neighbours on each side, or None if unranked."""
+    global _around_script
+    radius = max(0, min(radius, MAX_PAGE_SIZE // 2))
+    redis = get_redis_client()
+    if _around_script is None:
+        _around_script = redis.register_script(AROUND_SCRIPT)
+
+    result = await _around_script(keys=[LEADERBOARD_KEY], args=[username, radius], client=redis)
+    if not result:
+        return None
+
+    rank, start = int(result[0]), int(result[1])
+    neighbours = _entries(result[2:], start)
+    me = next(e for e in neighbours if e["username"] == username)
+    return {
+        "username": username,
+        "rank": rank + 1,
+        "rating": me["rating"],
+        "neighbours": neighbours
+    }
+
+
+async def rebuild():
+    """
+    Rebuilds the leaderboard from Postgres.
+    Fills a scratch key in chunks and RENAMEs it over the live one, so readers
+    never see a half-built board. Rating updates during the rebuild land in
+    both, so none is lost. Returns None (and does nothing) if another worker
+    is already rebuilding.
+    """
+    redis = get_redis_client()
+    token = uuid.uuid4().hex
+    if not await redis.set(REBUILD_LOCK_KEY, token, nx=True, ex=REBUILD_LOCK_SECONDS):
+        return None
+
+    scratch = f"{REBUILD_KEY}:{token}"
+    try:
+        # Point update_ratings() at the scratch board before reading any ratings
+        await redis.set(REBUILD_KEY, scratch, ex=REBUILD_LOCK_SECONDS)
+
+        count = 0
+        async with database.SessionLocal() as session:
+            result = await session.stream(
+                select(models.User.username, models.User.rating)
+                .execution_options(yield_per=REBUILD_CHUNK_SIZE)
+            )
+            async for chunk in result.partitions(REBUILD_CHUNK_SIZE):
+                # NX: a rating update_ratings() already wrote here is newer than this row
+                await redis.zadd(scratch, {
+                    row.username: row.rating if row.rating is not None else DEFAULT_RATING
+                    for row in chunk
+                }, nx=True)
+                count += len(chunk)
+
+        if await redis.exists(scratch):
+            await redis.rename(scratch, LEADERBOARD_KEY)
+        else:
+            await redis.delete(LEADERBOARD_KEY)
+        return count
+    finally:
+        await redis.delete(REBUILD_KEY, scratch)
+        if await redis.get(REBUILD_LOCK_KEY) == token:
+            await redis.delete(REBUILD_LOCK_KEY)
+
+
+async def rebuild_if_missing():
+    """Only one of the workers booting together rebuilds; losing that race counts as done."""
+    redis = get_redis_client()
+    if await redis.exists(LEADERBOARD_KEY):
+        return None
+    return await rebuild()
+
+
+if __name__ == "__main__":
+    # python -m app.leaderboard  -> rebuild from Postgres on demand
+    count = asyncio.run(rebuild())
+    if count is None:
+        print("⏳ Another worker is rebuilding the leaderboard")
+    else:
+        print(f"✅ Leaderboard rebuilt with {count} players")
@@ -1,18 +1,77 @@
-from fastapi import FastAPI, Depends, HTTPException, status, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Depends, HTTPException, Request, status, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, JSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from sqlalchemy import insert, update
+from sqlalchemy.exc import IntegrityError
 from contextlib import asynccontextmanager
-import json
+import asyncio
+import time
 
 from . import models, schemas, auth, database, matchmaker, game_utils
-from . import game_state
+from . import game_state, leaderboard, metrics, sweeper, match_history, rate_limit, presence
+from .question_sampler import question_sampler
+from .connections import manager
+from .match_writer import match_writer
+from .deck_pool import deck_pool
+from .token_cache import token_cache
+from .username_filter import username_filter
+from .event_log import event_log, event_consumer
+
+# Times every SQL statement issued through SessionLocal / the engine
+metrics.instrument_engine(database.engine)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    async with database.engine.begin() as conn:
-        await conn.run_sync(models.Base.metadata.create_all)
+    started = time.perf_counter()
+    # Dev convenience only: production creates the schema once with create_schema.py
+    if database.DB_CREATE_ALL:
+        async with database.engine.begin() as conn:
+            await conn.run_sync(models.Base.metadata.create_all)
+
+    async def warm_decks():
+        # Build the question id index so match start never does ORDER BY random(),
+        # then fill the deck pool from it; the producer keeps it topped up
+        await question_sampler.ensure_fresh()
+        await deck_pool.refill()
+
+    # Independent warm-ups run side by side; traffic is only accepted once all are done
+    await asyncio.gather(
+        # Open the DB pool now, not on the first requests
+        database.warm_up(),
+        warm_decks(),
+        # First boot against an empty Redis: seed the leaderboard and username filter from Postgres
+        leaderboard.rebuild_if_missing(),
+        username_filter.rebuild_if_missing()
+    )
+    deck_pool.start()
+    print(f"🚀 Worker ready in {time.perf_counter() - started:.2f}s")
+
+    # Cross-worker delivery: our pub/sub channel + presence heartbeats
+    manager.start()
+    # Batched, write-behind match persistence
+    match_writer.start()
+    # Game events: buffered -> Redis Stream -> bulk-loaded into game_events
+    event_log.start()
+    event_consumer.start()
+
+    # Re-tries waiting players as their rating windows widen
+    pairing_task = asyncio.create_task(matchmaker.run_pairing_loop(start_game))
+    # Prunes games whose Redis state expired (abandoned games)
+    reaper_task = asyncio.create_task(game_state.run_reaper())
+    # Settles forfeits of players who never came back; drops ghosts from the queue
+    sweeper_task = asyncio.create_task(sweeper.run_sweeper())
     yield
+    pairing_task.cancel()
+    reaper_task.cancel()
+    sweeper_task.cancel()
+    await deck_pool.stop()
+    await manager.stop()
+    # Drain queued matches (and buffered events) before the process exits
+    await match_writer.stop()
+    await event_log.stop()
+    await event_consumer.stop()
 
 app = FastAPI(title="CodeClash API", lifespan=lifespan)
 
@@ -25,187 +84,352 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# --- UPGRADED CONNECTION MANAGER ---
-class ConnectionManager:
-    def __init__(self):
-        # Dictionary: Maps "username" -> WebSocket connection
-        self.active_connections: dict[str, WebSocket] = {}
-
-    async def connect(self, websocket: WebSocket, username: str):
-        await websocket.accept()
-        self.active_connections[username] = websocket
+# --- RATE LIMITS / LOAD SHEDDING ---
 
-    def disconnect(self, username: str):
-        if username in self.active_connections:
-            del self.active_connections[username]
+@app.exception_handler(rate_limit.RateLimited)
+async def rate_limited_handler(request: Request, exc: rate_limit.RateLimited):
+    return JSONResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        content={"detail": "Too many requests, please slow down"},
+        headers={"Retry-After": str(max(1, round(exc.retry_after)))}
+    )
 
-    async def send_personal_message(self, message: dict, username: str):
-        if username in self.active_connections:
-            websocket = self.active_connections[username]
-            await websocket.send_text(json.dumps(message))
-    # Inside ConnectionManager class
-    async def broadcast_to_user(self, message: dict, username: str):
-        if username in self.active_connections:
-            websocket = self.active_connections[username]
-            await websocket.send_text(json.dumps(message))
-
-manager = ConnectionManager()
+@app.exception_handler(rate_limit.Overloaded)
+async def overloaded_handler(request: Request, exc: rate_limit.Overloaded):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": str(exc)},
+        headers={"Retry-After": "1"}
+    )
 
 # --- ROUTES ---
 
 @app.post("/register", response_model=schemas.UserResponse, status_code=status.HTTP_201_CREATED)
-async def register_user(user: schemas.UserCreate, db: AsyncSession = Depends(database.get_db)):
-    result = await db.execute(select(models.User).where(
-        (models.User.email == user.email) | (models.User.username == user.username)
-    ))
-    if result.scalars().first():
-        raise HTTPException(status_code=400, detail="User already exists")
-
-    hashed_pwd = auth.get_password_hash(user.password)
-    new_user = models.User(email=user.email, username=user.username, hashed_password=hashed_pwd)
-    db.add(new_user)
-    await db.commit()
-    await db.refresh(new_user)
+async def register_user(user: schemas.UserCreate, request: Request, db: AsyncSession = Depends(database.get_db)):
+    await rate_limit.register_ip.hit(rate_limit.client_ip(request))
+
+    # Argon2 runs in the hashing pool, not on the event loop (and before taking a DB slot)
+    hashed_pwd = await auth.get_password_hash_async(user.password)
+
+    async with rate_limit.db_admission():
+        # One INSERT ... RETURNING: the unique constraints decide, so concurrent signups can't race
+        try:
+            new_user = await db.scalar(
+                insert(models.User)
+                .values(email=user.email, username=user.username, hashed_password=hashed_pwd)
+                .returning(models.User)
+            )
+            await db.commit()
+        except IntegrityError:
+            await db.rollback()
+            raise HTTPException(status_code=400, detail="User already exists")
+
+    try:
+        await username_filter.add(new_user.username)
+    except Exception as e:
+        # Only availability hints go stale; the unique constraint still guards signups
+        print(f"❌ Failed to add {new_user.username} to the username filter: {e}")
+    try:
+        await leaderboard.update_ratings({new_user.username: new_user.rating})
+    except Exception as e:
+        # The account is committed: a 500 here would send the client retrying into "already exists".
+        # The player shows up on the board after their first game (or the next rebuild).
+        print(f"❌ Failed to add {new_user.username} to the leaderboard: {e}")
     return new_user
 
+@app.get("/username-available", response_model=schemas.UsernameAvailability)
+async def username_available(username: str, request: Request):
+    # Called on every keystroke of the signup form
+    await rate_limit.username_check_ip.hit(rate_limit.client_ip(request))
+    # Same normalization as /register, so the answer is about the name that would be saved
+    try:
+        username = schemas.normalize_username(username)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Names the Bloom filter rules out never reach Postgres
+    return {"username": username, "available": await username_filter.is_available(username)}
+
 @app.post("/login")
-async def login(user_credentials: schemas.UserLogin, db: AsyncSession = Depends(database.get_db)):
-    result = await db.execute(select(models.User).where(models.User.username == user_credentials.username))
-    user = result.scalars().first()
-    if not user or not auth.verify_password(user_credentials.password, user.hashed_password):
+async def login(user_credentials: schemas.UserLogin, request: Request, db: AsyncSession = Depends(database.get_db)):
+    # Checked before any Argon2 work: per caller, and per account being guessed at
+    await rate_limit.login_ip.hit(rate_limit.client_ip(request))
+    await rate_limit.login_user.hit(user_credentials.username)
+
+    async with rate_limit.db_admission():
+        result = await db.execute(
+            select(models.User.id, models.User.username, models.User.hashed_password)
+            .where(models.User.username == user_credentials.username)
+        )
+        user = result.first()
+        # Release the connection: it would otherwise sit idle in a transaction during the verify
+        await db.rollback()
+    if not user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
+
+    # Argon2 runs outside the DB slot (like register), so slow verifies can't starve other requests
+    is_valid, new_hash = await auth.verify_password_async(user_credentials.password, user.hashed_password)
+    if not is_valid:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+
+    # Argon2 parameters changed since this hash was made: upgrade it transparently
+    if new_hash:
+        async with rate_limit.db_admission():
+            await db.execute(
+                update(models.User).where(models.User.id == user.id).values(hashed_password=new_hash)
+            )
+            await db.commit()
     
     access_token = auth.create_access_token(data={"sub": user.username})
     return {"access_token": access_token, "token_type": "bearer"}
 
+# --- LEADERBOARD (Redis sorted set, cheap enough to poll from the lobby) ---
+
+@app.get("/leaderboard", response_model=schemas.LeaderboardPage)
+async def get_leaderboard(limit: int = 20, cursor: int = 0):
+    return await leaderboard.get_page(limit=limit, cursor=cursor)
+
+@app.get("/leaderboard/{username}", response_model=schemas.PlayerStanding)
+async def get_player_standing(username: str, radius: int = 5):
+    standing = await leaderboard.get_standing(username, radius=radius)
+    if standing is None:
+        raise HTTPException(status_code=404, detail="Player not ranked")
+    return standing
+
+# --- MATCH HISTORY & STATS ---
+async def get_user_or_404(username: str, db: AsyncSession) -> models.User:
+    result = await db.execute(select(models.User).where(models.User.username == username))
+    user = result.scalars().first()
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user
+
+@app.get("/users/{username}/matches", response_model=schemas.MatchHistoryPage)
+async def get_match_history(username: str, limit: int = 20, cursor: str | None = None,
+                            db: AsyncSession = Depends(database.get_db)):
+    async with rate_limit.db_admission():
+        user = await get_user_or_404(username, db)
+        try:
+            return await match_history.get_history(user.id, limit=limit, cursor=cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/users/{username}/stats", response_model=schemas.PlayerStats)
+async def get_player_stats(username: str, db: AsyncSession = Depends(database.get_db)):
+    async with rate_limit.db_admission():
+        user = await get_user_or_404(username, db)
+        return await match_history.get_stats(user)
+
+@app.get("/stats/token-cache")
+async def token_cache_stats():
+    return token_cache.stats()
+
+# --- METRICS (Prometheus text format, per worker) ---
+
+metrics.Gauge("codeclash_active_connections", "WebSockets open on this worker",
+              collect=lambda: len(manager.active_connections))
+metrics.Gauge("codeclash_matchmaking_queue_length", "Players waiting for a match",
+              collect=matchmaker.get_queue_length)
+metrics.Gauge("codeclash_games_in_flight", "Games started and not yet saved",
+              collect=game_state.count_active_games)
+metrics.CounterFunc("codeclash_token_cache_hits_total", "Handshake tokens served from the claims cache",
+                    collect=lambda: token_cache.hits)
+metrics.CounterFunc("codeclash_token_cache_misses_total", "Handshake tokens that needed full verification",
+                    collect=lambda: token_cache.misses)
+metrics.CounterFunc("codeclash_token_cache_expired_total", "Cached claims evicted because they expired",
+                    collect=lambda: token_cache.expired)
+metrics.Gauge("codeclash_token_cache_size", "Verified tokens cached on this worker",
+              collect=lambda: len(token_cache.entries))
+metrics.Gauge("codeclash_match_writer_queue_depth", "Matches waiting to be persisted",
+              collect=lambda: match_writer.queue.qsize())
+metrics.CounterFunc("codeclash_matches_saved_total", "Matches persisted by the writer",
+                    collect=lambda: match_writer.saved)
+metrics.CounterFunc("codeclash_matches_failed_total", "Matches the writer failed to persist",
+                    collect=lambda: match_writer.failed)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(await metrics.render_all(), media_type="text/plain; version=0.0.4")
+
 # --- THE REAL-TIME GAME SOCKET ---
 
+async def start_game(match: dict):
+    """Sends GAME_START (with a pre-built 10-question deck) to both players of a freshly formed match."""
+    player1, player2 = match["players"]
+    game_id = match["game_id"]
+
+    # Pre-built deck: the questions are already fetched and encoded
+    deck = await deck_pool.take(match["players"])
+
+    # The answer key + players live in Redis for the whole game,
+    # so scoring never needs Postgres or the client's word
+    await game_state.create_game(game_id, match["players"], deck.answer_key)
+    event_log.emit("GAME_START", game_id, username=player1, opponent=player2)
+
+    # Send to P1
+    if not await manager.send_personal_message(deck.payload.bind(game_id=game_id, opponent=player2), player1):
+        # Paired with someone whose socket is already gone: start their forfeit timer
+        await sweeper.handle_disconnect(player1)
+
+    # Send to P2
+    if not await manager.send_personal_message(deck.payload.bind(game_id=game_id, opponent=player1), player2):
+        await sweeper.handle_disconnect(player2)
+
+# PONG needs no handling: receive() already marked the socket alive
+WS_MESSAGE_TYPES = {"SUBMIT_ANSWER", "FINISH_GAME", "CANCEL_SEARCH", "PONG"}
+
 @app.websocket("/ws/matchmaking/{username}")
 async def websocket_endpoint(websocket: WebSocket, username: str):
-    await manager.connect(websocket, username)
+    if await rate_limit.ws_connects.retry_after(rate_limit.client_ip(websocket)):
+        await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER, reason="Too many connections, retry shortly")
+        return
+
+    # --- AUTH: the token must belong to the username in the path ---
+    token, bearer_subprotocol = auth.websocket_token(websocket)
+    claims = token_cache.verify(token)
+    if claims is None or claims.get("sub") != username:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    await manager.connect(websocket, username, bearer_subprotocol)
     
     try:
-        await manager.send_personal_message({"type": "status", "msg": "Finding match..."}, username)
-        
-        # --- MATCHMAKING LOGIC ---
-        match_data = await matchmaker.add_to_queue(username)
-        
-        if match_data["status"] == "MATCH_FOUND":
-            player1 = match_data["players"][0]
-            player2 = match_data["players"][1]
-            game_id = match_data["game_id"]
-            
-            # Fetch 10 Questions
-            questions = await game_utils.get_random_questions(limit=10)
-            
-            # Game Config
-            payload = {
-                "type": "GAME_START",
-                "game_id": game_id,
-                "opponent": "",
-                "questions": questions,
-                "config": {
-                    "question_count": 10,
-                    "timer_per_question": 15
-                }
-            }
-            
-            # Send to P1
-            payload["opponent"] = player2
-            await manager.send_personal_message(payload, player1)
-            
-            # Send to P2
-            payload["opponent"] = player1
-            await manager.send_personal_message(payload, player2)
-            
+        # --- RECONNECT: back within the grace period, so no forfeit ---
+        current_game = await sweeper.handle_reconnect(username)
+        if current_game:
+            p1, p2 = current_game["players"]
+            await manager.send_personal_message({
+                "type": "GAME_RESUME",
+                "game_id": current_game["game_id"],
+                "opponent": p2 if p1 == username else p1
+            }, username)
         else:
-            await manager.send_personal_message({"type": "status", "msg": "Waiting for opponent..."}, username)
+            await manager.send_personal_message({"type": "status", "msg": "Finding match..."}, username)
+
+            # --- MATCHMAKING LOGIC ---
+            # One atomic call: enqueue by rating + every pair it was able to form
+            try:
+                async with rate_limit.db_admission():
+                    rating = await game_utils.get_user_rating(username)
+            except rate_limit.Overloaded as e:
+                # The close reason carries the message; the finally block does the cleanup
+                await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER, reason=str(e))
+                return
+            match_data = await matchmaker.add_to_queue(username, rating)
+
+            for match in match_data["matches"]:
+                await start_game(match)
+
+            if not any(username in match["players"] for match in match_data["matches"]):
+                await manager.send_personal_message({"type": "status", "msg": "Waiting for opponent..."}, username)
             
         # --- GAMEPLAY LOOP ---
         while True:
             # Wait for data from Client
-            data = await websocket.receive_text()
-            message = json.loads(data)
-            
-# ... Inside the while True loop ...
-            if message.get("type") == "SUBMIT_ANSWER":
-                q_id = message.get("q_id")
-                ans = message.get("answer")
-                gid = message.get("game_id")
-                opponent_name = message.get("opponent")
-
-                # 1. Fetch the Question to get the correct letter
-                async with database.SessionLocal() as session:
-                    q_result = await session.execute(
-                        select(models.Question).where(models.Question.id == q_id)
-                    )
-                    question_obj = q_result.scalars().first()
-                
-                # Safety check
-                if not question_obj:
-                    continue
+            message = await manager.receive(websocket, username)
+            msg_type = message.get("type")
+            # Unknown types share one label so clients can't blow up cardinality
+            label = msg_type if msg_type in WS_MESSAGE_TYPES else "OTHER"
 
-                actual_correct_option = question_obj.correct_option
-                is_correct = (actual_correct_option == ans)
-                
-                if is_correct:
-                    # Update Score
-                    new_score = await game_state.update_score(gid, username, 10)
-                    
-                    # Notify Self (WITH correct_option)
+            # Every message costs a Redis (or DB) round trip: throttle floods, drop the excess
+            if msg_type != "PONG":
+                wait = await rate_limit.ws_messages.retry_after(username)
+                if wait:
                     await manager.send_personal_message({
-                        "type": "ANSWER_RESULT",
-                        "correct": True,
-                        "score": new_score,
-                        "correct_option": actual_correct_option 
+                        "type": "RATE_LIMITED",
+                        "msg": "Too many messages, slow down.",
+                        "retry_after": round(wait, 2)
                     }, username)
-                    
-                    # Notify Opponent
-                    if opponent_name:
+                    continue
+
+            with metrics.track_request(f"ws:{label}", metrics.WS_MESSAGE_SECONDS, label):
+# ... Inside the while True loop ...
+                if message.get("type") == "SUBMIT_ANSWER":
+                    # Malformed input is the client's problem: skip it, don't tear down the socket
+                    try:
+                        q_id = int(message.get("q_id"))
+                    except (ValueError, TypeError):
+                        continue
+                    ans = message.get("answer")
+                    if not isinstance(ans, str):
+                        continue
+                    gid = message.get("game_id")
+
+                    # 1. Check + dedupe + score in one Redis script against the game's own
+                    #    answer key. The opponent comes from the game, not the client.
+                    result = await game_state.submit_answer(gid, username, q_id, ans, 10)
+
+                    # Safety check: not our game / not one of its questions
+                    if result["status"] not in ("CORRECT", "WRONG", "DUPLICATE"):
+                        continue
+
+                    is_correct = result["status"] == "CORRECT"
+                    if result["status"] != "DUPLICATE":
+                        # Buffered in memory; shipped to the event stream in the background
+                        event_log.emit("ANSWER", gid, username=username, question_id=q_id, answer=ans,
+                                       correct=is_correct, latency_ms=result["latency_ms"],
+                                       score=result["score"])
+
+                    if is_correct:
+                        # Notify Self (WITH correct_option)
+                        await manager.send_personal_message({
+                            "type": "ANSWER_RESULT",
+                            "correct": True,
+                            "score": result["score"],
+                            "correct_option": result["correct_option"]
+                        }, username)
+
+                        # Notify Opponent
                         await manager.broadcast_to_user({
                             "type": "OPPONENT_UPDATE",
-                            "opponent_score": new_score
-                        }, opponent_name)
-                else:
-                    # Notify Self (WITH correct_option)
+                            "opponent_score": result["score"]
+                        }, result["opponent"])
+                    else:
+                        # Notify Self (WITH correct_option). A repeat answer scores nothing.
+                        await manager.send_personal_message({
+                            "type": "ANSWER_RESULT",
+                            "correct": False,
+                            "duplicate": result["status"] == "DUPLICATE",
+                            "correct_option": result["correct_option"]
+                        }, username)
+                # --- NEW LOGIC: INSERT THIS BLOCK HERE ---
+                elif message.get("type") == "FINISH_GAME":
+                    gid = message.get("game_id")
+
+                    # 1. Mark this user as done in Redis (one script call). Returns None
+                    #    unless they're one of the game's own players.
+                    finished = await game_state.mark_finished(gid, username)
+                    if finished is None:
+                        continue
+
+                    print(f"🏁 User {username} finished game {gid}")
+                    event_log.emit("FINISH_GAME", gid, username=username, score=finished["scores"][username])
+
+                    # 2. If this call completed the game (exactly once), Save the Match!
+                    if finished["completed"]:
+                        print(f"💾 Both players finished! Saving Match {gid} to DB...")
+
+                        # A. Queue for PostgreSQL (batched write-behind, includes ELO)
+                        await game_utils.save_match(gid, finished["scores"], finished["players"])
+
+                        # B. Clean up Redis (Free up memory)
+                        await game_state.clear_game_data(gid, finished["players"])
+
+                    # 3. Acknowledge the client (Optional)
+                    await manager.send_personal_message({"type": "GAME_OVER_ACK"}, username)
+                # --- NEW LOGIC: CANCEL SEARCH ---
+                elif message.get("type") == "CANCEL_SEARCH":
+                    await matchmaker.remove_from_queue(username)
                     await manager.send_personal_message({
-                        "type": "ANSWER_RESULT",
-                        "correct": False,
-                        "correct_option": actual_correct_option 
+                        "type": "status", 
+                        "msg": "Search Canceled."
                     }, username)
-            # --- NEW LOGIC: INSERT THIS BLOCK HERE ---
-            elif message.get("type") == "FINISH_GAME":
-                gid = message.get("game_id")
-                
-                print(f"🏁 User {username} finished game {gid}")
-                
-                # 1. Mark this user as done in Redis
-                # Returns how many people are now finished (1 or 2)
-                finished_count = await game_state.mark_finished(gid, username)
-                
-                # 2. If BOTH players (2) are finished, Save the Match!
-                if finished_count >= 2:
-                    print(f"💾 Both players finished! Saving Match {gid} to DB...")
-                    
-                    # A. Fetch Final Scores from Redis
-                    final_scores = await game_state.get_game_scores(gid)
-                    
-                    # B. Save to PostgreSQL
-                    await game_utils.save_match(gid, final_scores)
-                    
-                    # C. Clean up Redis (Free up memory)
-                    await game_state.clear_game_data(gid)
-                    
-                # 3. Acknowledge the client (Optional)
-                await manager.send_personal_message({"type": "GAME_OVER_ACK"}, username)
-            # --- NEW LOGIC: CANCEL SEARCH ---
-            elif message.get("type") == "CANCEL_SEARCH":
-                await matchmaker.remove_from_queue(username)
-                await manager.send_personal_message({
-                    "type": "status", 
-                    "msg": "Search Canceled."
-                }, username)
 
     except WebSocketDisconnect:
-        manager.disconnect(username)
-        # Optional: Handle forfeit logic here
\ No newline at end of file
+        pass
+    finally:
+        await manager.disconnect(username, websocket)
+        # Still connected through a newer socket, here or on another worker? Then nothing was abandoned.
+        # (Our own presence entry is gone by now, so any entry left belongs to that socket.)
+        if username not in manager.active_connections and not (await presence.online([username]))[0]:
+            # Out of the queue now; a forfeit after the grace period if mid-game
+            await sweeper.handle_disconnect(username)
\ No newline at end of file
@@ -0,0 +1,169 @@
+import base64
+import heapq
+from datetime import datetime
+from sqlalchemy import select, tuple_, func, case
+
+from . import models, database
+
+MAX_PAGE_SIZE = 100
+
+
+# --- CURSORS ---
+def encode_cursor(played_at: datetime, match_id: int) -> str:
+    raw = f"{played_at.isoformat()}|{match_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    """(played_at, id) of the last match on the previous page; ValueError if malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        played_at, match_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(played_at), int(match_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+# --- HISTORY ---
+def _side_query(own_id, own_score, opp_id, opp_score, user_id: int, after, limit: int):
+    """One player's matches from one seat (player1 or player2), newest first."""
+    opponent = models.User.__table__.alias("opponent")
+    query = (
+        select(
+            models.Match.id,
+            models.Match.played_at,
+            models.Match.winner_id,
+            own_score.label("score"),
+            opp_score.label("opponent_score"),
+            opponent.c.username.label("opponent")
+        )
+        .join(opponent, opponent.c.id == opp_id)
+        .where(own_id == user_id)
+    )
+    if after is not None:
+        # Row-value comparison: a single range scan on (player_id, played_at, id)
+        query = query.where(tuple_(models.Match.played_at, models.Match.id) < after)
+    return query.order_by(models.Match.played_at.desc(), models.Match.id.desc()).limit(limit)
+
+
+async def get_history(user_id: int, limit: int = 20, cursor: str | None = None):
+    """
+    Keyset-paged history, newest first. The player can sit in either seat, so
+    each seat is read with its own index range scan (an OR would defeat the
+    indexes) and the two already-sorted pages are merged.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    after = decode_cursor(cursor) if cursor else None
+    m = models.Match
+
+    async with database.SessionLocal() as session:
+        as_p1 = (await session.execute(
+            _side_query(m.player1_id, m.score1, m.player2_id, m.score2, user_id, after, limit + 1)
+        )).all()
+        as_p2 = (await session.execute(
+            _side_query(m.player2_id, m.score2, m.player1_id, m.score1, user_id, after, limit + 1)
+        )).all()
+
+    newest_first = lambda row: (row.played_at, row.id)
+    rows = list(heapq.merge(as_p1, as_p2, key=newest_first, reverse=True))[:limit + 1]
+    page, more = rows[:limit], len(rows) > limit
+
+    matches = [{
+        "id": row.id,
+        "played_at": row.played_at,
+        "opponent": row.opponent,
+        "score": row.score,
+        "opponent_score": row.opponent_score,
+        "result": "draw" if row.winner_id is None else "win" if row.winner_id == user_id else "loss"
+    } for row in page]
+    return {
+        "matches": matches,
+        "next_cursor": encode_cursor(page[-1].played_at, page[-1].id) if more else None
+    }
+
+
+# --- AGGREGATES ---
+async def apply_results(session, rows: list[dict]):
+    """
+    Folds newly inserted match rows into user_stats. Runs inside the
+    MatchWriter transaction, after the players' User rows were locked.
+    """
+    deltas: dict[int, list[int]] = {}
+    for row in rows:
+        for me, score in ((row["player1_id"], row["score1"]), (row["player2_id"], row["score2"])):
+            # [wins, losses, draws, total_score]
+            d = deltas.setdefault(me, [0, 0, 0, 0])
+            if row["winner_id"] is None:
+                d[2] += 1
+            elif row["winner_id"] == me:
+                d[0] += 1
+            else:
+                d[1] += 1
+            d[3] += score
+    if not deltas:
+        return
+
+    result = await session.execute(
+        select(models.UserStats).where(models.UserStats.user_id.in_(deltas))
+    )
+    existing = {s.user_id: s for s in result.scalars().all()}
+
+    for user_id, (wins, losses, draws, total_score) in deltas.items():
+        stats = existing.get(user_id)
+        if stats is None:
+            stats = models.UserStats(user_id=user_id, games=0, wins=0, losses=0, draws=0, total_score=0)
+            session.add(stats)
+        stats.games += wins + losses + draws
+        stats.wins += wins
+        stats.losses += losses
+        stats.draws += draws
+        stats.total_score += total_score
+
+
+async def get_stats(user: models.User) -> dict:
+    """One primary-key lookup; players with no games get zeros."""
+    async with database.SessionLocal() as session:
+        stats = await session.get(models.UserStats, user.id)
+
+    games = stats.games if stats else 0
+    return {
+        "username": user.username,
+        "rating": user.rating,
+        "games": games,
+        "wins": stats.wins if stats else 0,
+        "losses": stats.losses if stats else 0,
+        "draws": stats.draws if stats else 0,
+        "average_score": round(stats.total_score / games, 2) if games else 0.0
+    }
+
+
+async def rebuild_stats(session):
+    """Recomputes user_stats from the full history (backfill / repair)."""
+    m = models.Match
+    totals: dict[int, list[int]] = {}
+    for own_id, own_score in ((m.player1_id, m.score1), (m.player2_id, m.score2)):
+        result = await session.execute(
+            select(
+                own_id,
+                func.count(),
+                func.sum(case((m.winner_id == own_id, 1), else_=0)),
+                func.sum(case((m.winner_id.is_(None), 1), else_=0)),
+                func.coalesce(func.sum(own_score), 0)
+            ).group_by(own_id)
+        )
+        for user_id, games, wins, draws, total_score in result.all():
+            t = totals.setdefault(user_id, [0, 0, 0, 0])
+            wins, draws = wins or 0, draws or 0
+            t[0] += games
+            t[1] += wins
+            t[2] += draws
+            t[3] += total_score
+
+    await session.execute(models.UserStats.__table__.delete())
+    rows = [{
+        "user_id": user_id, "games": games, "wins": wins, "draws": draws,
+        "losses": games - wins - draws, "total_score": total_score
+    } for user_id, (games, wins, draws, total_score) in totals.items()]
+    if rows:
+        await session.execute(models.UserStats.__table__.insert(), rows)
+    return len(rows)
@@ -0,0 +1,195 @@
+import asyncio
+import os
+from sqlalchemy import select, insert
+from dotenv import load_dotenv
+
+from . import models, database, leaderboard, match_history
+from .rating import DEFAULT_RATING, elo_update, match_outcome
+
+load_dotenv()
+
+# Config
+MATCH_WRITER_FLUSH_SIZE = int(os.getenv("MATCH_WRITER_FLUSH_SIZE", "100"))
+MATCH_WRITER_FLUSH_INTERVAL_SECONDS = float(os.getenv("MATCH_WRITER_FLUSH_INTERVAL_SECONDS", "1.0"))
+MATCH_WRITER_MAX_QUEUE = int(os.getenv("MATCH_WRITER_MAX_QUEUE", "10000"))
+# A batch that fails to commit is retried (after this pause) until each match has had this many attempts
+MATCH_WRITER_MAX_ATTEMPTS = int(os.getenv("MATCH_WRITER_MAX_ATTEMPTS", "3"))
+MATCH_WRITER_RETRY_DELAY_SECONDS = float(os.getenv("MATCH_WRITER_RETRY_DELAY_SECONDS", "1.0"))
+
+# Queued by stop(): tells the worker to flush what it has and exit
+_STOP = object()
+
+
+def players_from_game_id(game_id: str):
+    # game_id looks like game_Manas_Devansh
+    _, p1_name, p2_name = game_id.split("_")
+    return p1_name, p2_name
+
+
+class MatchWriter:
+    """
+    Write-behind persistence for finished matches.
+
+    FINISH_GAME only enqueues; a background task groups matches and writes
+    each batch in ONE transaction: one user lookup, one bulk Match insert
+    and the ELO updates for everyone involved. A batch that fails is retried
+    ahead of newer matches, so ratings still chain in queue order.
+    """
+
+    def __init__(self, flush_size: int = MATCH_WRITER_FLUSH_SIZE,
+                 flush_interval: float = MATCH_WRITER_FLUSH_INTERVAL_SECONDS,
+                 max_queue: int = MATCH_WRITER_MAX_QUEUE):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        # Matches from a failed batch, written before anything newer
+        self.retry: list[dict] = []
+        self.task: asyncio.Task | None = None
+        self.saved = 0
+        self.failed = 0
+
+    async def submit(self, game_id: str, scores: dict, players: tuple[str, str] | None = None,
+                     forfeit_by: str | None = None):
+        """
+        scores dict looks like: {'Manas': '50', 'Devansh': '40'}
+        `forfeit_by` (a player who abandoned the game) loses regardless of the scores.
+        Blocks only when the queue is full (backpressure instead of unbounded memory).
+        """
+        p1_name, p2_name = players or players_from_game_id(game_id)
+        await self.queue.put({
+            "game_id": game_id,
+            "player1": p1_name,
+            "player2": p2_name,
+            # Default to 0 if missing
+            "score1": int(scores.get(p1_name, 0)),
+            "score2": int(scores.get(p2_name, 0)),
+            "forfeit_by": forfeit_by
+        })
+
+    async def flush(self, batch: list[dict]):
+        names = {m["player1"] for m in batch} | {m["player2"] for m in batch}
+
+        async with database.SessionLocal() as session:
+            # 1. Resolve every player in the batch with ONE query.
+            # Rows are locked so concurrent workers can't interleave rating updates;
+            # always in id order, so two workers locking overlapping batches can't deadlock.
+            result = await session.execute(
+                select(models.User)
+                .where(models.User.username.in_(names))
+                .order_by(models.User.id)
+                .with_for_update()
+            )
+            user_map = {u.username: u for u in result.scalars().all()}
+
+            rows = []
+            missing = 0
+            for m in batch:
+                p1 = user_map.get(m["player1"])
+                p2 = user_map.get(m["player2"])
+                if not p1 or not p2:
+                    print(f"❌ Error: Could not find players of {m['game_id']} in DB")
+                    missing += 1
+                    continue
+
+                s1, s2 = m["score1"], m["score2"]
+
+                # 2. Determine Winner (a forfeit overrides the scoreboard)
+                if m.get("forfeit_by") == p1.username:
+                    outcome = 0.0
+                elif m.get("forfeit_by") == p2.username:
+                    outcome = 1.0
+                else:
+                    outcome = match_outcome(s1, s2)
+                winner_id = p1.id if outcome == 1.0 else p2.id if outcome == 0.0 else None
+
+                rows.append({
+                    "player1_id": p1.id,
+                    "player2_id": p2.id,
+                    "score1": s1,
+                    "score2": s2,
+                    "winner_id": winner_id
+                })
+
+                # 3. ELO, applied in queue order so a player's consecutive games chain correctly
+                r1, r2 = elo_update(
+                    p1.rating if p1.rating is not None else DEFAULT_RATING,
+                    p2.rating if p2.rating is not None else DEFAULT_RATING,
+                    outcome
+                )
+                p1.rating, p2.rating = round(r1), round(r2)
+
+            # 4. Bulk insert + rating UPDATEs + stats aggregates, committed together
+            if rows:
+                await session.execute(insert(models.Match), rows)
+                await match_history.apply_results(session, rows)
+            await session.commit()
+
+        # Counted only once committed: if the commit fails, the whole batch is retried
+        self.saved += len(rows)
+        self.failed += missing
+        if rows:
+            print(f"✅ Saved {len(rows)} matches")
+
+        # 5. Push the new ratings to the leaderboard (one ZADD for the whole batch).
+        # Postgres is the source of truth; a failure here is fixed by the next rebuild.
+        try:
+            await leaderboard.update_ratings({u.username: u.rating for u in user_map.values()})
+        except Exception as e:
+            print(f"❌ Leaderboard update failed: {e}")
+
+    async def _collect(self):
+        """Waits for the first match, then gathers more until the batch is full or the interval ends."""
+        if self.retry:
+            # Give the database a moment, then the failed matches go first
+            await asyncio.sleep(MATCH_WRITER_RETRY_DELAY_SECONDS)
+            batch, self.retry = self.retry, []
+        else:
+            batch = [await self.queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.flush_interval
+        while len(batch) < self.flush_size and batch[-1] is not _STOP:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def run(self):
+        stopping = False
+        while True:
+            batch = await self._collect()
+            if batch and batch[-1] is _STOP:
+                stopping = True
+                batch.pop()
+
+            try:
+                if batch:
+                    await self.flush(batch)
+            except Exception as e:
+                for m in batch:
+                    m["attempts"] = m.get("attempts", 0) + 1
+                self.retry = [m for m in batch if m["attempts"] < MATCH_WRITER_MAX_ATTEMPTS]
+                self.failed += len(batch) - len(self.retry)
+                print(f"❌ Failed to save {len(batch)} matches ({len(self.retry)} will be retried): {e}")
+
+            # Retries still get their attempts during shutdown
+            if stopping and not self.retry:
+                return
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Flushes everything queued before shutdown, then stops (called from lifespan)."""
+        if not self.task:
+            return
+        # The sentinel queues up behind every pending match, so they all get written first
+        await self.queue.put(_STOP)
+        await self.task
+        self.task = None
+
+
+match_writer = MatchWriter()
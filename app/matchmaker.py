@@ -1,49 +1,217 @@
-import json
+import asyncio
+import os
+import time
 from .redis_client import get_redis_client
+from .metrics import redis_timed
 
+# Sorted set: member = username, score = rating.
+# Closest-rated opponents are neighbouring ranks, so a lookup is O(log n).
 QUEUE_KEY = "matchmaking_queue"
+# Sorted set: member = username, score = enqueue time (unix seconds).
+# Lets the sweeper walk the longest-waiting players first.
+JOINED_KEY = "matchmaking_queue:joined"
 
-async def add_to_queue(username: str):
+DEFAULT_RATING = 1000
+
+# Upper bound on how many games a single script call may form
+MAX_PAIRS_PER_CALL = int(os.getenv("MATCHMAKING_MAX_PAIRS_PER_CALL", "50"))
+# How many of the longest-waiting players one sweep looks at
+SWEEP_SCAN_LIMIT = int(os.getenv("MATCHMAKING_SWEEP_SCAN_LIMIT", "200"))
+# Rating window: starts at BASE, grows by WIDEN_PER_SECOND while waiting, capped at MAX
+RATING_WINDOW_BASE = float(os.getenv("MATCHMAKING_RATING_WINDOW_BASE", "50"))
+RATING_WINDOW_WIDEN_PER_SECOND = float(os.getenv("MATCHMAKING_RATING_WINDOW_WIDEN_PER_SECOND", "25"))
+RATING_WINDOW_MAX = float(os.getenv("MATCHMAKING_RATING_WINDOW_MAX", "1000"))
+# How often (seconds) the background sweeper re-tries waiting players
+SWEEP_INTERVAL_SECONDS = float(os.getenv("MATCHMAKING_SWEEP_INTERVAL_SECONDS", "1"))
+
+# Enqueue + pair in ONE atomic server-side step.
+# Nothing can interleave between the ZADD and the pairing, so two concurrent
+# callers can never both grab the same opponent.
+#
+# A player is matched to the closest-rated neighbour (rank - 1 or rank + 1)
+# if the gap fits inside the wider of the two players' windows. The window
+# widens the longer a player waits. An enqueue only tries the arriving
+# player (O(log n)); a sweep (username = '') re-tries the longest waiters.
+#
+# KEYS[1] = queue zset, KEYS[2] = joined zset
+# ARGV = username ('' = sweep only), rating, now, base, widen, max window,
+#        max pairs, sweep scan limit
+# Returns a flat list: {p1, p2, p1, p2, ...}
+PAIR_SCRIPT = """
+local queue = KEYS[1]
+local joined = KEYS[2]
+local username = ARGV[1]
+local now = tonumber(ARGV[3])
+local base = tonumber(ARGV[4])
+local widen = tonumber(ARGV[5])
+local max_window = tonumber(ARGV[6])
+local max_pairs = tonumber(ARGV[7])
+local scan_limit = tonumber(ARGV[8])
+
+local function window(player)
+    local since = tonumber(redis.call('ZSCORE', joined, player) or now)
+    return math.min(base + widen * math.max(now - since, 0), max_window)
+end
+
+local function neighbour(rank)
+    if rank < 0 then return nil end
+    local hit = redis.call('ZRANGE', queue, rank, rank, 'WITHSCORES')
+    if #hit == 0 then return nil end
+    return hit[1], tonumber(hit[2])
+end
+
+local function try_match(player)
+    local rank = redis.call('ZRANK', queue, player)
+    if not rank then return nil end
+    local rating = tonumber(redis.call('ZSCORE', queue, player))
+    local my_window = window(player)
+
+    local best, best_gap = nil, nil
+    for _, r in ipairs({rank - 1, rank + 1}) do
+        local other, other_rating = neighbour(r)
+        if other then
+            local gap = math.abs(other_rating - rating)
+            if gap <= math.max(my_window, window(other)) and (best_gap == nil or gap < best_gap) then
+                best, best_gap = other, gap
+            end
+        end
+    end
+
+    if best then
+        redis.call('ZREM', queue, player, best)
+        redis.call('ZREM', joined, player, best)
+    end
+    return best
+end
+
+local matched = {}
+
+if username ~= '' then
+    -- 1 user = 1 entry (ZADD just moves an existing entry), so no self-matching
+    redis.call('ZADD', queue, tonumber(ARGV[2]), username)
+    redis.call('ZADD', joined, now, username)
+    local opponent = try_match(username)
+    if opponent then
+        matched[#matched + 1] = opponent
+        matched[#matched + 1] = username
+    end
+    return matched
+end
+
+-- Sweep: give the longest-waiting players a chance with their widened windows
+local waiting = redis.call('ZRANGE', joined, 0, scan_limit - 1)
+for _, player in ipairs(waiting) do
+    if #matched >= max_pairs * 2 then break end
+    local opponent = try_match(player)
+    if opponent then
+        matched[#matched + 1] = player
+        matched[#matched + 1] = opponent
+    end
+end
+return matched
+"""
+
+_pair_script = None
+
+
+def _get_pair_script(redis):
+    # register_script only hashes the source; EVALSHA (with EVAL fallback) happens on call
+    global _pair_script
+    if _pair_script is None:
+        _pair_script = redis.register_script(PAIR_SCRIPT)
+    return _pair_script
+
+
+def make_game_id(player1: str, player2: str) -> str:
+    return f"game_{player1.lower()}_{player2.lower()}"
+
+
+@redis_timed("pair_players")
+async def pair_players(username: str = "", rating: float = DEFAULT_RATING, now: float | None = None,
+                       max_pairs: int = MAX_PAIRS_PER_CALL):
+    """
+    Atomically enqueues `username` and tries to pair them, or (no username)
+    sweeps the longest-waiting players.
+    Returns a list of {"game_id", "players"} dicts, one per game formed.
+    """
     redis = get_redis_client()
-    
-    # --- FIX 1: IDEMPOTENCY ---
-    # Check if user is already in the queue to prevent "Self-Matching"
-    # LPOS is the fastest way to check existence in a list (Requires Redis 6.0+)
-    # If your Redis is old, we can use LRANGE (slower but safer for compat).
-    # Let's use a robust method: Remove old instance, then add new.
-    # This ensures 1 user = 1 entry.
-    await redis.lrem(QUEUE_KEY, 0, username)
-    
-    # 1. Add user to the right side of the queue
-    await redis.rpush(QUEUE_KEY, username)
-    
-    # 2. Check queue length
-    queue_len = await redis.llen(QUEUE_KEY)
-    
-    if queue_len >= 2:
-        # 3. Pop the first two players
-        player1 = await redis.lpop(QUEUE_KEY)
-        player2 = await redis.lpop(QUEUE_KEY)
-        
-        # --- FIX 2: SANITY CHECK ---
-        # If by some miracle P1 is P2 (shouldn't happen due to lrem above), 
-        # recycle P1 and wait.
-        if player1 == player2:
-             await redis.rpush(QUEUE_KEY, player1)
-             return {"status": "WAITING"}
-
-        game_id = f"game_{player1.lower()}_{player2.lower()}"
-        
-        return {
-            "status": "MATCH_FOUND",
-            "game_id": game_id,
-            "players": [player1, player2]
+    script = _get_pair_script(redis)
+    flat = await script(
+        keys=[QUEUE_KEY, JOINED_KEY],
+        args=[
+            username,
+            rating,
+            time.time() if now is None else now,
+            RATING_WINDOW_BASE,
+            RATING_WINDOW_WIDEN_PER_SECOND,
+            RATING_WINDOW_MAX,
+            max_pairs,
+            SWEEP_SCAN_LIMIT
+        ],
+        client=redis
+    )
+
+    return [
+        {
+            "game_id": make_game_id(flat[i], flat[i + 1]),
+            "players": [flat[i], flat[i + 1]]
         }
-    
-    return {"status": "WAITING"}
+        for i in range(0, len(flat) - 1, 2)
+    ]
+
+
+async def add_to_queue(username: str, rating: float = DEFAULT_RATING):
+    # One round trip: enqueue + pair with the closest-rated waiting player.
+    # Anyone left waiting is re-tried by run_pairing_loop as windows widen.
+    matches = await pair_players(username, rating if rating is not None else DEFAULT_RATING)
+
+    if not matches:
+        return {"status": "WAITING", "matches": []}
+
+    # Report the caller's own game first, but hand back every game formed
+    # so one burst of arrivals drains in a single call.
+    own = next((m for m in matches if username in m["players"]), matches[0])
+    return {
+        "status": "MATCH_FOUND",
+        "game_id": own["game_id"],
+        "players": own["players"],
+        "matches": matches
+    }
 
 # --- NEW FUNCTION: CANCEL SEARCH ---
-async def remove_from_queue(username: str):
+@redis_timed("remove_from_queue")
+async def remove_from_queue(*usernames: str):
+    if not usernames:
+        return False
+    redis = get_redis_client()
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.zrem(QUEUE_KEY, *usernames)
+        pipe.zrem(JOINED_KEY, *usernames)
+        await pipe.execute()
+    return True
+
+@redis_timed("get_waiting")
+async def get_waiting(offset: int = 0, count: int = 500) -> list[str]:
+    """A page of waiting players, longest-waiting first."""
     redis = get_redis_client()
-    await redis.lrem(QUEUE_KEY, 0, username)
-    return True
\ No newline at end of file
+    return await redis.zrange(JOINED_KEY, offset, offset + count - 1)
+
+@redis_timed("get_queue_length")
+async def get_queue_length():
+    redis = get_redis_client()
+    return await redis.zcard(QUEUE_KEY)
+
+async def run_pairing_loop(on_match, interval: float = SWEEP_INTERVAL_SECONDS):
+    """
+    Background sweeper: windows widen with time, so players who found no
+    opponent on arrival are re-tried here. `on_match` is awaited per game.
+    """
+    while True:
+        try:
+            for match in await pair_players():
+                await on_match(match)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"❌ Matchmaking sweep failed: {e}")
+        await asyncio.sleep(interval)
@@ -0,0 +1,302 @@
+"""
+Tiny in-process metrics registry with Prometheus text exposition.
+
+Hot paths only pay for a dict lookup, a bisect and two additions per
+observation, so it stays on in production. Gauges that need I/O (e.g. Redis
+queue length) are computed lazily when /metrics is scraped.
+"""
+import inspect
+import os
+import sys
+import threading
+import time
+import traceback
+from bisect import bisect_left
+from collections import Counter as _Tally
+from contextlib import contextmanager
+from functools import wraps
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Config
+# Handlers slower than this (seconds) are reported to the slow-request hook
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "0.5"))
+# Turn on the sampling profiler for slow requests (off by default)
+PROFILE_SLOW_REQUESTS = os.getenv("PROFILE_SLOW_REQUESTS", "false").lower() in ("1", "true", "yes")
+PROFILE_SAMPLE_INTERVAL_SECONDS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_SECONDS", "0.005"))
+
+# Latency buckets in seconds: 0.5ms .. 10s
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REGISTRY = []
+
+
+def _format_labels(names, values, extra: str = "") -> str:
+    pairs = [f'{n}="{str(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        REGISTRY.append(self)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    async def render(self):
+        return self.header() + self.samples()
+
+    def samples(self):
+        return []
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, *labelvalues, amount: float = 1):
+        self.values[labelvalues] = self.values.get(labelvalues, 0) + amount
+
+    def samples(self):
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+            for labels, value in self.values.items()
+        ]
+
+
+class Gauge(Metric):
+    """Either set() directly, or pass `collect` (sync or async, returning a number) for scrape-time values."""
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), collect=None):
+        super().__init__(name, documentation, labelnames)
+        self.values: dict[tuple, float] = {}
+        self.collect = collect
+
+    def set(self, value: float, *labelvalues):
+        self.values[labelvalues] = value
+
+    def inc(self, *labelvalues, amount: float = 1):
+        self.values[labelvalues] = self.values.get(labelvalues, 0) + amount
+
+    def dec(self, *labelvalues, amount: float = 1):
+        self.inc(*labelvalues, amount=-amount)
+
+    async def render(self):
+        if self.collect is not None:
+            try:
+                value = self.collect()
+                if inspect.isawaitable(value):
+                    value = await value
+                self.values[()] = value
+            except Exception as e:
+                print(f"❌ Metric {self.name} failed to collect: {e}")
+        return await super().render()
+
+    def samples(self):
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+            for labels, value in self.values.items()
+        ]
+
+
+class CounterFunc(Gauge):
+    """A counter whose value lives elsewhere (e.g. MatchWriter.saved); read at scrape time."""
+    kind = "counter"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [bucket counts..., +Inf count, sum]
+        self.values: dict[tuple, list] = {}
+
+    def observe(self, value: float, *labelvalues):
+        series = self.values.get(labelvalues)
+        if series is None:
+            series = self.values[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self):
+        lines = []
+        for labels, series in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {series[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+async def render_all() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(await metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- TIMING HELPERS ---
+@contextmanager
+def timed(histogram: Histogram, *labelvalues):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - start, *labelvalues)
+
+
+def timed_async(histogram: Histogram, *labelvalues):
+    """Decorator for coroutine functions."""
+    def decorator(fn):
+        @wraps(fn)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, *labelvalues)
+        return wrapper
+    return decorator
+
+
+# --- SHARED HOT-PATH METRICS ---
+WS_MESSAGE_SECONDS = Histogram(
+    "codeclash_ws_message_seconds", "Time to handle one WebSocket message", ("type",)
+)
+REDIS_CALL_SECONDS = Histogram(
+    "codeclash_redis_call_seconds", "Latency of game_state/matchmaker Redis operations", ("op",)
+)
+DB_QUERY_SECONDS = Histogram(
+    "codeclash_db_query_seconds", "Latency of SQL statements", ("statement",)
+)
+SLOW_REQUESTS = Counter(
+    "codeclash_slow_requests_total", "Handlers slower than SLOW_REQUEST_SECONDS", ("name",)
+)
+
+
+def redis_timed(op: str):
+    """Times a game_state/matchmaker function that wraps one Redis round trip."""
+    return timed_async(REDIS_CALL_SECONDS, op)
+
+
+def instrument_engine(engine):
+    """Times every SQL statement via SQLAlchemy cursor events (covers all SessionLocal usage)."""
+    from sqlalchemy import event
+
+    sync_engine = engine.sync_engine
+
+    # The start time lives on the statement's own execution context, so a
+    # statement that raises (and never reaches _after) leaves nothing behind
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._codeclash_query_start = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_codeclash_query_start", None)
+        if started is None:
+            return
+        verb = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+        DB_QUERY_SECONDS.observe(time.perf_counter() - started, verb)
+
+
+# --- SLOW REQUEST PROFILER ---
+def print_slow_request(name: str, duration: float, stacks: _Tally):
+    """Default hook: log the slow handler and the hottest sampled stacks."""
+    print(f"🐢 Slow {name}: {duration * 1000:.1f} ms")
+    for stack, hits in stacks.most_common(3):
+        print(f"   {hits} samples:\n{stack}")
+
+
+_slow_request_hook = print_slow_request
+
+
+def set_slow_request_hook(hook):
+    """hook(name, duration_seconds, stacks: collections.Counter[str -> samples])"""
+    global _slow_request_hook
+    _slow_request_hook = hook
+
+
+class SamplingProfiler:
+    """
+    Samples the event-loop thread's stack while a tracked section runs.
+
+    Only CPU work that blocks the loop shows up (an awaiting coroutine leaves
+    the loop idle), which is exactly what makes one slow handler stall every
+    other socket on the worker.
+    """
+
+    def __init__(self, interval: float = PROFILE_SAMPLE_INTERVAL_SECONDS):
+        self.interval = interval
+        self.active: dict[int, tuple] = {}
+        self.lock = threading.Lock()
+        self.thread = None
+        self.next_id = 0
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                sections = list(self.active.values())
+            if not sections:
+                continue
+            frames = sys._current_frames()
+            for thread_id, tally in sections:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    tally["".join(traceback.format_stack(frame, limit=8))] += 1
+
+    def enter(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="slow-request-profiler", daemon=True)
+            self.thread.start()
+        with self.lock:
+            self.next_id += 1
+            token = self.next_id
+            self.active[token] = (threading.get_ident(), _Tally())
+        return token
+
+    def exit(self, token):
+        with self.lock:
+            return self.active.pop(token)[1]
+
+
+profiler = SamplingProfiler()
+
+
+@contextmanager
+def track_request(name: str, histogram: Histogram | None = None, *labelvalues):
+    """Times a handler; slow ones are counted and (optionally) profiled."""
+    token = profiler.enter() if PROFILE_SLOW_REQUESTS else None
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        if histogram is not None:
+            histogram.observe(duration, *labelvalues)
+        stacks = profiler.exit(token) if token is not None else _Tally()
+        if duration >= SLOW_REQUEST_SECONDS:
+            SLOW_REQUESTS.inc(name)
+            try:
+                _slow_request_hook(name, duration, stacks)
+            except Exception as e:
+                print(f"❌ Slow request hook failed: {e}")
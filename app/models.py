@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Index
 from sqlalchemy.sql import func
 from sqlalchemy import ForeignKey
 from .database import Base
@@ -33,9 +33,19 @@ class Question(Base):
     # Category: 'Complexity', 'Debugging', 'Concepts'
     category = Column(String, index=True)
 
+    # sha256 of the question text + options + answer, so reseeding is idempotent
+    content_hash = Column(String(64), unique=True, index=True, nullable=True)
+
 
 class Match(Base):
     __tablename__ = "matches"
+    __table_args__ = (
+        # Match history is read per player, newest first, keyset-paged on (played_at, id)
+        Index("ix_matches_player1_played", "player1_id", "played_at", "id"),
+        Index("ix_matches_player2_played", "player2_id", "played_at", "id"),
+        Index("ix_matches_winner_id", "winner_id"),
+        Index("ix_matches_played_at", "played_at", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     
@@ -50,4 +60,39 @@ class Match(Base):
     # Who won? (Nullable, because it could be a draw)
     winner_id = Column(Integer, ForeignKey("users.id"), nullable=True)
     
-    played_at = Column(DateTime(timezone=True), server_default=func.now())
\ No newline at end of file
+    played_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class UserStats(Base):
+    """Per-player totals, updated in the same transaction that inserts the matches."""
+    __tablename__ = "user_stats"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    games = Column(Integer, nullable=False, default=0)
+    wins = Column(Integer, nullable=False, default=0)
+    losses = Column(Integer, nullable=False, default=0)
+    draws = Column(Integer, nullable=False, default=0)
+    # Sum of the player's own scores; average = total_score / games
+    total_score = Column(Integer, nullable=False, default=0)
+
+
+class GameEvent(Base):
+    """Append-only analytics log, bulk-loaded from the Redis event stream."""
+    __tablename__ = "game_events"
+
+    id = Column(Integer, primary_key=True, index=True)
+    # Redis stream entry id; unique so a redelivered batch can't double-load
+    stream_id = Column(String, unique=True, nullable=False)
+    event_type = Column(String, nullable=False)  # GAME_START / ANSWER / FINISH_GAME / FORFEIT
+    game_id = Column(String, index=True, nullable=False)
+    username = Column(String, index=True)
+    opponent = Column(String)
+
+    # ANSWER only
+    question_id = Column(Integer, index=True)
+    answer = Column(String(1))
+    correct = Column(Boolean)
+    latency_ms = Column(Integer)
+
+    score = Column(Integer)
+    occurred_at = Column(DateTime(timezone=True), nullable=False)
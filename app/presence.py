@@ -0,0 +1,120 @@
+import os
+import socket
+import uuid
+from dotenv import load_dotenv
+
+from .redis_client import get_redis_client
+
+load_dotenv()
+
+# Every uvicorn worker gets its own id; it names the worker's pub/sub channel.
+NODE_ID = os.getenv("NODE_ID") or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+# presence:{username} -> node id. Expires unless the owning worker keeps heartbeating.
+PRESENCE_TTL_SECONDS = int(os.getenv("PRESENCE_TTL_SECONDS", "30"))
+PRESENCE_HEARTBEAT_SECONDS = float(os.getenv("PRESENCE_HEARTBEAT_SECONDS", "10"))
+
+PRESENCE_PREFIX = "presence:"
+NODE_CHANNEL_PREFIX = "node:"
+
+
+def presence_key(username: str) -> str:
+    return f"{PRESENCE_PREFIX}{username}"
+
+
+def node_channel(node_id: str | None = None) -> str:
+    return f"{NODE_CHANNEL_PREFIX}{node_id or NODE_ID}"
+
+
+# Only delete the presence entry if it still points at us
+# (the user may already have reconnected on another worker).
+UNREGISTER_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Refresh the TTL only while the entry still points at us; re-claim it if it expired.
+# Returns 0 if another worker owns it now (the user reconnected there).
+# KEYS[1] = presence key, ARGV[1] = node id, ARGV[2] = TTL (seconds)
+HEARTBEAT_SCRIPT = """
+local owner = redis.call('GET', KEYS[1])
+if owner == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+if not owner then
+    redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+    return 1
+end
+return 0
+"""
+
+# Look up the owning worker and publish to its channel in ONE round trip.
+# KEYS[1] = presence key, ARGV[1] = channel prefix, ARGV[2] = payload
+# Returns the number of subscribers that got it (0 = user offline everywhere).
+ROUTE_SCRIPT = """
+local node = redis.call('GET', KEYS[1])
+if not node then
+    return 0
+end
+return redis.call('PUBLISH', ARGV[1] .. node, ARGV[2])
+"""
+
+_scripts = {}
+
+
+def _script(redis, source: str):
+    if source not in _scripts:
+        _scripts[source] = redis.register_script(source)
+    return _scripts[source]
+
+
+async def register(username: str):
+    redis = get_redis_client()
+    await redis.set(presence_key(username), NODE_ID, ex=PRESENCE_TTL_SECONDS)
+
+
+async def unregister(username: str):
+    redis = get_redis_client()
+    await _script(redis, UNREGISTER_SCRIPT)(keys=[presence_key(username)], args=[NODE_ID], client=redis)
+
+
+async def heartbeat(usernames) -> list[str]:
+    """
+    Refreshes the TTL of every locally connected user in one pipelined round trip.
+    Returns the users whose entry now belongs to another worker: our sockets for them are stale.
+    """
+    usernames = list(usernames)
+    if not usernames:
+        return []
+    redis = get_redis_client()
+    script = _script(redis, HEARTBEAT_SCRIPT)
+    async with redis.pipeline(transaction=False) as pipe:
+        for username in usernames:
+            await script(keys=[presence_key(username)], args=[NODE_ID, PRESENCE_TTL_SECONDS], client=pipe)
+        owned = await pipe.execute()
+    return [username for username, ok in zip(usernames, owned) if not ok]
+
+
+async def online(usernames) -> list[bool]:
+    """Which of `usernames` have a live socket on any worker (one pipelined round trip)."""
+    usernames = list(usernames)
+    if not usernames:
+        return []
+    redis = get_redis_client()
+    async with redis.pipeline(transaction=False) as pipe:
+        for username in usernames:
+            pipe.exists(presence_key(username))
+        return [bool(n) for n in await pipe.execute()]
+
+
+async def route(username: str, payload: str) -> bool:
+    """Publishes `payload` to the worker holding `username`'s socket."""
+    redis = get_redis_client()
+    delivered = await _script(redis, ROUTE_SCRIPT)(
+        keys=[presence_key(username)],
+        args=[NODE_CHANNEL_PREFIX, payload],
+        client=redis
+    )
+    return bool(delivered)
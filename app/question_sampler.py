@@ -0,0 +1,140 @@
+import os
+import random
+import time
+from sqlalchemy import select
+from dotenv import load_dotenv
+
+from . import models, database
+from .redis_client import get_redis_client
+
+load_dotenv()
+
+# Config
+# Rebuild the id index at least this often (seconds), even without a reseed
+QUESTION_SAMPLER_REFRESH_SECONDS = float(os.getenv("QUESTION_SAMPLER_REFRESH_SECONDS", "300"))
+# How often (seconds) we ask Redis whether the question bank was reseeded
+QUESTION_SAMPLER_VERSION_CHECK_SECONDS = float(os.getenv("QUESTION_SAMPLER_VERSION_CHECK_SECONDS", "30"))
+
+
+# Bumped by seed scripts every time the `questions` table is rewritten.
+# Every worker compares it with the version it loaded and rebuilds its index.
+BANK_VERSION_KEY = "questions:version"
+
+
+async def get_bank_version() -> int:
+    redis = get_redis_client()
+    version = await redis.get(BANK_VERSION_KEY)
+    return int(version or 0)
+
+
+async def bump_bank_version() -> int:
+    """Call this after reseeding the questions table."""
+    redis = get_redis_client()
+    return await redis.incr(BANK_VERSION_KEY)
+
+
+def parse_quotas(raw: str | None) -> dict[str, int]:
+    """'Complexity:4,Debugging:3,Concepts:3' -> {'Complexity': 4, ...}"""
+    quotas = {}
+    for part in (raw or "").split(","):
+        if ":" not in part:
+            continue
+        category, count = part.rsplit(":", 1)
+        if category.strip() and int(count) > 0:
+            quotas[category.strip()] = int(count)
+    return quotas
+
+
+# Default category mix for a match, e.g. "Complexity:4,Debugging:3,Concepts:3".
+# Empty means "sample uniformly from the whole bank".
+DEFAULT_QUOTAS = parse_quotas(os.getenv("QUESTION_CATEGORY_QUOTAS"))
+
+
+class QuestionSampler:
+    """
+    Draws random questions without ORDER BY random().
+
+    Keeps every question id in memory (overall and per category), picks ids
+    with random.sample and then fetches only those rows by primary key.
+    """
+
+    def __init__(self):
+        self.all_ids: list[int] = []
+        self.ids_by_category: dict[str, list[int]] = {}
+        self.version = None
+        self.loaded_at = 0.0
+        self.version_checked_at = 0.0
+
+    async def refresh(self):
+        """Rebuilds the id index with one narrow (id, category) query."""
+        async with database.SessionLocal() as session:
+            result = await session.execute(
+                select(models.Question.id, models.Question.category)
+            )
+            rows = result.all()
+
+        all_ids = []
+        ids_by_category = {}
+        for row in rows:
+            all_ids.append(row.id)
+            ids_by_category.setdefault(row.category, []).append(row.id)
+
+        # Swap in one go so concurrent samplers never see a half-built index
+        self.all_ids = all_ids
+        self.ids_by_category = ids_by_category
+        self.loaded_at = time.monotonic()
+        return len(all_ids)
+
+    async def ensure_fresh(self):
+        now = time.monotonic()
+        stale = not self.all_ids or now - self.loaded_at >= QUESTION_SAMPLER_REFRESH_SECONDS
+
+        if now - self.version_checked_at >= QUESTION_SAMPLER_VERSION_CHECK_SECONDS:
+            self.version_checked_at = now
+            version = await get_bank_version()
+            if version != self.version:
+                self.version = version
+                stale = True
+
+        if stale:
+            await self.refresh()
+
+    def draw_ids(self, limit: int, quotas: dict[str, int] | None = None) -> list[int]:
+        """Picks `limit` distinct ids, honouring per-category quotas where possible."""
+        picked = []
+        seen = set()
+
+        for category, count in (quotas or {}).items():
+            pool = self.ids_by_category.get(category, [])
+            for qid in random.sample(pool, min(count, len(pool), limit - len(picked))):
+                picked.append(qid)
+                seen.add(qid)
+
+        # Fill whatever the quotas didn't cover (or a category ran short) from the whole bank
+        missing = limit - len(picked)
+        if missing > 0:
+            # Oversample a little so collisions with the quota picks rarely need a retry
+            sample_size = min(len(self.all_ids), missing + len(seen))
+            for qid in random.sample(self.all_ids, sample_size):
+                if len(picked) >= limit:
+                    break
+                if qid not in seen:
+                    picked.append(qid)
+                    seen.add(qid)
+
+        random.shuffle(picked)
+        return picked
+
+    async def fetch(self, ids) -> dict[int, models.Question]:
+        """One primary-key lookup for any number of ids."""
+        if not ids:
+            return {}
+
+        async with database.SessionLocal() as session:
+            result = await session.execute(
+                select(models.Question).where(models.Question.id.in_(set(ids)))
+            )
+            return {q.id: q for q in result.scalars().all()}
+
+
+question_sampler = QuestionSampler()
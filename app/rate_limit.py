@@ -0,0 +1,238 @@
+"""
+Token-bucket rate limits and DB admission control.
+
+Buckets are kept per process by default. With RATE_LIMIT_BACKEND=redis
+they live in Redis (one Lua call per check), so the limits hold across
+every worker; if Redis errors, the check falls back to the local bucket
+rather than failing the request.
+
+`db_admission` caps how much DB-touching work runs at once per worker.
+When every slot is busy a request may wait briefly in a short, bounded line;
+past that it is shed (Overloaded -> 503) instead of queueing behind the pool.
+"""
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
+
+from . import metrics
+from .redis_client import get_redis_client
+
+load_dotenv()
+
+# Config
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+# "local" (per process) or "redis" (shared by every worker)
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "local")
+# Distinct keys (users / IPs) tracked per local limiter; least recently seen are forgotten
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+# Behind a proxy the socket peer is the proxy; opt in to trusting X-Forwarded-For
+TRUST_FORWARDED_FOR = os.getenv("TRUST_FORWARDED_FOR", "false").lower() in ("1", "true", "yes")
+
+# DB-touching requests (login, register, history, rating lookups) allowed at once per worker
+DB_CONCURRENCY_LIMIT = int(os.getenv("DB_CONCURRENCY_LIMIT", "32"))
+# When all slots are busy: how many may wait for one, and for how long (seconds), before being shed
+DB_ADMISSION_MAX_WAITING = int(os.getenv("DB_ADMISSION_MAX_WAITING", str(DB_CONCURRENCY_LIMIT * 4)))
+DB_ADMISSION_TIMEOUT_SECONDS = float(os.getenv("DB_ADMISSION_TIMEOUT_SECONDS", "1.0"))
+
+RATE_LIMITED = metrics.Counter(
+    "codeclash_rate_limited_total", "Requests / messages rejected by a rate limit", ("limit",)
+)
+LOAD_SHED = metrics.Counter(
+    "codeclash_load_shed_total", "DB-touching work rejected because every slot was busy", ("name", "reason")
+)
+
+
+class RateLimited(Exception):
+    def __init__(self, limit: str, retry_after: float):
+        super().__init__(f"Rate limit exceeded ({limit})")
+        self.limit = limit
+        self.retry_after = retry_after
+
+
+class Overloaded(Exception):
+    pass
+
+
+# Refills and takes `cost` tokens in ONE round trip; the bucket expires once idle and full.
+# KEYS[1] = bucket hash; ARGV = rate (tokens/s), burst, cost, now (ms)
+# Returns {allowed (0/1), ms until enough tokens}
+BUCKET_SCRIPT = """
+local rate, burst, cost, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local b = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens, ts = tonumber(b[1]) or burst, tonumber(b[2]) or now
+tokens = math.min(burst, tokens + math.max(now - ts, 0) * rate / 1000)
+local allowed, wait = 0, 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    wait = math.ceil((cost - tokens) * 1000 / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst * 1000 / rate) + 1000)
+return {allowed, wait}
+"""
+
+_bucket_script = None
+
+
+class RateLimiter:
+    """`rate` tokens per second, up to `burst` at once, per key (user, IP...)."""
+
+    def __init__(self, name: str, rate: float, burst: float, backend: str = RATE_LIMIT_BACKEND):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.backend = backend
+        # key -> [tokens, last refill (monotonic)]
+        self.buckets: OrderedDict[str, list[float]] = OrderedDict()
+
+    def _take_local(self, key: str, cost: float) -> float:
+        """0 if allowed, else seconds until it would be."""
+        now = time.monotonic()
+        bucket = self.buckets.pop(key, None) or [self.burst, now]
+        bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        self.buckets[key] = bucket
+        while len(self.buckets) > RATE_LIMIT_MAX_KEYS:
+            self.buckets.popitem(last=False)
+
+        if bucket[0] >= cost:
+            bucket[0] -= cost
+            return 0.0
+        return (cost - bucket[0]) / self.rate
+
+    async def _take_redis(self, key: str, cost: float) -> float:
+        global _bucket_script
+        redis = get_redis_client()
+        if _bucket_script is None:
+            _bucket_script = redis.register_script(BUCKET_SCRIPT)
+        allowed, wait_ms = await _bucket_script(
+            keys=[f"ratelimit:{self.name}:{key}"],
+            args=[self.rate, self.burst, cost, int(time.time() * 1000)],
+            client=redis
+        )
+        return 0.0 if int(allowed) else int(wait_ms) / 1000
+
+    async def retry_after(self, key: str, cost: float = 1) -> float:
+        """0 if allowed (tokens taken), else seconds to wait; rejections are counted."""
+        if not RATE_LIMIT_ENABLED or not key:
+            return 0.0
+        wait = None
+        if self.backend == "redis":
+            try:
+                wait = await self._take_redis(key, cost)
+            except Exception as e:
+                print(f"❌ Shared rate limit unavailable, using the local bucket: {e}")
+        if wait is None:
+            wait = self._take_local(key, cost)
+        if wait > 0:
+            RATE_LIMITED.inc(self.name)
+        return wait
+
+    async def hit(self, key: str, cost: float = 1):
+        """Raises RateLimited if `key` is over the limit."""
+        wait = await self.retry_after(key, cost)
+        if wait > 0:
+            raise RateLimited(self.name, wait)
+
+
+def _limiter(name: str, default_rate: str, default_burst: str) -> RateLimiter:
+    """Reads RATE_LIMIT_{NAME}_PER_SECOND / _BURST from the environment."""
+    env = name.upper()
+    return RateLimiter(
+        name,
+        float(os.getenv(f"RATE_LIMIT_{env}_PER_SECOND", default_rate)),
+        float(os.getenv(f"RATE_LIMIT_{env}_BURST", default_burst))
+    )
+
+
+# --- LIMITS ---
+# Messages on one player's socket (answers, finish, cancel)
+ws_messages = _limiter("ws_message", "10", "20")
+# New sockets per IP
+ws_connects = _limiter("ws_connect_ip", "2", "20")
+# Login attempts: per IP and per target username (each one costs an Argon2 verify)
+login_ip = _limiter("login_ip", "0.5", "10")
+login_user = _limiter("login_user", "0.2", "5")
+# Sign-ups per IP
+register_ip = _limiter("register_ip", "0.1", "5")
+# Username availability checks per IP (the signup form checks as the user types)
+username_check_ip = _limiter("username_check_ip", "5", "30")
+
+
+def client_ip(connection) -> str:
+    """Request or WebSocket -> caller's IP."""
+    if TRUST_FORWARDED_FOR:
+        forwarded = connection.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return connection.client.host if connection.client else ""
+
+
+# --- ADMISSION CONTROL ---
+class ConcurrencyLimiter:
+    """
+    At most `limit` holders at once. A full limiter lets up to `max_waiting`
+    callers wait `timeout` seconds for a slot; everyone else is shed at once.
+    """
+
+    def __init__(self, name: str, limit: int, max_waiting: int, timeout: float):
+        self.name = name
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self.released = asyncio.Condition()
+
+    def _shed(self, reason: str):
+        LOAD_SHED.inc(self.name, reason)
+        return Overloaded(f"Server busy ({self.name}), please retry shortly")
+
+    async def _acquire(self):
+        # No await between check and increment, so the fast path is race-free on one event loop
+        if self.in_flight < self.limit:
+            self.in_flight += 1
+            return
+        if self.waiting >= self.max_waiting:
+            raise self._shed("queue_full")
+
+        self.waiting += 1
+        try:
+            async with self.released:
+                await asyncio.wait_for(
+                    self.released.wait_for(lambda: self.in_flight < self.limit), self.timeout
+                )
+                self.in_flight += 1
+        except asyncio.TimeoutError:
+            raise self._shed("timeout") from None
+        finally:
+            self.waiting -= 1
+
+    async def _release(self):
+        self.in_flight -= 1
+        if self.waiting:
+            async with self.released:
+                self.released.notify()
+
+    @asynccontextmanager
+    async def __call__(self):
+        await self._acquire()
+        try:
+            yield
+        finally:
+            await self._release()
+
+
+db_admission = ConcurrencyLimiter(
+    "db", DB_CONCURRENCY_LIMIT, DB_ADMISSION_MAX_WAITING, DB_ADMISSION_TIMEOUT_SECONDS
+)
+
+metrics.Gauge("codeclash_db_admission_in_flight", "DB-touching requests running on this worker",
+              collect=lambda: db_admission.in_flight)
+metrics.Gauge("codeclash_db_admission_waiting", "DB-touching requests waiting for a slot on this worker",
+              collect=lambda: db_admission.waiting)
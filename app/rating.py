@@ -0,0 +1,27 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# ELO config
+DEFAULT_RATING = 1000
+ELO_K_FACTOR = float(os.getenv("ELO_K_FACTOR", "32"))
+
+
+def match_outcome(score1: int, score2: int) -> float:
+    """Player 1's result: 1 = win, 0.5 = draw, 0 = loss."""
+    if score1 > score2:
+        return 1.0
+    if score1 < score2:
+        return 0.0
+    return 0.5
+
+
+def expected_score(rating_a: float, rating_b: float) -> float:
+    return 1.0 / (1.0 + 10 ** ((rating_b - rating_a) / 400.0))
+
+
+def elo_update(rating1: float, rating2: float, outcome: float, k: float = ELO_K_FACTOR):
+    """Returns both players' new ratings after one match (`outcome` is player 1's result)."""
+    delta = k * (outcome - expected_score(rating1, rating2))
+    return rating1 + delta, rating2 - delta
@@ -0,0 +1,148 @@
+import numpy as np
+
+from .rating import DEFAULT_RATING, ELO_K_FACTOR
+
+# Below this many matches per round on average, a chunk is replayed match by match instead
+MIN_ROUND_SIZE = 32
+
+
+class RatingEngine:
+    """
+    Vectorized ELO replay over the match history.
+
+    Ratings live in one float64 array indexed by user id. Matches are fed in
+    `played_at` order, chunk by chunk. Inside a chunk each match is assigned a
+    "round": one past the last round either player appeared in. Matches in the
+    same round share no players, so a whole round is updated with one set of
+    NumPy fancy-indexing operations. When rounds are small (a few players with
+    many games each) the chunk is replayed match by match instead. Either way
+    the result matches applying `elo_update` one match at a time, in order.
+    """
+
+    def __init__(self, max_user_id: int, k: float = ELO_K_FACTOR, initial: float = DEFAULT_RATING):
+        self.k = k
+        self.initial = initial
+        self.ratings = np.full(max_user_id + 1, initial, dtype=np.float64)
+        self.games = np.zeros(max_user_id + 1, dtype=np.int64)
+        self.matches = 0
+
+    def _ensure_capacity(self, max_id: int):
+        if max_id < len(self.ratings):
+            return
+        extra = max_id + 1 - len(self.ratings)
+        self.ratings = np.concatenate([self.ratings, np.full(extra, self.initial)])
+        self.games = np.concatenate([self.games, np.zeros(extra, dtype=np.int64)])
+
+    @staticmethod
+    def link(p1: np.ndarray, p2: np.ndarray):
+        """
+        Each match's previous and next match of either player inside the chunk
+        (-1 = none), from one stable sort over all appearances, plus the most
+        games any one player has in the chunk.
+        """
+        n = len(p1)
+        # Appearance 2i is match i's player 1, 2i + 1 its player 2
+        players = np.column_stack((p1, p2)).ravel()
+        # (player, appearance) keys are unique, so the default sort keeps played order (and beats kind="stable")
+        order = np.argsort(players * (2 * n) + np.arange(2 * n))
+        sorted_players = players[order]
+        same = sorted_players[1:] == sorted_players[:-1]
+        earlier, later = order[:-1][same], order[1:][same]
+
+        prev = np.full(2 * n, -1, dtype=np.int64)
+        nxt = np.full(2 * n, -1, dtype=np.int64)
+        prev[later] = earlier // 2
+        nxt[earlier] = later // 2
+
+        runs = np.diff(np.flatnonzero(np.concatenate(([True], ~same, [True]))))
+        return prev[0::2], prev[1::2], nxt[0::2], nxt[1::2], int(runs.max())
+
+    @staticmethod
+    def rounds(prev1, prev2, next1, next2):
+        """
+        Yields the matches of each round, in order: a match joins the round
+        after the last of its players' earlier matches (a topological layering,
+        O(n) in total). A rematch waits on the same previous match through both
+        seats; that counts once.
+        """
+        waiting = (prev1 >= 0).astype(np.int64) + ((prev2 >= 0) & (prev2 != prev1))
+        slot = np.empty(len(waiting), dtype=np.int64)
+        frontier = np.flatnonzero(waiting == 0)
+        while len(frontier):
+            yield frontier
+            a, b = next1[frontier], next2[frontier]
+            released = np.concatenate([a[a >= 0], b[(b >= 0) & (b != a)]])
+            np.subtract.at(waiting, released, 1)
+            released = released[waiting[released] == 0]
+            # Both of a match's previous matches may finish in the same round: keep one copy
+            slot[released] = np.arange(len(released))
+            frontier = released[slot[released] == np.arange(len(released))]
+
+    def _apply_rounds(self, p1, p2, outcome, links):
+        """One set of fancy-indexing operations per round."""
+        ratings = self.ratings
+        for idx in self.rounds(*links):
+            a, b = p1[idx], p2[idx]
+            ra, rb = ratings[a], ratings[b]
+            delta = self.k * (outcome[idx] - 1.0 / (1.0 + 10.0 ** ((rb - ra) / 400.0)))
+            ratings[a] = ra + delta
+            ratings[b] = rb - delta
+
+    def _apply_sequential(self, p1, p2, outcome):
+        """Match by match over plain floats, for chunks whose rounds are too small to vectorize."""
+        ids, local = np.unique(np.concatenate([p1, p2]), return_inverse=True)
+        ratings = self.ratings[ids].tolist()
+        n = len(p1)
+        k = self.k
+        for a, b, result in zip(local[:n].tolist(), local[n:].tolist(), outcome.tolist()):
+            ra, rb = ratings[a], ratings[b]
+            delta = k * (result - 1.0 / (1.0 + 10.0 ** ((rb - ra) / 400.0)))
+            ratings[a] = ra + delta
+            ratings[b] = rb - delta
+        self.ratings[ids] = ratings
+
+    def apply_chunk(self, player1_ids, player2_ids, score1, score2):
+        """Applies one chunk of matches, given in played order."""
+        p1 = np.asarray(player1_ids, dtype=np.int64)
+        p2 = np.asarray(player2_ids, dtype=np.int64)
+        s1 = np.asarray(score1, dtype=np.float64)
+        s2 = np.asarray(score2, dtype=np.float64)
+
+        # A self-match can't move a rating; dropping it keeps rounds well defined
+        keep = p1 != p2
+        p1, p2, s1, s2 = p1[keep], p2[keep], s1[keep], s2[keep]
+        if len(p1) == 0:
+            return 0
+
+        self._ensure_capacity(int(max(p1.max(), p2.max())))
+        # Player 1's result: 1 = win, 0.5 = draw, 0 = loss
+        outcome = np.where(s1 > s2, 1.0, np.where(s1 < s2, 0.0, 0.5))
+
+        *links, longest = self.link(p1, p2)
+        # There are at least as many rounds as one player's games. Few players with many
+        # games each make rounds so small that the per-round NumPy overhead dominates.
+        if len(p1) >= MIN_ROUND_SIZE * longest:
+            self._apply_rounds(p1, p2, outcome, links)
+        else:
+            self._apply_sequential(p1, p2, outcome)
+
+        np.add.at(self.games, p1, 1)
+        np.add.at(self.games, p2, 1)
+        self.matches += len(p1)
+        return len(p1)
+
+    def rounded(self) -> np.ndarray:
+        return np.rint(self.ratings).astype(np.int64)
+
+
+def replay_scalar(matches, k: float = ELO_K_FACTOR, initial: float = DEFAULT_RATING) -> dict[int, float]:
+    """Reference implementation: one `elo_update` per match, in order."""
+    from .rating import elo_update, match_outcome
+
+    ratings = {}
+    for p1, p2, s1, s2 in matches:
+        if p1 == p2:
+            continue
+        r1, r2 = elo_update(ratings.get(p1, initial), ratings.get(p2, initial), match_outcome(s1, s2), k)
+        ratings[p1], ratings[p2] = r1, r2
+    return ratings
@@ -1,10 +1,20 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, AfterValidator
 from datetime import datetime
-from typing import Optional
+from typing import Annotated, Optional
+
+
+def normalize_username(value: str) -> str:
+    """The one spelling of a username used for signup, login and availability checks."""
+    value = value.strip()
+    if not value:
+        raise ValueError("Username required")
+    return value
+
+Username = Annotated[str, AfterValidator(normalize_username)]
 
 # Base Schema (Shared properties)
 class UserBase(BaseModel):
-    username: str
+    username: Username
     email: EmailStr
 
 # Schema for creating a user (Password required)
@@ -13,7 +23,7 @@ class UserCreate(UserBase):
 
 # Schema for logging in
 class UserLogin(BaseModel):
-    username: str
+    username: Username
     password: str
 
 # Schema for returning user data (NEVER return the password)
@@ -24,4 +34,46 @@ class UserResponse(UserBase):
     is_active: bool
 
     class ConfigDict:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class UsernameAvailability(BaseModel):
+    username: str
+    available: bool
+
+# --- LEADERBOARD ---
+class LeaderboardEntry(BaseModel):
+    rank: int
+    username: str
+    rating: int
+
+class LeaderboardPage(BaseModel):
+    entries: list[LeaderboardEntry]
+    next_cursor: Optional[int] = None
+
+class PlayerStanding(BaseModel):
+    username: str
+    rank: int
+    rating: int
+    neighbours: list[LeaderboardEntry]
+
+# --- MATCH HISTORY ---
+class MatchHistoryEntry(BaseModel):
+    id: int
+    played_at: datetime
+    opponent: str
+    score: int
+    opponent_score: int
+    result: str  # "win" / "loss" / "draw"
+
+class MatchHistoryPage(BaseModel):
+    matches: list[MatchHistoryEntry]
+    next_cursor: Optional[str] = None
+
+class PlayerStats(BaseModel):
+    username: str
+    rating: int
+    games: int
+    wins: int
+    losses: int
+    draws: int
+    average_score: float
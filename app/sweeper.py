@@ -0,0 +1,108 @@
+import asyncio
+import os
+from dotenv import load_dotenv
+
+from . import game_state, matchmaker, presence, game_utils, metrics
+from .connections import manager
+from .event_log import event_log
+
+load_dotenv()
+
+# Config
+# How long (seconds) a player who dropped mid-game has to reconnect before forfeiting
+FORFEIT_GRACE_SECONDS = float(os.getenv("FORFEIT_GRACE_SECONDS", "20"))
+# How often (seconds) each worker settles due forfeits and purges ghost players
+SWEEPER_INTERVAL_SECONDS = float(os.getenv("SWEEPER_INTERVAL_SECONDS", "2"))
+GHOST_SCAN_BATCH = 500
+
+FORFEITS = metrics.Counter("codeclash_forfeits_total", "Games ended by a player's forfeit")
+GHOSTS_REMOVED = metrics.Counter(
+    "codeclash_ghost_players_removed_total", "Queued players removed because they had no live socket"
+)
+
+
+async def handle_disconnect(username: str):
+    """Socket gone: leave the queue, and start the grace timer if mid-game."""
+    await matchmaker.remove_from_queue(username)
+    game_id = await game_state.schedule_forfeit(username, FORFEIT_GRACE_SECONDS)
+    if game_id:
+        print(f"⏳ {username} left {game_id}; forfeits in {FORFEIT_GRACE_SECONDS:.0f}s unless they return")
+    return game_id
+
+
+async def handle_reconnect(username: str):
+    """Cancels a pending forfeit. Returns the game the player is still in, or None."""
+    await game_state.cancel_forfeit(username)
+    return await game_state.get_current_game(username)
+
+
+async def settle_forfeit(username: str):
+    # Came back on some worker after the timer was set (connect() cancels it, this is the backstop)
+    if (await presence.online([username]))[0]:
+        return False
+
+    game = await game_state.get_current_game(username)
+    if game is None:
+        return False
+    result = await game_state.forfeit(game["game_id"], username)
+    if result is None:
+        # Finished (or the game ended) in the meantime
+        return False
+
+    game_id, players = game["game_id"], result["players"]
+    print(f"🏳️ {username} forfeited {game_id}")
+    await game_utils.save_match(game_id, result["scores"], players, forfeit_by=username)
+    await game_state.clear_game_data(game_id, players)
+    FORFEITS.inc()
+
+    opponent = players[1] if players[0] == username else players[0]
+    event_log.emit("FORFEIT", game_id, username=username, opponent=opponent)
+    await manager.send_personal_message({
+        "type": "OPPONENT_FORFEIT",
+        "game_id": game_id,
+        "opponent": username
+    }, opponent)
+    return True
+
+
+async def purge_ghosts() -> int:
+    """Removes queued players whose presence expired (e.g. their worker died)."""
+    removed = 0
+    offset = 0
+    while True:
+        waiting = await matchmaker.get_waiting(offset, GHOST_SCAN_BATCH)
+        if not waiting:
+            break
+        ghosts = [u for u, live in zip(waiting, await presence.online(waiting)) if not live]
+        if ghosts:
+            await matchmaker.remove_from_queue(*ghosts)
+            removed += len(ghosts)
+        offset += len(waiting) - len(ghosts)
+        if len(waiting) < GHOST_SCAN_BATCH:
+            break
+
+    if removed:
+        GHOSTS_REMOVED.inc(amount=removed)
+        print(f"👻 Removed {removed} ghost players from the queue")
+    return removed
+
+
+async def sweep():
+    for username in await game_state.claim_due_forfeits():
+        try:
+            await settle_forfeit(username)
+        except Exception as e:
+            print(f"❌ Forfeit for {username} failed: {e}")
+    await purge_ghosts()
+
+
+async def run_sweeper(interval: float = SWEEPER_INTERVAL_SECONDS):
+    """Runs on every worker; claims are atomic, so workers never double-handle a forfeit."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await sweep()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"❌ Sweeper failed: {e}")
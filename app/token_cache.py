@@ -0,0 +1,85 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+from . import auth, metrics
+
+load_dotenv()
+
+# Config
+TOKEN_CACHE_MAX_SIZE = int(os.getenv("TOKEN_CACHE_MAX_SIZE", "10000"))
+# Re-verify a token at least this often (seconds), even if it's valid for longer
+TOKEN_CACHE_TTL_SECONDS = float(os.getenv("TOKEN_CACHE_TTL_SECONDS", "300"))
+
+TOKEN_VERIFY_SECONDS = metrics.Histogram(
+    "codeclash_token_verify_seconds", "Full JWT verification (signature + decode) on a cache miss"
+)
+
+
+class TokenCache:
+    """
+    Process-local cache of verified JWT claims.
+
+    Keyed by the SHA-256 digest of the token, so the cache never holds the
+    tokens themselves. Entries live until the token's own `exp` or
+    TOKEN_CACHE_TTL_SECONDS, whichever comes first; reconnects with the
+    same token skip the HMAC check and JSON decode entirely.
+    """
+
+    def __init__(self, max_size: int = TOKEN_CACHE_MAX_SIZE, ttl: float = TOKEN_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl = ttl
+        # digest -> (claims, expires_at as unix time)
+        self.entries: OrderedDict[bytes, tuple[dict, float]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+
+    def verify(self, token: str | None) -> dict | None:
+        """Claims of a valid token, or None (missing, bad signature, expired)."""
+        if not token:
+            return None
+        digest = hashlib.sha256(token.encode()).digest()
+        now = time.time()
+
+        entry = self.entries.get(digest)
+        if entry is not None:
+            claims, expires_at = entry
+            if now < expires_at:
+                self.entries.move_to_end(digest)
+                self.hits += 1
+                return claims
+            del self.entries[digest]
+            self.expired += 1
+
+        self.misses += 1
+        with metrics.timed(TOKEN_VERIFY_SECONDS):
+            claims = auth.decode_access_token(token)
+        if claims is None:
+            # Failures aren't cached: a flood of junk tokens can't evict good ones
+            return None
+
+        expires_at = now + self.ttl
+        if isinstance(claims.get("exp"), (int, float)):
+            expires_at = min(expires_at, claims["exp"])
+        self.entries[digest] = (claims, expires_at)
+        # Size bound: evict the least recently used tokens
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+        return claims
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
+
+
+token_cache = TokenCache()
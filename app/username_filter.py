@@ -0,0 +1,177 @@
+"""
+Bloom filter of taken usernames, kept in Redis so every worker shares it.
+
+"Definitely not taken" answers come from the filter alone, so the signup
+form can check availability on every keystroke without touching Postgres;
+only "maybe taken" (a real name, or a false positive at ~USERNAME_FILTER_ERROR_RATE)
+falls through to the database. Registrations add their name; the filter is
+rebuilt from Postgres when missing (first boot, flushed Redis).
+"""
+import asyncio
+import hashlib
+import math
+import os
+import uuid
+from sqlalchemy import select
+from dotenv import load_dotenv
+
+from . import models, database, metrics, rate_limit
+from .redis_client import get_redis_client
+
+load_dotenv()
+
+# Config: sized for this many usernames at this false-positive rate (more names -> more false positives)
+USERNAME_FILTER_CAPACITY = int(os.getenv("USERNAME_FILTER_CAPACITY", "1000000"))
+USERNAME_FILTER_ERROR_RATE = float(os.getenv("USERNAME_FILTER_ERROR_RATE", "0.01"))
+REBUILD_CHUNK_SIZE = 5000
+# One rebuild at a time across workers; the lock outlives a stuck one by this much
+REBUILD_LOCK_SECONDS = 300
+
+USERNAME_CHECKS = metrics.Counter(
+    "codeclash_username_checks_total", "Username availability checks by how they were answered", ("result",)
+)
+
+# Sets the bits on every filter in KEYS: the live one and, during a rebuild, the scratch one.
+# A missing filter stays missing (a partial one would report taken names as free).
+# KEYS = filters; ARGV = bit offsets
+ADD_SCRIPT = """
+for _, key in ipairs(KEYS) do
+    if redis.call('EXISTS', key) == 1 then
+        for i = 1, #ARGV do
+            redis.call('SETBIT', key, ARGV[i], 1)
+        end
+    end
+end
+return 1
+"""
+
+# KEYS[1] = filter; ARGV = bit offsets
+# Returns -1 if there is no filter, 0 if definitely absent, 1 if maybe present
+CHECK_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return -1
+end
+for i = 1, #ARGV do
+    if redis.call('GETBIT', KEYS[1], ARGV[i]) == 0 then
+        return 0
+    end
+end
+return 1
+"""
+
+
+class UsernameFilter:
+    def __init__(self, capacity: int = USERNAME_FILTER_CAPACITY, error_rate: float = USERNAME_FILTER_ERROR_RATE):
+        # Optimal size / hash count for the target false-positive rate
+        self.bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        # Sizing is in the key: a new configuration builds a new filter instead of misreading the old one.
+        # It is also the hash tag, so the scratch and lock keys land in the same cluster slot (RENAME, ADD_SCRIPT).
+        self.key = f"username_filter:{{{self.bits}:{self.hashes}}}"
+        # Scratch filters are per rebuild; this key names the one in progress
+        self.rebuild_key = f"{self.key}:rebuild"
+        self.lock_key = f"{self.key}:rebuild:lock"
+        self._add_script = None
+        self._check_script = None
+
+    def offsets(self, username: str) -> list[int]:
+        """k bit positions by double hashing one 128-bit digest."""
+        digest = hashlib.blake2b(username.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:], "big") | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def _scripts(self, redis):
+        if self._add_script is None:
+            self._add_script = redis.register_script(ADD_SCRIPT)
+            self._check_script = redis.register_script(CHECK_SCRIPT)
+
+    async def add(self, username: str):
+        redis = get_redis_client()
+        self._scripts(redis)
+        # The name is committed before this runs, so a rebuild that starts after this read still sees it
+        scratch = await redis.get(self.rebuild_key)
+        keys = [self.key, scratch] if scratch else [self.key]
+        await self._add_script(keys=keys, args=self.offsets(username), client=redis)
+
+    async def might_contain(self, username: str) -> bool | None:
+        """False = definitely free, True = maybe taken, None = no filter (ask the DB)."""
+        redis = get_redis_client()
+        self._scripts(redis)
+        found = int(await self._check_script(keys=[self.key], args=self.offsets(username), client=redis))
+        return None if found < 0 else bool(found)
+
+    async def rebuild(self) -> int | None:
+        """
+        Fills a scratch filter from Postgres in chunks and RENAMEs it over the
+        live one. Registrations during the rebuild land in both, so none is lost.
+        Returns None (and does nothing) if another worker is already rebuilding.
+        """
+        redis = get_redis_client()
+        token = uuid.uuid4().hex
+        if not await redis.set(self.lock_key, token, nx=True, ex=REBUILD_LOCK_SECONDS):
+            return None
+
+        scratch = f"{self.rebuild_key}:{token}"
+        try:
+            # Allocate it up front and point add() at it before reading any names
+            await redis.setbit(scratch, self.bits - 1, 0)
+            await redis.set(self.rebuild_key, scratch, ex=REBUILD_LOCK_SECONDS)
+
+            count = 0
+            async with database.SessionLocal() as session:
+                result = await session.stream(
+                    select(models.User.username).execution_options(yield_per=REBUILD_CHUNK_SIZE)
+                )
+                async for chunk in result.partitions(REBUILD_CHUNK_SIZE):
+                    async with redis.pipeline(transaction=False) as pipe:
+                        for (username,) in chunk:
+                            for offset in self.offsets(username):
+                                pipe.setbit(scratch, offset, 1)
+                        await pipe.execute()
+                    count += len(chunk)
+
+            await redis.rename(scratch, self.key)
+            return count
+        finally:
+            await redis.delete(self.rebuild_key, scratch)
+            if await redis.get(self.lock_key) == token:
+                await redis.delete(self.lock_key)
+
+    async def rebuild_if_missing(self):
+        """Losing the rebuild race to another booting worker counts as done."""
+        redis = get_redis_client()
+        if not await redis.exists(self.key):
+            return await self.rebuild()
+        return None
+
+    async def is_available(self, username: str) -> bool:
+        """Filter first; the database (under admission control) only for names the filter can't rule out."""
+        try:
+            maybe_taken = await self.might_contain(username)
+        except Exception as e:
+            print(f"❌ Username filter unavailable, checking the database: {e}")
+            maybe_taken = None
+        if maybe_taken is False:
+            USERNAME_CHECKS.inc("filter_free")
+            return True
+
+        async with rate_limit.db_admission(), database.SessionLocal() as session:
+            result = await session.execute(
+                select(models.User.id).where(models.User.username == username).limit(1)
+            )
+            taken = result.first() is not None
+        USERNAME_CHECKS.inc("db_taken" if taken else "db_free")
+        return not taken
+
+
+username_filter = UsernameFilter()
+
+
+if __name__ == "__main__":
+    # python -m app.username_filter  -> rebuild from Postgres on demand
+    count = asyncio.run(username_filter.rebuild())
+    if count is None:
+        print("⏳ Another worker is rebuilding the username filter")
+    else:
+        print(f"✅ Username filter rebuilt with {count} names")
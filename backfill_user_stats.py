@@ -0,0 +1,39 @@
+"""
+One-off migration for match history: adds the `matches` indexes and
+(re)builds the `user_stats` aggregates from the existing history.
+
+    python backfill_user_stats.py
+
+create_all only creates indexes together with a new table, so existing
+databases need this once. Safe to re-run; it also repairs drifted stats.
+Run it with the match writers stopped, or stats for games saved meanwhile
+may be counted twice.
+"""
+import asyncio
+import time
+
+from app import match_history
+from app.database import engine, SessionLocal, Base
+from app.models import Match
+
+
+async def backfill():
+    started = time.perf_counter()
+
+    # 1. New table + any missing indexes on `matches`
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        for index in Match.__table__.indexes:
+            await conn.run_sync(lambda sync_conn, index=index: index.create(sync_conn, checkfirst=True))
+
+    # 2. Aggregates from the full history, swapped in one transaction
+    async with SessionLocal() as session:
+        players = await match_history.rebuild_stats(session)
+        await session.commit()
+
+    print(f"✅ Stats rebuilt for {players} players ({time.perf_counter() - started:.1f}s)")
+
+
+if __name__ == "__main__":
+    print("🚀 Backfilling match indexes and player stats...")
+    asyncio.run(backfill())
@@ -0,0 +1,106 @@
+"""
+Codec micro-benchmark: GAME_START fan-out and small-message encode/decode.
+
+Compares the old path (stdlib json.dumps of the full GAME_START once per
+player) with codec.Payload (shared part encoded once, `opponent` spliced in),
+for JSON (stdlib / orjson) and MessagePack. Also times the small messages
+that dominate a game: SUBMIT_ANSWER decode and ANSWER_RESULT encode.
+
+    python -m benchmarks.bench_codec --iterations 20000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import codec
+
+
+def game_start_shared(question_count: int = 10):
+    return {
+        "type": "GAME_START",
+        "game_id": "game_alice_bob",
+        "questions": [
+            {
+                "id": 1000 + i,
+                "question": f"What is the time complexity of algorithm #{i} when the input is already sorted?",
+                "options": {"A": "O(1)", "B": "O(log n)", "C": "O(n)", "D": "O(n log n)"},
+                "category": "Complexity"
+            }
+            for i in range(question_count)
+        ],
+        "config": {"question_count": question_count, "timer_per_question": 15}
+    }
+
+
+def per_op_us(fn, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20_000)
+    args = parser.parse_args()
+    n = args.iterations
+
+    shared = game_start_shared()
+
+    def stdlib_game_start():
+        # Old start_game: mutate one dict, json.dumps it for each player
+        payload = dict(shared, opponent="")
+        payload["opponent"] = "bob"
+        json.dumps(payload)
+        payload["opponent"] = "alice"
+        json.dumps(payload)
+
+    def payload_game_start(encoding):
+        def run():
+            payload = codec.Payload(shared)
+            codec.encode(payload.bind(opponent="bob"), encoding)
+            codec.encode(payload.bind(opponent="alice"), encoding)
+        return run
+
+    answer = {"type": "SUBMIT_ANSWER", "game_id": "game_alice_bob", "q_id": 1003, "answer": "C", "opponent": "bob"}
+    result = {"type": "ANSWER_RESULT", "correct": True, "score": 40, "correct_option": "C"}
+    answer_json = json.dumps(answer)
+
+    results = {
+        "json_backend": "orjson" if codec.orjson is not None else "stdlib",
+        "game_start_bytes": {"json": len(json.dumps(dict(shared, opponent="bob")).encode())},
+        "game_start_us_per_pair": {
+            "stdlib_json_twice": round(per_op_us(stdlib_game_start, n), 2),
+            "payload_json": round(per_op_us(payload_game_start(codec.JSON), n), 2)
+        },
+        "small_message_us": {
+            "decode_stdlib_json": round(per_op_us(lambda: json.loads(answer_json), n * 5), 3),
+            "decode_codec_json": round(per_op_us(lambda: codec.decode(answer_json), n * 5), 3),
+            "encode_stdlib_json": round(per_op_us(lambda: json.dumps(result), n * 5), 3),
+            "encode_codec_json": round(per_op_us(lambda: codec.encode(result), n * 5), 3)
+        }
+    }
+
+    if codec.msgpack is not None:
+        answer_msgpack = codec.encode(answer, codec.MSGPACK)
+        results["game_start_bytes"]["msgpack"] = len(codec.encode(codec.Payload(shared).bind(opponent="bob"), codec.MSGPACK))
+        results["game_start_us_per_pair"]["payload_msgpack"] = round(per_op_us(payload_game_start(codec.MSGPACK), n), 2)
+        results["small_message_us"]["decode_msgpack"] = round(
+            per_op_us(lambda: codec.decode(answer_msgpack, codec.MSGPACK), n * 5), 3)
+        results["small_message_us"]["encode_msgpack"] = round(
+            per_op_us(lambda: codec.encode(result, codec.MSGPACK), n * 5), 3)
+
+    # Sanity: the spliced frames decode to exactly what the old path sent
+    for encoding in codec.available_encodings():
+        frame = codec.encode(codec.Payload(shared).bind(opponent="bob"), encoding)
+        assert codec.decode(frame, encoding) == dict(shared, opponent="bob"), encoding
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
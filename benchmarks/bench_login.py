@@ -0,0 +1,95 @@
+"""
+Login micro-benchmark: Argon2 verify throughput and the event-loop lag it causes.
+
+Compares calling auth.verify_password inline (old /login behaviour) with
+auth.verify_password_async (hashing pool). A ticker task measures how late
+the loop wakes up while logins are in flight.
+
+    python -m benchmarks.bench_login --logins 64 --concurrency 16
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SECRET_KEY", "bench")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
+
+from app import auth
+
+TICK_SECONDS = 0.005
+
+
+async def measure_lag(stop: asyncio.Event, samples: list):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK_SECONDS)
+        samples.append((time.perf_counter() - start - TICK_SECONDS) * 1000)
+
+
+async def run(mode: str, hashed: str, logins: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def login_inline():
+        async with semaphore:
+            assert auth.verify_password("hunter2", hashed)
+            await asyncio.sleep(0)
+
+    async def login_offloaded():
+        async with semaphore:
+            is_valid, _ = await auth.verify_password_async("hunter2", hashed)
+            assert is_valid
+
+    login = login_inline if mode == "inline" else login_offloaded
+    stop = asyncio.Event()
+    lag = []
+    ticker = asyncio.create_task(measure_lag(stop, lag))
+
+    start = time.perf_counter()
+    await asyncio.gather(*[login() for _ in range(logins)])
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await ticker
+    lag.sort()
+    return {
+        "mode": mode,
+        "logins": logins,
+        "logins_per_sec": round(logins / elapsed, 1),
+        "loop_lag_ms": {
+            "avg": round(statistics.fmean(lag), 2) if lag else None,
+            "p99": round(lag[min(int(len(lag) * 0.99), len(lag) - 1)], 2) if lag else None,
+            "max": round(lag[-1], 2) if lag else None
+        }
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--logins", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    hashed = auth.get_password_hash("hunter2")
+    report = {
+        "argon2": {
+            "time_cost": auth.ARGON2_TIME_COST,
+            "memory_cost_kib": auth.ARGON2_MEMORY_COST,
+            "parallelism": auth.ARGON2_PARALLELISM,
+            "pool_size": auth.PASSWORD_HASH_CONCURRENCY
+        },
+        "results": [
+            await run("inline", hashed, args.logins, args.concurrency),
+            await run("offloaded", hashed, args.logins, args.concurrency)
+        ]
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
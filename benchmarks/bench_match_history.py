@@ -0,0 +1,202 @@
+"""
+Match history / player stats benchmark.
+
+Seeds a throwaway database (SQLite unless --database-url is given) with a
+few million matches, then compares, for a "hot" player who sits in a share
+of all games:
+
+  * history pages: keyset (played_at, id) vs OFFSET paging at the same depth
+  * stats: the maintained user_stats row vs aggregating the history per request
+
+    python -m benchmarks.bench_match_history --matches 2000000 --users 20000
+    python -m benchmarks.bench_match_history --database-url postgresql+asyncpg://... --reset
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def configure_env(args):
+    """Must run before `app` is imported: its modules read config at import time."""
+    db_path = os.path.join(tempfile.mkdtemp(prefix="codeclash-history-"), "history.db")
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite+aiosqlite:///{db_path}"
+    os.environ.setdefault("REDIS_URL", "redis://localhost:6379/0")
+    os.environ.setdefault("SECRET_KEY", "bench")
+    os.environ.setdefault("ALGORITHM", "HS256")
+    os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "60")
+
+
+async def seed(args):
+    from sqlalchemy import insert
+    from app import database, models, match_history
+
+    rng = random.Random(args.seed)
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+    # Player ids are assigned 1..users, so the tables must start empty
+    # (main() only gets here for a --database-url with --reset)
+    async with database.engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.drop_all)
+        await conn.run_sync(models.Base.metadata.create_all)
+        await conn.execute(insert(models.User), [
+            {"username": f"user{i}", "email": f"user{i}@bench.test", "hashed_password": "x"}
+            for i in range(1, args.users + 1)
+        ])
+
+    for offset in range(0, args.matches, args.chunk_size):
+        rows = []
+        for n in range(offset, min(offset + args.chunk_size, args.matches)):
+            p1 = 1 if rng.random() < args.hot_share else rng.randint(2, args.users)
+            p2 = rng.randint(2, args.users)
+            while p2 == p1:
+                p2 = rng.randint(2, args.users)
+            s1, s2 = rng.randint(0, 10) * 10, rng.randint(0, 10) * 10
+            rows.append({
+                "player1_id": p1, "player2_id": p2, "score1": s1, "score2": s2,
+                "winner_id": p1 if s1 > s2 else p2 if s2 > s1 else None,
+                # Several matches per second, like batched writer flushes
+                "played_at": start + timedelta(seconds=n // 4)
+            })
+        async with database.engine.begin() as conn:
+            await conn.execute(insert(models.Match), rows)
+        print(f"   ... {offset + len(rows):,} matches seeded")
+
+    async with database.SessionLocal() as session:
+        await match_history.rebuild_stats(session)
+        await session.commit()
+
+
+async def timed(fn, repeat: int):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = await fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return result, round(statistics.median(samples), 3)
+
+
+async def offset_page(user_id: int, limit: int, offset: int):
+    """What a naive endpoint would do: OR over both seats + OFFSET."""
+    from sqlalchemy import select, or_
+    from app import database, models
+
+    m = models.Match
+    async with database.SessionLocal() as session:
+        result = await session.execute(
+            select(m.id, m.played_at)
+            .where(or_(m.player1_id == user_id, m.player2_id == user_id))
+            .order_by(m.played_at.desc(), m.id.desc())
+            .offset(offset).limit(limit)
+        )
+        return result.all()
+
+
+async def scan_stats(user_id: int):
+    """Stats computed from the history on every request."""
+    from sqlalchemy import select, or_, func, case
+    from app import database, models
+
+    m = models.Match
+    async with database.SessionLocal() as session:
+        result = await session.execute(
+            select(
+                func.count(),
+                func.sum(case((m.winner_id == user_id, 1), else_=0)),
+                func.sum(case((m.winner_id.is_(None), 1), else_=0)),
+                func.avg(case((m.player1_id == user_id, m.score1), else_=m.score2))
+            ).where(or_(m.player1_id == user_id, m.player2_id == user_id))
+        )
+        return result.one()
+
+
+async def run(args):
+    from app import database, models, match_history
+
+    # Statement logging would dominate the timings
+    database.engine.echo = False
+
+    seed_started = time.perf_counter()
+    if not args.skip_seed:
+        await seed(args)
+    seed_seconds = time.perf_counter() - seed_started
+
+    hot = 1
+    async with database.SessionLocal() as session:
+        user = await session.get(models.User, hot)
+
+    # Walk `depth` pages with the cursor; the last one is what OFFSET has to reach
+    cursor, keyset_ms = None, []
+    for _ in range(args.depth):
+        started = time.perf_counter()
+        page = await match_history.get_history(hot, limit=args.limit, cursor=cursor)
+        keyset_ms.append((time.perf_counter() - started) * 1000)
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    depth = len(keyset_ms)
+    deep_offset = (depth - 1) * args.limit
+
+    _, offset_first_ms = await timed(lambda: offset_page(hot, args.limit, 0), args.repeat)
+    _, offset_deep_ms = await timed(lambda: offset_page(hot, args.limit, deep_offset), args.repeat)
+    stats, stats_ms = await timed(lambda: match_history.get_stats(user), args.repeat)
+    scanned, scan_ms = await timed(lambda: scan_stats(hot), args.repeat)
+
+    report = {
+        "database": os.environ["DATABASE_URL"].split(":")[0],
+        "matches": args.matches,
+        "users": args.users,
+        "seed_seconds": round(seed_seconds, 1),
+        "hot_player_games": stats["games"],
+        "history": {
+            "limit": args.limit,
+            "pages_walked": depth,
+            "keyset_first_page_ms": round(keyset_ms[0], 3),
+            "keyset_last_page_ms": round(keyset_ms[-1], 3),
+            "offset_first_page_ms": offset_first_ms,
+            "offset_same_depth_ms": offset_deep_ms
+        },
+        "stats": {
+            "user_stats_row_ms": stats_ms,
+            "full_scan_ms": scan_ms,
+            "agree": stats["games"] == scanned[0] and stats["wins"] == (scanned[1] or 0)
+        }
+    }
+    print(json.dumps(report, indent=2))
+    if not report["stats"]["agree"]:
+        sys.exit("❌ user_stats disagrees with the match history")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--matches", type=int, default=2_000_000)
+    parser.add_argument("--users", type=int, default=20_000)
+    parser.add_argument("--hot-share", type=float, default=0.05, help="Share of matches the measured player is in")
+    parser.add_argument("--chunk-size", type=int, default=50_000)
+    parser.add_argument("--limit", type=int, default=20, help="History page size")
+    parser.add_argument("--depth", type=int, default=200, help="History pages to walk with the cursor")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--database-url", help="Benchmark against an existing database instead of SQLite")
+    parser.add_argument("--skip-seed", action="store_true", help="Reuse what's already in --database-url")
+    parser.add_argument("--reset", action="store_true",
+                        help="Allow seeding --database-url: drops and recreates every table in it")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    if args.database_url and not (args.reset or args.skip_seed):
+        parser.error("seeding wipes --database-url: pass --reset to allow it, or --skip-seed to reuse its data")
+
+    configure_env(args)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
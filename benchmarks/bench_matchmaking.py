@@ -0,0 +1,128 @@
+"""
+Matchmaking benchmark: pairing throughput and average wait time.
+
+Runs the real matchmaker Lua script against fakeredis by default
+(pip install fakeredis lupa), or a real server with --redis-url.
+
+    python -m benchmarks.bench_matchmaking --queue-size 20000
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("REDIS_URL", "redis://localhost:6379/0")
+
+import redis.asyncio as redis_asyncio
+from app import matchmaker
+
+
+def use_redis(url: str | None):
+    """Points the matchmaker at a real server or an in-process fakeredis."""
+    if url:
+        pool = redis_asyncio.ConnectionPool.from_url(url, decode_responses=True)
+    else:
+        import fakeredis
+        pool = fakeredis.FakeAsyncRedis(decode_responses=True).connection_pool
+    matchmaker.get_redis_client = lambda: redis_asyncio.Redis(connection_pool=pool)
+    return matchmaker.get_redis_client()
+
+
+async def bench_throughput(redis, queue_size: int, calls: int):
+    """Enqueue `calls` players into a queue already holding `queue_size` players."""
+    await redis.delete(matchmaker.QUEUE_KEY, matchmaker.JOINED_KEY)
+    now = time.time()
+    async with redis.pipeline(transaction=False) as pipe:
+        for i in range(queue_size):
+            # Spread far apart so the backlog itself doesn't pair off
+            pipe.zadd(matchmaker.QUEUE_KEY, {f"idle{i}": i * 10_000})
+            pipe.zadd(matchmaker.JOINED_KEY, {f"idle{i}": now})
+        await pipe.execute()
+
+    pairs = 0
+    start = time.perf_counter()
+    for i in range(calls):
+        # Two players per rating so every second call forms a game
+        matches = await matchmaker.pair_players(f"p{i}", rating=-1_000_000 - (i // 2) * 10_000, now=now)
+        pairs += len(matches)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "queue_size": queue_size,
+        "calls": calls,
+        "pairs": pairs,
+        "calls_per_sec": round(calls / elapsed, 1),
+        "pairs_per_sec": round(pairs / elapsed, 1),
+        "avg_call_ms": round(elapsed / calls * 1000, 3)
+    }
+
+
+async def bench_wait_time(redis, arrivals_per_sec: float, duration: float, tick: float, seed: int):
+    """Simulated clock: Poisson arrivals with normally distributed ratings."""
+    await redis.delete(matchmaker.QUEUE_KEY, matchmaker.JOINED_KEY)
+    rng = random.Random(seed)
+    ratings = {}
+    arrived = {}
+    waits = []
+    gaps = []
+
+    def record(matches, now):
+        for match in matches:
+            p1, p2 = match["players"]
+            waits.extend([now - arrived[p1], now - arrived[p2]])
+            gaps.append(abs(ratings[p1] - ratings[p2]))
+
+    now = 0.0
+    next_arrival = rng.expovariate(arrivals_per_sec)
+    player_id = 0
+    while now < duration:
+        while next_arrival <= now + tick:
+            name = f"sim{player_id}"
+            player_id += 1
+            ratings[name] = round(rng.gauss(1000, 200))
+            arrived[name] = next_arrival
+            record(await matchmaker.pair_players(name, ratings[name], now=next_arrival), next_arrival)
+            next_arrival += rng.expovariate(arrivals_per_sec)
+        now += tick
+        # Background sweeper
+        record(await matchmaker.pair_players(now=now), now)
+
+    waits.sort()
+    return {
+        "arrivals": player_id,
+        "matched_players": len(waits),
+        "still_waiting": await redis.zcard(matchmaker.QUEUE_KEY),
+        "avg_wait_s": round(statistics.fmean(waits), 3) if waits else None,
+        "p95_wait_s": round(waits[int(len(waits) * 0.95) - 1], 3) if waits else None,
+        "avg_rating_gap": round(statistics.fmean(gaps), 1) if gaps else None
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--redis-url", help="Use a real Redis instead of fakeredis")
+    parser.add_argument("--queue-size", type=int, default=20000)
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--arrivals-per-sec", type=float, default=20)
+    parser.add_argument("--duration", type=float, default=120)
+    parser.add_argument("--tick", type=float, default=matchmaker.SWEEP_INTERVAL_SECONDS)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    redis = use_redis(args.redis_url)
+    report = {
+        "backend": "redis" if args.redis_url else "fakeredis",
+        "throughput": await bench_throughput(redis, args.queue_size, args.calls),
+        "wait_time": await bench_wait_time(redis, args.arrivals_per_sec, args.duration, args.tick, args.seed)
+    }
+    await redis.delete(matchmaker.QUEUE_KEY, matchmaker.JOINED_KEY)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
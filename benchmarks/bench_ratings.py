@@ -0,0 +1,90 @@
+"""
+Rating engine benchmark + parity check.
+
+Replays a synthetic match history with the vectorized RatingEngine and with
+the scalar reference (one elo_update per match) and fails if they disagree.
+Runs twice: a wide history (many players, large rounds) and a skewed one
+(few players with many games each, where rounds are tiny).
+
+    python -m benchmarks.bench_ratings --matches 1000000 --users 50000 --skewed-users 500
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from app.rating_engine import RatingEngine, replay_scalar
+
+
+def synthetic_history(matches: int, users: int, seed: int):
+    rng = np.random.default_rng(seed)
+    p1 = rng.integers(1, users + 1, size=matches)
+    # Shift by 1..users-1 so nobody plays themselves
+    p2 = (p1 - 1 + rng.integers(1, users, size=matches)) % users + 1
+    s1 = rng.integers(0, 11, size=matches) * 10
+    s2 = rng.integers(0, 11, size=matches) * 10
+    return p1, p2, s1, s2
+
+
+def run_case(args, matches: int, users: int) -> dict:
+    p1, p2, s1, s2 = synthetic_history(matches, users, args.seed)
+
+    # 1. Vectorized engine over the full history
+    engine = RatingEngine(users)
+    start = time.perf_counter()
+    for i in range(0, matches, args.chunk_size):
+        j = i + args.chunk_size
+        engine.apply_chunk(p1[i:j], p2[i:j], s1[i:j], s2[i:j])
+    vector_seconds = time.perf_counter() - start
+
+    # 2. Scalar reference on a prefix, compared against a fresh engine on the same prefix
+    n = min(args.parity_matches, matches)
+    prefix = list(zip(p1[:n].tolist(), p2[:n].tolist(), s1[:n].tolist(), s2[:n].tolist()))
+    start = time.perf_counter()
+    reference = replay_scalar(prefix)
+    scalar_seconds = time.perf_counter() - start
+
+    check = RatingEngine(users)
+    for i in range(0, n, args.chunk_size):
+        j = min(i + args.chunk_size, n)
+        check.apply_chunk(p1[i:j], p2[i:j], s1[i:j], s2[i:j])
+    ids = np.fromiter(reference.keys(), dtype=np.int64)
+    expected = np.fromiter(reference.values(), dtype=np.float64)
+    max_diff = float(np.max(np.abs(check.ratings[ids] - expected))) if len(ids) else 0.0
+
+    return {
+        "matches": matches,
+        "users": users,
+        "vectorized_matches_per_sec": round(matches / vector_seconds),
+        "scalar_matches_per_sec": round(n / scalar_seconds),
+        "parity": {"matches": n, "max_abs_diff": max_diff, "ok": max_diff < 1e-6}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--matches", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=50_000)
+    parser.add_argument("--skewed-matches", type=int, default=500_000)
+    parser.add_argument("--skewed-users", type=int, default=500)
+    parser.add_argument("--chunk-size", type=int, default=50_000)
+    parser.add_argument("--parity-matches", type=int, default=200_000,
+                        help="How much of each history the (slow) scalar reference replays")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    report = {
+        "wide": run_case(args, args.matches, args.users),
+        "skewed": run_case(args, args.skewed_matches, args.skewed_users)
+    }
+    print(json.dumps(report, indent=2))
+    if not all(case["parity"]["ok"] for case in report.values()):
+        sys.exit("❌ Vectorized ratings diverge from the scalar reference")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""
+Worker cold-start and per-query overhead benchmark.
+
+Every run boots a fresh Python process (a real cold start: imports, engine,
+lifespan) under two profiles:
+
+  * legacy:     SQL echo on, create_all on every boot, no pool warm-up
+  * production: the defaults (echo off, schema created once, warmed pool)
+
+and reports, per profile, import time, lifespan startup time, the latency of
+the first query after startup and the steady per-query cost of a rating
+lookup (session + pool checkout + one SELECT) next to a bare SELECT 1.
+
+    python -m benchmarks.bench_startup --runs 5
+    python -m benchmarks.bench_startup --database-url postgresql+asyncpg://... --redis-url redis://...
+
+Uses fakeredis and a throwaway SQLite database unless URLs are given. A
+--database-url keeps its question bank unless --reset is passed.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PROFILES = {
+    "legacy": {"DB_ECHO": "true", "DB_CREATE_ALL": "true", "DB_WARM_CONNECTIONS": "0"},
+    "production": {"DB_ECHO": "false", "DB_CREATE_ALL": "false"}
+}
+
+
+def configure_env(args, db_path: str):
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite+aiosqlite:///{db_path}"
+    os.environ["REDIS_URL"] = args.redis_url or "redis://localhost:6379/0"
+    os.environ.setdefault("SECRET_KEY", "bench")
+    os.environ.setdefault("ALGORITHM", "HS256")
+    os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "60")
+    # The background consumer would compete with the measured queries
+    os.environ.setdefault("EVENT_CONSUMER_ENABLED", "false")
+
+
+async def seed(args):
+    """
+    Schema + a small question bank and user table, done once before the measured boots.
+    The throwaway SQLite database (or --reset) gets a fresh bank; a --database-url
+    keeps its questions and only gets them seeded if the bank is empty.
+    """
+    from sqlalchemy import insert, delete, select, func
+    from app import database, models
+
+    reset = args.reset or not args.database_url
+    usernames = [f"boot{i}" for i in range(100)]
+    async with database.engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.create_all)
+        if reset:
+            await conn.execute(delete(models.Question))
+            await conn.execute(delete(models.User).where(models.User.email.like("%@startup.test")))
+
+        if reset or not await conn.scalar(select(func.count()).select_from(models.Question)):
+            await conn.execute(insert(models.Question), [
+                {
+                    "title": f"Startup question {i}",
+                    "option_a": "a", "option_b": "b", "option_c": "c", "option_d": "d",
+                    "correct_option": "ABCD"[i % 4],
+                    "category": ["Complexity", "Debugging", "Concepts"][i % 3]
+                }
+                for i in range(args.questions)
+            ])
+
+        result = await conn.execute(select(models.User.username).where(models.User.username.in_(usernames)))
+        existing = set(result.scalars().all())
+        missing = [name for name in usernames if name not in existing]
+        if missing:
+            await conn.execute(insert(models.User), [
+                {"username": name, "email": f"{name}@startup.test", "hashed_password": "x"}
+                for name in missing
+            ])
+    await database.engine.dispose()
+
+
+# --- CHILD: one cold boot, measured from the first import ---
+async def child_run(args, import_seconds: float):
+    from sqlalchemy import text
+    from app import database, game_utils, redis_client
+    from app.main import app
+
+    if not args.redis_url:
+        import fakeredis
+        redis_client.pool = fakeredis.FakeAsyncRedis(decode_responses=True).connection_pool
+
+    started = time.perf_counter()
+    async with app.router.lifespan_context(app):
+        startup_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        await game_utils.get_user_rating("boot0")
+        first_query_ms = (time.perf_counter() - started) * 1000
+
+        # Per-query overhead: what a handler pays (session + checkout + query) vs the query alone
+        lookup_ms = []
+        for i in range(args.queries):
+            started = time.perf_counter()
+            await game_utils.get_user_rating(f"boot{i % 100}")
+            lookup_ms.append((time.perf_counter() - started) * 1000)
+
+        select_ms = []
+        async with database.engine.connect() as conn:
+            for _ in range(args.queries):
+                started = time.perf_counter()
+                await conn.execute(text("SELECT 1"))
+                select_ms.append((time.perf_counter() - started) * 1000)
+
+    return {
+        "import_s": round(import_seconds, 3),
+        "startup_s": round(startup_seconds, 3),
+        "first_query_ms": round(first_query_ms, 3),
+        "rating_lookup_ms": round(statistics.median(lookup_ms), 3),
+        "select_1_ms": round(statistics.median(select_ms), 3)
+    }
+
+
+def child_main(args):
+    started = time.perf_counter()
+    import app.main  # noqa: F401  the import itself is part of the cold start
+    import_seconds = time.perf_counter() - started
+    result = asyncio.run(child_run(args, import_seconds))
+    # SQL echo goes to stdout too; the parent reads the last line
+    print("\n" + json.dumps(result))
+
+
+# --- PARENT ---
+def boot(args, profile: str) -> dict:
+    env = dict(os.environ, **PROFILES[profile])
+    command = [sys.executable, "-m", "benchmarks.bench_startup", "--child", "--queries", str(args.queries)]
+    if args.redis_url:
+        command += ["--redis-url", args.redis_url]
+    output = subprocess.run(command, cwd=ROOT, env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def summarize(runs: list[dict]) -> dict:
+    return {name: round(statistics.median(run[name] for run in runs), 3) for name in runs[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Cold boots per profile")
+    parser.add_argument("--queries", type=int, default=500, help="Queries timed per boot")
+    parser.add_argument("--questions", type=int, default=500, help="Questions seeded into the bank")
+    parser.add_argument("--redis-url", help="Use a real Redis instead of fakeredis")
+    parser.add_argument("--database-url", help="Use a real database instead of SQLite")
+    parser.add_argument("--reset", action="store_true",
+                        help="Replace the question bank in --database-url with the synthetic one")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        # Environment (URLs, profile) was set by the parent
+        child_main(args)
+        return
+
+    configure_env(args, os.path.join(tempfile.mkdtemp(prefix="codeclash-startup-"), "startup.db"))
+    asyncio.run(seed(args))
+
+    report = {"database": os.environ["DATABASE_URL"].split(":")[0], "runs": args.runs, "profiles": {}}
+    for profile in PROFILES:
+        runs = [boot(args, profile) for _ in range(args.runs)]
+        report["profiles"][profile] = summarize(runs)
+        print(f"   ... {profile}: {args.runs} boots", file=sys.stderr)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+"""
+Local load test: N simulated players against the real FastAPI app.
+
+The app runs in-process (uvicorn, own thread + event loop) against local
+stand-ins: fakeredis unless --redis-url is given, and a throwaway SQLite
+database (aiosqlite) unless --database-url is given. Every client walks the
+full game: connect to /ws/matchmaking/{username} with a token, wait for GAME_START, send
+10 SUBMIT_ANSWERs (waiting for each ANSWER_RESULT) and FINISH_GAME.
+
+    pip install fakeredis lupa aiosqlite websockets
+    python -m benchmarks.load_test --clients 1000 --output run.json
+
+The report is JSON so runs can be diffed across versions.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def configure_env(args):
+    """Must run before `app` is imported: its modules read config at import time."""
+    db_path = os.path.join(tempfile.mkdtemp(prefix="codeclash-load-"), "load.db")
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite+aiosqlite:///{db_path}"
+    os.environ["REDIS_URL"] = args.redis_url or "redis://localhost:6379/0"
+    os.environ.setdefault("SECRET_KEY", "load-test")
+    os.environ.setdefault("ALGORITHM", "HS256")
+    os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "60")
+    # Every simulated client connects from 127.0.0.1
+    os.environ.setdefault("RATE_LIMIT_WS_CONNECT_IP_PER_SECOND", "100000")
+    os.environ.setdefault("RATE_LIMIT_WS_CONNECT_IP_BURST", "100000")
+    # SQLite runs one query at a time, so a connect burst waits far longer for it than for Postgres
+    os.environ.setdefault("DB_ADMISSION_TIMEOUT_SECONDS", "5")
+    # Analytics loading competes with the game path for the one SQLite connection
+    os.environ.setdefault("EVENT_CONSUMER_ENABLED", "false")
+
+
+def percentiles(samples: list[float]):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+
+    def pick(q):
+        return round(ordered[min(int(len(ordered) * q), len(ordered) - 1)], 3)
+
+    return {
+        "count": len(ordered),
+        "avg": round(statistics.fmean(ordered), 3),
+        "p50": pick(0.50),
+        "p95": pick(0.95),
+        "p99": pick(0.99),
+        "max": round(ordered[-1], 3)
+    }
+
+
+def git_version():
+    try:
+        return subprocess.check_output(
+            ["git", "describe", "--always", "--dirty"], cwd=ROOT, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+# --- SERVER SIDE (runs in its own thread / event loop) ---
+class ServerThread(threading.Thread):
+    def __init__(self, args, usernames: list[str]):
+        super().__init__(daemon=True)
+        self.args = args
+        self.usernames = usernames
+        self.ready = threading.Event()
+        self.lag_ms: list[float] = []
+        self.error = None
+        self.server = None
+        self.loop = None
+
+    async def seed(self):
+        """
+        The throwaway SQLite database (or --reset) starts from empty tables. A
+        --database-url is never wiped: only missing bot users are added, and
+        questions only if the bank is empty.
+        """
+        from sqlalchemy import insert, select, func
+        from app import database, models
+
+        reset = self.args.reset or not self.args.database_url
+        async with database.engine.begin() as conn:
+            if reset:
+                await conn.run_sync(models.Base.metadata.drop_all)
+            await conn.run_sync(models.Base.metadata.create_all)
+
+            if reset or not await conn.scalar(select(func.count()).select_from(models.Question)):
+                await conn.execute(insert(models.Question), [
+                    {
+                        "title": f"Load test question {i}",
+                        "option_a": "a", "option_b": "b", "option_c": "c", "option_d": "d",
+                        "correct_option": "ABCD"[i % 4],
+                        "category": ["Complexity", "Debugging", "Concepts"][i % 3]
+                    }
+                    for i in range(self.args.questions)
+                ])
+
+            result = await conn.execute(
+                select(models.User.username).where(models.User.username.in_(self.usernames))
+            )
+            existing = set(result.scalars().all())
+            missing = [name for name in self.usernames if name not in existing]
+            if missing:
+                await conn.execute(insert(models.User), [
+                    {"username": name, "email": f"{name}@load.test", "hashed_password": "x"}
+                    for name in missing
+                ])
+
+    async def measure_lag(self):
+        tick = 0.01
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(tick)
+            self.lag_ms.append((time.perf_counter() - start - tick) * 1000)
+
+    async def serve(self):
+        import uvicorn
+        from app import database, redis_client
+
+        # SQL echo would turn this into a logging benchmark
+        database.engine.echo = False
+        if not self.args.redis_url:
+            import fakeredis
+            redis_client.pool = fakeredis.FakeAsyncRedis(decode_responses=True).connection_pool
+
+        await self.seed()
+
+        from app.main import app
+        config = uvicorn.Config(app, host="127.0.0.1", port=self.args.port, log_level="warning", ws_max_queue=1024)
+        self.server = uvicorn.Server(config)
+        serve_task = asyncio.create_task(self.server.serve())
+        while not self.server.started:
+            if serve_task.done():
+                await serve_task
+            await asyncio.sleep(0.05)
+
+        lag_task = asyncio.create_task(self.measure_lag())
+        self.ready.set()
+        await serve_task
+        lag_task.cancel()
+
+    def run(self):
+        try:
+            asyncio.run(self.serve())
+        except BaseException as e:
+            self.error = e
+            self.ready.set()
+
+    def stop(self):
+        if self.server:
+            self.server.should_exit = True
+
+
+# --- CLIENT SIDE ---
+class Stats:
+    def __init__(self):
+        self.match_formation_ms = []
+        self.answer_rtt_ms = []
+        self.messages = 0
+        self.completed = 0
+        self.errors = []
+
+
+async def play(url: str, username: str, stats: Stats, timeout: float):
+    import websockets
+
+    inbox: dict[str, asyncio.Queue] = {}
+
+    def queue(kind):
+        return inbox.setdefault(kind, asyncio.Queue())
+
+    async def expect(kind):
+        return await asyncio.wait_for(queue(kind).get(), timeout)
+
+    async def send(ws, message):
+        stats.messages += 1
+        await ws.send(json.dumps(message))
+
+    connected_at = time.perf_counter()
+    from app import auth
+    token = auth.create_access_token({"sub": username})
+    async with websockets.connect(f"{url}/ws/matchmaking/{username}?token={token}", max_size=None) as ws:
+        async def reader():
+            async for raw in ws:
+                stats.messages += 1
+                message = json.loads(raw)
+                if message.get("type") == "PING":
+                    await send(ws, {"type": "PONG"})
+                    continue
+                queue(message.get("type")).put_nowait(message)
+
+        reader_task = asyncio.create_task(reader())
+        try:
+            game = await expect("GAME_START")
+            stats.match_formation_ms.append((time.perf_counter() - connected_at) * 1000)
+
+            for question in game["questions"]:
+                sent_at = time.perf_counter()
+                await send(ws, {
+                    "type": "SUBMIT_ANSWER",
+                    "game_id": game["game_id"],
+                    "q_id": question["id"],
+                    "answer": random.choice("ABCD"),
+                    "opponent": game["opponent"]
+                })
+                await expect("ANSWER_RESULT")
+                stats.answer_rtt_ms.append((time.perf_counter() - sent_at) * 1000)
+
+            await send(ws, {"type": "FINISH_GAME", "game_id": game["game_id"]})
+            await expect("GAME_OVER_ACK")
+            stats.completed += 1
+        finally:
+            reader_task.cancel()
+
+
+async def run_clients(args, usernames: list[str], stats: Stats):
+    url = f"ws://127.0.0.1:{args.port}"
+    semaphore = asyncio.Semaphore(args.max_connections)
+
+    async def one(i, username):
+        # Spread arrivals over the ramp so the queue sees a realistic burst shape
+        await asyncio.sleep(args.ramp * i / max(len(usernames), 1))
+        async with semaphore:
+            try:
+                await play(url, username, stats, args.timeout)
+            except Exception as e:
+                stats.errors.append(f"{username}: {type(e).__name__}: {e}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one(i, name) for i, name in enumerate(usernames)])
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=200, help="Simulated players (rounded down to even)")
+    parser.add_argument("--ramp", type=float, default=5.0, help="Seconds over which clients arrive")
+    parser.add_argument("--max-connections", type=int, default=2000, help="Cap on simultaneously open sockets")
+    parser.add_argument("--questions", type=int, default=500, help="Questions seeded into the bank")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Per-message wait before a client gives up")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--redis-url", help="Use a real Redis instead of fakeredis")
+    parser.add_argument("--database-url", help="Use a real database (e.g. a local Postgres) instead of SQLite")
+    parser.add_argument("--reset", action="store_true",
+                        help="Drop and recreate every table in --database-url before seeding")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    configure_env(args)
+    random.seed(args.seed)
+    usernames = [f"bot{i}" for i in range(args.clients - args.clients % 2)]
+
+    server = ServerThread(args, usernames)
+    server.start()
+    server.ready.wait()
+    if server.error:
+        raise server.error
+
+    stats = Stats()
+    try:
+        elapsed = asyncio.run(run_clients(args, usernames, stats))
+    finally:
+        server.stop()
+        server.join(timeout=30)
+
+    report = {
+        "version": git_version(),
+        "config": {
+            "clients": len(usernames),
+            "ramp_s": args.ramp,
+            "redis": "redis" if args.redis_url else "fakeredis",
+            "database": os.environ["DATABASE_URL"].split(":")[0]
+        },
+        "duration_s": round(elapsed, 3),
+        "games_completed": stats.completed // 2,
+        "clients_completed": stats.completed,
+        "errors": len(stats.errors),
+        "error_samples": stats.errors[:5],
+        "messages": stats.messages,
+        "messages_per_sec": round(stats.messages / elapsed, 1) if elapsed else None,
+        "match_formation_ms": percentiles(stats.match_formation_ms),
+        "answer_rtt_ms": percentiles(stats.answer_rtt_ms),
+        "server_loop_lag_ms": percentiles(server.lag_ms)
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
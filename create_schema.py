@@ -0,0 +1,59 @@
+"""
+Creates the database schema: every table, plus any column or index missing
+on an existing one.
+
+    python create_schema.py
+
+Run it once per deploy, before starting the workers; they no longer run
+create_all on boot (set DB_CREATE_ALL=true to bring that back in dev).
+Safe to re-run: existing tables, columns and indexes are left alone.
+"""
+import asyncio
+import time
+from sqlalchemy import inspect, text
+
+from app import models  # noqa: F401  registers every table on Base.metadata
+from app.database import engine, Base
+
+# Columns added to a table after it first shipped: (table, column, SQL type).
+# create_all never alters an existing table, so these are added here.
+ADDED_COLUMNS = [
+    ("questions", "content_hash", "VARCHAR(64)")
+]
+
+
+def add_missing_columns(sync_conn) -> list[str]:
+    inspector = inspect(sync_conn)
+    added = []
+    for table, column, sql_type in ADDED_COLUMNS:
+        if column not in {c["name"] for c in inspector.get_columns(table)}:
+            sync_conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {sql_type}"))
+            added.append(f"{table}.{column}")
+    return added
+
+
+async def ensure_schema(conn) -> list[str]:
+    """Tables, then missing columns, then missing indexes (some index the new columns)."""
+    await conn.run_sync(Base.metadata.create_all)
+    added = await conn.run_sync(add_missing_columns)
+    # create_all only creates indexes together with a new table
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            await conn.run_sync(lambda sync_conn, index=index: index.create(sync_conn, checkfirst=True))
+    return added
+
+
+async def create_schema():
+    started = time.perf_counter()
+    async with engine.begin() as conn:
+        added = await ensure_schema(conn)
+    await engine.dispose()
+
+    for column in added:
+        print(f"➕ Added column {column}")
+    print(f"✅ Schema ready: {len(Base.metadata.tables)} tables ({time.perf_counter() - started:.1f}s)")
+
+
+if __name__ == "__main__":
+    print("🚀 Creating database schema...")
+    asyncio.run(create_schema())
@@ -0,0 +1,84 @@
+"""
+Rebuilds every User.rating by replaying the whole `matches` history.
+
+    python recompute_ratings.py                 # replay with ELO_K_FACTOR
+    python recompute_ratings.py --k 24 --dry-run
+
+Matches are streamed in (played_at, id) order in chunks and rated with the
+vectorized RatingEngine; results are written back with bulk UPDATEs and the
+Redis leaderboard is rebuilt.
+"""
+import argparse
+import asyncio
+import time
+from sqlalchemy import select, update, func
+
+from app import leaderboard
+from app.database import SessionLocal
+from app.models import User, Match
+from app.rating import DEFAULT_RATING, ELO_K_FACTOR
+from app.rating_engine import RatingEngine
+
+
+async def recompute(args):
+    started = time.perf_counter()
+
+    async with SessionLocal() as session:
+        max_user_id = (await session.execute(select(func.max(User.id)))).scalar() or 0
+        user_ids = (await session.execute(select(User.id))).scalars().all()
+
+    engine = RatingEngine(max_user_id, k=args.k, initial=args.initial)
+
+    # 1. Stream the history (server-side cursor) and rate it chunk by chunk
+    compute_seconds = 0.0
+    async with SessionLocal() as session:
+        result = await session.stream(
+            select(Match.player1_id, Match.player2_id, Match.winner_id)
+            .order_by(Match.played_at, Match.id)
+            .execution_options(yield_per=args.chunk_size)
+        )
+        async for chunk in result.partitions(args.chunk_size):
+            p1, p2, winners = zip(*chunk)
+            # The stored winner is the result (it already accounts for forfeits);
+            # turn it into 1-0 / 0-1 / 0-0 "scores" for the engine
+            s1 = [1 if w is not None and w == a else 0 for a, w in zip(p1, winners)]
+            s2 = [1 if w is not None and w == b else 0 for b, w in zip(p2, winners)]
+            chunk_started = time.perf_counter()
+            engine.apply_chunk(p1, p2, s1, s2)
+            compute_seconds += time.perf_counter() - chunk_started
+            print(f"   ... {engine.matches} matches replayed")
+
+    # 2. Write back in bulk (users without matches go back to the initial rating)
+    ratings = engine.rounded()
+    rows = [{"id": uid, "rating": int(ratings[uid])} for uid in user_ids]
+    if not args.dry_run:
+        for i in range(0, len(rows), args.write_batch_size):
+            async with SessionLocal() as session:
+                await session.execute(update(User), rows[i:i + args.write_batch_size])
+                await session.commit()
+        # Every rating moved, so rebuild the board rather than patching it
+        if await leaderboard.rebuild() is None:
+            print("⏳ A leaderboard rebuild was already running; run `python -m app.leaderboard` once it ends")
+
+    total_seconds = time.perf_counter() - started
+    print(f"✅ Replayed {engine.matches} matches for {len(rows)} users"
+          f"{' (dry run, nothing written)' if args.dry_run else ''}")
+    print(f"   compute: {engine.matches / compute_seconds if compute_seconds else 0:,.0f} matches/sec")
+    print(f"   end-to-end: {engine.matches / total_seconds if total_seconds else 0:,.0f} matches/sec "
+          f"({total_seconds:.1f}s)")
+    return engine
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--k", type=float, default=ELO_K_FACTOR, help="K-factor to replay with")
+    parser.add_argument("--initial", type=float, default=DEFAULT_RATING, help="Starting rating")
+    parser.add_argument("--chunk-size", type=int, default=50_000)
+    parser.add_argument("--write-batch-size", type=int, default=5_000)
+    parser.add_argument("--dry-run", action="store_true", help="Compute and report, but don't write")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    print("🚀 Recomputing ratings from match history...")
+    asyncio.run(recompute(parse_args()))
@@ -1,56 +1,217 @@
+"""
+Streaming, idempotent question import.
+
+    python seed_from_hf.py                          # stream lmms-lab/CSBench_MCQ from the Hub
+    python seed_from_hf.py --file questions.jsonl   # offline: local JSONL ...
+    python seed_from_hf.py --file questions.parquet # ... or Parquet
+
+Rows are filtered lazily, inserted in multi-row batches and deduplicated on
+`questions.content_hash`, so a rerun never creates duplicates. Progress is
+checkpointed after every batch; a failed import resumes where it stopped.
+"""
+import argparse
 import asyncio
-from datasets import load_dataset
-from app.database import SessionLocal, engine, Base
+import hashlib
+import itertools
+import json
+import os
+from sqlalchemy import select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app.database import SessionLocal, engine
 from app.models import Question
-from sqlalchemy import text
+from app.question_sampler import bump_bank_version
+from create_schema import ensure_schema
 
-async def seed_from_csbench():
-    print("🚀 Connecting to Hugging Face Hub...")
-    
-    # FIX: Changed split from "test" to "mcq"
-    dataset = load_dataset("lmms-lab/CSBench_MCQ", split="mcq")
-    
-    print(f"📦 Found {len(dataset)} questions. Filtering and Writing to Database...")
+DEFAULT_DATASET = "lmms-lab/CSBench_MCQ"
+# FIX: Changed split from "test" to "mcq"
+DEFAULT_SPLIT = "mcq"
+DEFAULT_CHECKPOINT = ".seed_checkpoint.json"
+
+
+# --- 1. SOURCES (lazy iterators of raw rows) ---
+def iter_hub(dataset_name: str, split: str):
+    # Imported here so offline imports don't need `datasets` installed
+    from datasets import load_dataset
+    yield from load_dataset(dataset_name, split=split, streaming=True)
+
+
+def iter_jsonl(path: str):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_parquet(path: str, batch_size: int = 1024):
+    import pyarrow.parquet as pq
+    for record_batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size):
+        yield from record_batch.to_pylist()
+
+
+def open_source(args):
+    if not args.file:
+        return iter_hub(args.dataset, args.split), f"hub:{args.dataset}:{args.split}"
+    if args.file.endswith(".parquet"):
+        return iter_parquet(args.file), f"file:{os.path.abspath(args.file)}"
+    return iter_jsonl(args.file), f"file:{os.path.abspath(args.file)}"
+
+
+# --- 2. FILTER + NORMALIZE ---
+def content_hash(title: str, a: str, b: str, c: str, d: str, answer: str) -> str:
+    parts = [str(p).strip() for p in (title, a, b, c, d, answer)]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+def clean_rows(raw_rows, start: int = 0):
+    """Yields (raw_index, question dict) for every usable row."""
+    for index, row in enumerate(raw_rows, start=start):
+        # 1. Filter: Ensure it is in English
+        if row.get('Language') != 'English':
+            continue
+
+        # 2. Filter: Ensure we have a valid answer (A, B, C, or D)
+        answer = (row.get('Answer') or '').strip()
+        if answer not in ['A', 'B', 'C', 'D']:
+            continue
+
+        options = [str(row['A']), str(row['B']), str(row['C']), str(row['D'])]
+        yield index, {
+            "title": row['Question'],
+            "option_a": options[0],
+            "option_b": options[1],
+            "option_c": options[2],
+            "option_d": options[3],
+            "correct_option": answer,
+            "category": row['Domain'],
+            "content_hash": content_hash(row['Question'], *options, answer)
+        }
+
+
+def batched(iterable, size: int):
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+# --- 3. CHECKPOINTS ---
+def load_checkpoint(path: str, source: str) -> tuple[int, int]:
+    """(next row to read, questions the interrupted run(s) already inserted)"""
+    if not os.path.exists(path):
+        return 0, 0
+    with open(path) as f:
+        checkpoint = json.load(f)
+    # A checkpoint from a different source is meaningless here
+    if checkpoint.get("source") != source:
+        return 0, 0
+    return checkpoint.get("next_row", 0), checkpoint.get("inserted", 0)
 
-    # 1. Database Connection
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
 
+def save_checkpoint(path: str, source: str, next_row: int, inserted: int):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"source": source, "next_row": next_row, "inserted": inserted}, f)
+    os.replace(tmp_path, path)  # atomic: a crash never leaves a half-written checkpoint
+
+
+# --- 4. DATABASE ---
+def insert_ignoring_duplicates(rows: list[dict]):
+    """Multi-row INSERT ... ON CONFLICT (content_hash) DO NOTHING."""
+    dialect = postgresql if engine.dialect.name == "postgresql" else sqlite
+    return (
+        dialect.insert(Question)
+        .values(rows)
+        .on_conflict_do_nothing(index_elements=["content_hash"])
+        .returning(Question.id)
+    )
+
+
+async def backfill_hashes(batch_size: int):
+    """Hashes rows imported before content_hash existed, so they dedup too."""
     async with SessionLocal() as session:
-        # Optional: Uncomment to clear old data
-        # await session.execute(text("TRUNCATE TABLE questions RESTART IDENTITY"))
-        
-        count = 0
-        for row in dataset:
-            # 1. Filter: Ensure it is in English
-            if row.get('Language') != 'English':
-                continue
-            
-            # 2. Filter: Ensure we have a valid answer (A, B, C, or D)
-            answer = row.get('Answer', '').strip()
-            if answer not in ['A', 'B', 'C', 'D']:
-                continue
+        known = set((await session.execute(
+            select(Question.content_hash).where(Question.content_hash.is_not(None))
+        )).scalars())
+        result = await session.stream(
+            select(
+                Question.id, Question.title, Question.option_a, Question.option_b,
+                Question.option_c, Question.option_d, Question.correct_option
+            ).where(Question.content_hash.is_(None))
+        )
 
-            # 3. Create the Question Object
-            new_q = Question(
-                title=row['Question'],
-                option_a=str(row['A']),
-                option_b=str(row['B']),
-                option_c=str(row['C']),
-                option_d=str(row['D']),
-                correct_option=answer,
-                category=row['Domain'] 
+        updates = []
+        async for row in result:
+            digest = content_hash(
+                row.title, row.option_a, row.option_b, row.option_c, row.option_d, row.correct_option
             )
-            
-            session.add(new_q)
-            count += 1
-            
-            if count % 100 == 0:
-                await session.commit()
-                print(f"   ... Inserted {count} questions so far")
-        
-        await session.commit()
-        print(f"✅ SUCCESS! Imported {count} CS questions from CSBench.")
+            # Older duplicates keep a NULL hash instead of violating the unique index
+            if digest in known:
+                continue
+            known.add(digest)
+            updates.append({"id": row.id, "content_hash": digest})
+
+    for batch in batched(updates, batch_size):
+        async with SessionLocal() as session:
+            await session.execute(update(Question), batch)
+            await session.commit()
+    if updates:
+        print(f"   ... Backfilled content hashes for {len(updates)} existing questions")
+
+
+async def seed(args):
+    raw_rows, source = open_source(args)
+
+    if args.reset_checkpoint and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+    start, inserted_before = load_checkpoint(args.checkpoint, source)
+    if start:
+        print(f"⏩ Resuming {source} from row {start}")
+
+    async with engine.begin() as conn:
+        await ensure_schema(conn)
+    await backfill_hashes(args.batch_size)
+
+    inserted = 0
+    seen = 0
+    next_row = start
+    for batch in batched(clean_rows(itertools.islice(raw_rows, start, None), start), args.batch_size):
+        rows = [question for _, question in batch]
+        async with SessionLocal() as session:
+            result = await session.execute(insert_ignoring_duplicates(rows))
+            inserted += len(result.all())
+            await session.commit()
+
+        seen += len(rows)
+        next_row = batch[-1][0] + 1
+        save_checkpoint(args.checkpoint, source, next_row, inserted_before + inserted)
+        print(f"   ... {seen} rows processed, {inserted} new questions so far")
+
+    print(f"✅ SUCCESS! Imported {inserted} new CS questions ({seen - inserted} already present).")
+
+    # The whole source went through: next run starts from scratch (and dedups)
+    if os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+
+    # Tell every running worker to reload its question ids and decks (only if
+    # there is something new, counting what an interrupted run added before this resume)
+    if inserted or inserted_before:
+        version = await bump_bank_version()
+        print(f"🔄 Question bank version is now {version}")
+    else:
+        print("🔄 Question bank unchanged; workers keep their question ids and decks")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--file", help="Local .jsonl or .parquet file instead of the Hugging Face Hub")
+    parser.add_argument("--dataset", default=DEFAULT_DATASET)
+    parser.add_argument("--split", default=DEFAULT_SPLIT)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT)
+    parser.add_argument("--reset-checkpoint", action="store_true", help="Ignore any saved progress")
+    return parser.parse_args()
+
 
 if __name__ == "__main__":
-    asyncio.run(seed_from_csbench())
\ No newline at end of file
+    print("🚀 Starting streaming question import...")
+    asyncio.run(seed(parse_args()))
@@ -1,40 +1,195 @@
-import redis
+"""
+Redis keyspace inspector that is safe to point at production.
+
+Walks the keyspace with SCAN (never KEYS) and looks up TYPE / TTL /
+MEMORY USAGE in pipelined batches, throttled to --rate keys per second.
+Keys are grouped by prefix (`game:*`, `presence:*`, `matchmaking_queue`...)
+and the report shows counts, memory, keys without a TTL and the largest keys.
+
+    python spy_redis.py                      # whole keyspace, 2000 keys/s
+    python spy_redis.py --match 'game:*' --top 20
+    python spy_redis.py --rate 500 --no-memory --json > keyspace.json
+"""
+import argparse
+import heapq
+import json
 import os
+import sys
+import time
+from urllib.parse import urlparse
 from dotenv import load_dotenv
 
+import redis
+
 load_dotenv()
 
-# 1. Connect explicitly to the Cloud URL
-url = os.getenv("REDIS_URL")
-print(f"🕵️ Connecting to: {url.split('@')[1]}") # Hides password
-
-try:
-    # We use the synchronous Redis client for this simple script
-    r = redis.from_url(url, decode_responses=True)
-    
-    # 2. Ask for ALL keys
-    keys = r.keys("*")
-    
-    print(f"\n📦 Total Keys found: {len(keys)}")
-    print("-" * 30)
-    
-    if len(keys) == 0:
-        print("The database is EMPTY.")
-    else:
+
+def redact(url: str) -> str:
+    """Host/port/db only, never the password."""
+    parsed = urlparse(url)
+    return f"{parsed.scheme}://{parsed.hostname}:{parsed.port or 6379}{parsed.path}"
+
+
+def group_of(key: str, separator: str, depth: int) -> str:
+    """'game:game_a_b' -> 'game:*'; keys without the separator are their own group."""
+    parts = key.split(separator)
+    if len(parts) <= depth:
+        return key
+    return separator.join(parts[:depth]) + separator + "*"
+
+
+class Group:
+    __slots__ = ("keys", "memory", "no_ttl", "types")
+
+    def __init__(self):
+        self.keys = 0
+        self.memory = 0
+        self.no_ttl = 0
+        self.types: dict[str, int] = {}
+
+    def to_dict(self):
+        return {"keys": self.keys, "memory_bytes": self.memory, "no_ttl": self.no_ttl, "types": self.types}
+
+
+def scan_batches(r, match: str, count: int):
+    """Yields lists of keys, one SCAN page at a time (O(1) memory in the keyspace size)."""
+    cursor = 0
+    while True:
+        cursor, keys = r.scan(cursor=cursor, match=match, count=count)
+        if keys:
+            yield keys
+        if cursor == 0:
+            return
+
+
+def inspect(r, args):
+    groups: dict[str, Group] = {}
+    largest: list[tuple[int, str]] = []  # min-heap of (bytes, key)
+    no_ttl_examples: list[str] = []
+    use_memory = not args.no_memory
+    scanned = 0
+    started = time.monotonic()
+
+    for keys in scan_batches(r, args.match, args.count):
+        pipe = r.pipeline(transaction=False)
         for key in keys:
-            type_ = r.type(key)
-            print(f"🔑 [{type_}] {key}")
-            
-            # If it's a score or queue, show the value
-            if type_ == 'list':
-                print(f"   └── Value: {r.lrange(key, 0, -1)}")
-            elif type_ == 'hash':
-                print(f"   └── Value: {r.hgetall(key)}")
-            elif type_ == 'string':
-                print(f"   └── Value: {r.get(key)}")
-                
-    print("-" * 30)
-
-except Exception as e:
-    print("❌ Could not connect to Cloud!")
-    print(e)
\ No newline at end of file
+            pipe.type(key)
+            pipe.ttl(key)
+            if use_memory:
+                pipe.memory_usage(key, samples=args.memory_samples)
+        replies = pipe.execute(raise_on_error=False)
+        step = 3 if use_memory else 2
+
+        for i, key in enumerate(keys):
+            type_, ttl = replies[i * step], replies[i * step + 1]
+            if type_ == "none":
+                # Expired or deleted between SCAN and the lookup
+                continue
+            memory = replies[i * step + 2] if use_memory else 0
+            if isinstance(memory, Exception):
+                # e.g. a managed Redis that disables MEMORY; carry on without it
+                print(f"⚠️ MEMORY USAGE unavailable ({memory}); continuing without memory stats", file=sys.stderr)
+                use_memory, memory = False, 0
+            memory = memory or 0
+
+            group = groups.setdefault(group_of(key, args.separator, args.depth), Group())
+            group.keys += 1
+            group.memory += memory
+            group.types[type_] = group.types.get(type_, 0) + 1
+            if ttl == -1:
+                group.no_ttl += 1
+                if len(no_ttl_examples) < args.top:
+                    no_ttl_examples.append(key)
+
+            if use_memory:
+                if len(largest) < args.top:
+                    heapq.heappush(largest, (memory, key))
+                elif memory > largest[0][0]:
+                    heapq.heapreplace(largest, (memory, key))
+
+        scanned += len(keys)
+        if args.progress and scanned // 10_000 != (scanned - len(keys)) // 10_000:
+            print(f"   ... {scanned:,} keys scanned", file=sys.stderr)
+
+        # Rate limit: never get ahead of `rate` keys/s, so live traffic keeps priority
+        ahead = scanned / args.rate - (time.monotonic() - started)
+        if ahead > 0:
+            time.sleep(ahead)
+
+    return {
+        "scanned": scanned,
+        "seconds": round(time.monotonic() - started, 2),
+        "memory_stats": use_memory,
+        "groups": {name: g.to_dict() for name, g in sorted(groups.items(), key=lambda kv: (-kv[1].memory, -kv[1].keys))},
+        "largest_keys": [{"key": key, "memory_bytes": size} for size, key in sorted(largest, reverse=True)],
+        "no_ttl_examples": no_ttl_examples
+    }
+
+
+def human(n: int) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024:
+            return f"{n:.0f}{unit}" if unit == "B" else f"{n:.1f}{unit}"
+        n /= 1024
+    return f"{n:.1f}TB"
+
+
+def print_report(report: dict):
+    print(f"\n📦 {report['scanned']:,} keys scanned in {report['seconds']}s")
+    print("-" * 78)
+    print(f"{'GROUP':<32}{'KEYS':>10}{'MEMORY':>12}{'AVG':>10}{'NO TTL':>9}  TYPES")
+    for name, g in report["groups"].items():
+        avg = human(g["memory_bytes"] // g["keys"]) if report["memory_stats"] and g["keys"] else "-"
+        memory = human(g["memory_bytes"]) if report["memory_stats"] else "-"
+        types = ",".join(f"{t}:{n}" for t, n in g["types"].items())
+        print(f"{name[:31]:<32}{g['keys']:>10,}{memory:>12}{avg:>10}{g['no_ttl']:>9,}  {types}")
+    print("-" * 78)
+
+    if report["largest_keys"]:
+        print("\n🐘 Largest keys")
+        for entry in report["largest_keys"]:
+            print(f"   {human(entry['memory_bytes']):>10}  {entry['key']}")
+    if report["no_ttl_examples"]:
+        print("\n♾️ Keys without a TTL (examples)")
+        for key in report["no_ttl_examples"]:
+            print(f"   {key}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=os.getenv("REDIS_URL"), help="Defaults to $REDIS_URL")
+    parser.add_argument("--match", default="*", help="SCAN MATCH pattern")
+    parser.add_argument("--count", type=int, default=500, help="SCAN COUNT hint (also the pipeline batch size)")
+    parser.add_argument("--rate", type=float, default=2000, help="Max keys inspected per second")
+    parser.add_argument("--separator", default=":", help="Prefix separator for grouping")
+    parser.add_argument("--depth", type=int, default=1, help="Prefix segments to group by")
+    parser.add_argument("--top", type=int, default=10, help="How many largest / no-TTL keys to list")
+    parser.add_argument("--no-memory", action="store_true", help="Skip MEMORY USAGE (cheaper)")
+    parser.add_argument("--memory-samples", type=int, default=5, help="MEMORY USAGE SAMPLES for aggregates")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    parser.add_argument("--progress", action="store_true", help="Progress on stderr every 10k keys")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if not args.url:
+        sys.exit("❌ No Redis URL (set REDIS_URL or pass --url)")
+
+    print(f"🕵️ Connecting to: {redact(args.url)}", file=sys.stderr)
+    try:
+        r = redis.from_url(args.url, decode_responses=True)
+        r.ping()
+    except Exception as e:
+        print("❌ Could not connect!")
+        sys.exit(str(e))
+
+    report = inspect(r, args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
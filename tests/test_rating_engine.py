@@ -0,0 +1,72 @@
+"""
+RatingEngine must give the same ratings as replaying `elo_update` one match at a time.
+
+    python -m pytest tests
+"""
+import numpy as np
+import pytest
+
+from app import rating_engine
+from app.rating_engine import RatingEngine, replay_scalar
+
+
+def history(matches: int, users: int, seed: int = 7):
+    rng = np.random.default_rng(seed)
+    p1 = rng.integers(1, users + 1, size=matches)
+    p2 = (p1 - 1 + rng.integers(1, users, size=matches)) % users + 1
+    s1 = rng.integers(0, 11, size=matches) * 10
+    s2 = rng.integers(0, 11, size=matches) * 10
+    return p1, p2, s1, s2
+
+
+def assert_matches_scalar(p1, p2, s1, s2, chunk_size: int, max_user_id: int = 0):
+    engine = RatingEngine(max_user_id)
+    for i in range(0, len(p1), chunk_size):
+        j = i + chunk_size
+        engine.apply_chunk(p1[i:j], p2[i:j], s1[i:j], s2[i:j])
+
+    reference = replay_scalar(zip(np.asarray(p1).tolist(), np.asarray(p2).tolist(),
+                                  np.asarray(s1).tolist(), np.asarray(s2).tolist()))
+    ids = np.fromiter(reference.keys(), dtype=np.int64)
+    expected = np.fromiter(reference.values(), dtype=np.float64)
+    np.testing.assert_allclose(engine.ratings[ids], expected, rtol=0, atol=1e-6)
+    return engine
+
+
+@pytest.mark.parametrize("matches, users, chunk_size", [
+    (20_000, 5_000, 5_000),   # wide: many players, large rounds
+    (20_000, 50, 5_000),      # skewed: few players, many games each
+    (2_000, 2, 500),          # one long rematch chain
+    (1_000, 300, 7)           # chains crossing tiny chunks
+])
+def test_matches_scalar_replay(matches, users, chunk_size):
+    assert_matches_scalar(*history(matches, users), chunk_size=chunk_size, max_user_id=users)
+
+
+@pytest.mark.parametrize("min_round_size", [1, 10 ** 9])
+def test_round_and_sequential_paths_agree(monkeypatch, min_round_size):
+    # 1 forces every chunk through the rounds, 10**9 through the match-by-match path
+    monkeypatch.setattr(rating_engine, "MIN_ROUND_SIZE", min_round_size)
+    assert_matches_scalar(*history(5_000, 40), chunk_size=1_000, max_user_id=40)
+
+
+def test_self_matches_are_skipped_and_capacity_grows():
+    p1 = [1, 3, 3, 7, 2, 1]
+    p2 = [2, 3, 1, 1, 7, 2]
+    s1 = [50, 40, 0, 30, 30, 100]
+    s2 = [10, 40, 60, 30, 20, 0]
+    engine = assert_matches_scalar(p1, p2, s1, s2, chunk_size=3)
+    assert engine.matches == 5
+    assert engine.games[3] == 1
+
+
+def test_rounds_share_no_players():
+    p1, p2, _, _ = history(3_000, 100)
+    *links, _ = RatingEngine.link(p1, p2)
+    seen = np.zeros(len(p1), dtype=bool)
+    for idx in RatingEngine.rounds(*links):
+        players = np.concatenate([p1[idx], p2[idx]])
+        assert len(np.unique(players)) == len(players)
+        assert not seen[idx].any()
+        seen[idx] = True
+    assert seen.all()